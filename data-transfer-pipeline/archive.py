@@ -0,0 +1,141 @@
+"""The layout of the long term archive in the s3 bucket, and its manifest of files."""
+import json
+from collections.abc import Iterator
+from datetime import datetime
+from os import environ as ENV
+
+import pandas as pd
+from botocore.exceptions import ClientError
+
+
+ARCHIVE_PREFIX = "plant_recordings"
+MANIFEST_KEY = f"{ARCHIVE_PREFIX}/_manifest.json"
+PARTITION_COLUMNS = ["year", "month", "day", "bucket"]
+# The errors S3 returns when a conditional put loses a race with another writer.
+CONFLICT_CODES = ("PreconditionFailed", "412", "ConditionalRequestConflict", "409")
+
+
+def split_partitions(recordings: pd.DataFrame,
+                     plant_buckets: int = 0) -> Iterator[tuple[tuple, pd.DataFrame]]:
+    """
+    Yields the recordings for each partition they fall in, in the order they first appear,
+    keyed by (year, month, day, bucket). Plants are only split into buckets
+    (plant_id modulo plant_buckets) if plant_buckets is set, otherwise bucket is None.
+    """
+    taken = recordings["recording_taken"]
+    keys = [taken.dt.year, taken.dt.month, taken.dt.day]
+    if plant_buckets:
+        keys.append(recordings["plant_id"] % plant_buckets)
+
+    for partition, rows in recordings.groupby(keys, sort=False):
+        partition = tuple(int(value) for value in partition)
+        yield (partition if plant_buckets else (*partition, None)), rows
+
+
+def partition_path(partition: tuple) -> str:
+    """Returns the hive style path of a partition, e.g. year=2024/month=10/day=01."""
+    year, month, day, bucket = partition
+    path = f"{ARCHIVE_PREFIX}/year={year}/month={month:02d}/day={day:02d}"
+    return path if bucket is None else f"{path}/bucket={bucket}"
+
+
+def archive_key(partition: tuple, run_id: str) -> str:
+    """Returns the key of the file written by one run for one partition."""
+    return f"{partition_path(partition)}/recording-{run_id}.parquet"
+
+
+def compacted_key(year: int, month: int, bucket: int, run_id: str, index: int) -> str:
+    """Returns the key of one of the files a month is compacted into."""
+    path = f"{ARCHIVE_PREFIX}/year={year}/month={month:02d}"
+    path = path if bucket is None else f"{path}/bucket={bucket}"
+    return f"{path}/compacted-{run_id}-{index:03d}.parquet"
+
+
+def read_manifest_version(s3, bucket_name: str) -> tuple[dict, str]:
+    """Returns the manifest of archive files and its ETag, or an empty manifest
+    and None if there isn't one yet."""
+    try:
+        response = s3.get_object(Bucket=bucket_name, Key=MANIFEST_KEY)
+    except ClientError as err:
+        if err.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return {"files": []}, None
+        raise
+
+    return json.loads(response["Body"].read()), response.get("ETag")
+
+
+def read_manifest(s3, bucket_name: str) -> dict:
+    """Returns the manifest of archive files, or an empty one if there isn't one yet."""
+    return read_manifest_version(s3, bucket_name)[0]
+
+
+def write_manifest(s3, bucket_name: str, manifest: dict, if_match: str = None,
+                   create: bool = False) -> None:
+    """Replaces the manifest with a single put. With if_match, the put fails
+    if the manifest has changed since that ETag was read. With create, it fails
+    if a manifest has been written since there was none."""
+    conditions = {"IfMatch": if_match} if if_match else {}
+    if create:
+        conditions["IfNoneMatch"] = "*"
+    s3.put_object(Bucket=bucket_name, Key=MANIFEST_KEY,
+                  Body=json.dumps(manifest, indent=2).encode("utf-8"),
+                  ContentType="application/json", **conditions)
+
+
+def update_manifest(s3, bucket_name: str, files: list[dict]) -> dict:
+    """
+    Adds the files to the manifest with a conditional put, so a manifest swapped in by
+    a compaction meanwhile is never overwritten. If the manifest has changed since it
+    was read, it is read again and the files added again, up to
+    ARCHIVE_MANIFEST_ATTEMPTS (default 5) times. Returns the manifest written.
+    """
+    attempts = int(ENV.get("ARCHIVE_MANIFEST_ATTEMPTS", 5))
+    for attempt in range(1, attempts + 1):
+        manifest, etag = read_manifest_version(s3, bucket_name)
+        manifest = add_to_manifest(manifest, files)
+        try:
+            write_manifest(s3, bucket_name, manifest, if_match=etag, create=etag is None)
+            return manifest
+        except ClientError as err:
+            if err.response["Error"]["Code"] not in CONFLICT_CODES or attempt == attempts:
+                raise
+            print(f"Manifest changed while it was updated, retrying ({attempt}/{attempts}).")
+
+    return manifest
+
+
+def delete_keys(s3, bucket_name: str, keys: list[str]) -> None:
+    """Deletes the objects, up to 1000 per request."""
+    for start in range(0, len(keys), 1000):
+        s3.delete_objects(Bucket=bucket_name, Delete={
+            "Objects": [{"Key": key} for key in keys[start:start + 1000]], "Quiet": True})
+
+
+def add_to_manifest(manifest: dict, files: list[dict]) -> dict:
+    """Returns the manifest with the files added,
+    replacing any earlier entries for the same keys."""
+    keys = {file["key"] for file in files}
+    kept = [file for file in manifest["files"] if file["key"] not in keys]
+    return {**manifest, "files": sorted(kept + files, key=lambda file: file["key"])}
+
+
+def prune_files(manifest: dict, plant_id: int = None,
+                start: datetime = None, end: datetime = None) -> list[dict]:
+    """
+    Returns the manifest entries for the files that could hold recordings for the plant
+    taken between start and end, using the min and max of each file to skip the rest.
+    """
+    files = []
+    for file in manifest["files"]:
+        if start and datetime.fromisoformat(file["max_recording_taken"]) < start:
+            continue
+        if end and datetime.fromisoformat(file["min_recording_taken"]) >= end:
+            continue
+        if plant_id is not None and not file["min_plant_id"] <= plant_id <= file["max_plant_id"]:
+            continue
+        if (plant_id is not None and file.get("bucket") is not None
+                and plant_id % file["plant_buckets"] != file["bucket"]):
+            continue
+        files.append(file)
+
+    return files
@@ -0,0 +1,110 @@
+"""Checkpoints that let a transfer run resume after a crash without repeating any stage."""
+from collections.abc import Iterator
+from datetime import datetime
+from os import environ as ENV
+
+from dotenv import load_dotenv
+
+from extract import create_connection
+
+
+# The stages of a run in order. Each is recorded once its work is finished.
+STAGES = ["started", "archived", "averaged", "deleted"]
+
+
+def find_unfinished_runs(conn) -> list[dict]:
+    """Returns every run that didn't reach the last stage, oldest first."""
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+        SELECT run_id, cutoff_time, first_recording_id, last_recording_id, stage
+        FROM {ENV['SCHEMA_NAME']}.transfer_checkpoint
+        WHERE stage <> %s
+        ORDER BY cutoff_time, run_id
+        """, (STAGES[-1],))
+        return cursor.fetchall()
+
+
+def start_run(conn, cutoff_time: datetime) -> dict:
+    """
+    Pins the recordings a new run will transfer: those taken before the cutoff
+    within the range of recording ids that exist now. Recordings that arrive
+    later are left for the next run. Returns None if there is nothing to transfer.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+        SELECT MIN(recording_id) AS first_recording_id, MAX(recording_id) AS last_recording_id
+        FROM {ENV['SCHEMA_NAME']}.recording
+        WHERE recording_taken < %s
+        """, (cutoff_time,))
+        id_range = cursor.fetchone()
+
+        if id_range is None or id_range["first_recording_id"] is None:
+            return None
+
+        run = {"run_id": f"{cutoff_time:%Y%m%dT%H%M%S}-{id_range['first_recording_id']}",
+               "cutoff_time": cutoff_time, **id_range, "stage": STAGES[0]}
+        cursor.execute(f"""
+        INSERT INTO {ENV['SCHEMA_NAME']}.transfer_checkpoint
+            (run_id, cutoff_time, first_recording_id, last_recording_id, stage)
+        VALUES (%s, %s, %s, %s, %s)
+        """, (run["run_id"], cutoff_time, run["first_recording_id"],
+              run["last_recording_id"], run["stage"]))
+    conn.commit()
+
+    return run
+
+
+def set_stage(cursor, run_id: str, stage: str) -> None:
+    """Records that a run has finished a stage, as part of the cursor's transaction.
+    Raises a ValueError if the stage isn't one of STAGES."""
+    if stage not in STAGES:
+        raise ValueError(f"Unknown stage {stage!r}, expected one of {STAGES}.")
+
+    cursor.execute(f"""
+    UPDATE {ENV['SCHEMA_NAME']}.transfer_checkpoint
+    SET stage = %s, updated_at = SYSDATETIME()
+    WHERE run_id = %s
+    """, (stage, run_id))
+
+
+def mark_stage(run_id: str, stage: str) -> None:
+    """Records that a run has finished a stage.
+    Raises a ValueError if the stage isn't one of STAGES."""
+    if stage not in STAGES:
+        raise ValueError(f"Unknown stage {stage!r}, expected one of {STAGES}.")
+
+    conn = create_connection()
+    try:
+        with conn.cursor() as cursor:
+            set_stage(cursor, run_id, stage)
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"Run {run_id} {stage}.")
+
+
+def get_runs(cutoff_time: datetime) -> Iterator[dict]:
+    """
+    Yields the runs to carry out: every run left unfinished by a crash, oldest first,
+    then a new run for the recordings taken before the cutoff.
+    The new run is only started once the caller has finished the unfinished runs,
+    so its range of recording ids never overlaps one of theirs. If resuming one raises,
+    no new run is started.
+    """
+    load_dotenv()
+    conn = create_connection()
+    try:
+        unfinished = find_unfinished_runs(conn)
+    finally:
+        conn.close()
+
+    yield from unfinished
+
+    conn = create_connection()
+    try:
+        new_run = start_run(conn, cutoff_time)
+    finally:
+        conn.close()
+
+    if new_run:
+        yield new_run
@@ -1,123 +1,359 @@
 """A script to remove out of date data from the RDS."""
-from datetime import datetime, timedelta
+from datetime import datetime
 from os import environ as ENV
+from time import perf_counter, sleep
 
 import pandas as pd
 from dotenv import load_dotenv
 
-from extract import create_connection, extract_recordings
+from extract import create_connection
+from checkpoint import set_stage
+from stats import METRIC_PREFIXES, HISTOGRAM_COLUMNS, pooled_m2, calculate_histograms
 
 
-def delete_outdataed_recordings() -> None:
-    """Removes the recordings over 24 hours old from the RDS."""
+AVERAGE_STAGING_TABLE = "#plant_average_staging"
+HISTOGRAM_STAGING_TABLE = "#plant_histogram_staging"
+AVERAGE_COLUMNS = ["plant_id", "new_avg_temp", "new_avg_soil_moisture", "new_recordings",
+                   "new_temp_count", "new_soil_moisture_count", "new_temp_m2",
+                   "new_soil_moisture_m2", "new_min_temp", "new_max_temp",
+                   "new_min_soil_moisture", "new_max_soil_moisture"]
+
+
+def start_progress(label: str) -> dict:
+    """Returns the progress of a batched delete, before its first batch."""
+    return {"label": label, "batches": 0, "rows": 0, "seconds": 0.0, "started": perf_counter()}
+
+
+def print_progress(progress: dict) -> None:
+    """Prints how many recordings a batched delete has removed so far, and how quickly."""
+    progress["seconds"] = perf_counter() - progress["started"]
+    rate = progress["rows"] / progress["seconds"] if progress["seconds"] else 0
+    print(f"{progress['label']}: {progress['rows']} recordings deleted in "
+          f"{progress['batches']} batches ({progress['seconds']:.1f}s, {rate:.0f}/s).")
+
+
+def delete_batch(conn, cursor, query: str, params: tuple, progress: dict) -> int:
+    """
+    Runs one batch of a delete in its own transaction, so its locks are released
+    before the next batch, and records its progress. It then pauses for
+    DELETE_BATCH_PAUSE_SECONDS (default 0) to let the minute by minute inserts through.
+    Returns the number of recordings deleted.
+    """
+    cursor.execute(query, params)
+    conn.commit()
+    progress["batches"] += 1
+    progress["rows"] += max(cursor.rowcount, 0)
+
+    if progress["batches"] % int(ENV.get("DELETE_PROGRESS_BATCHES", 10)) == 0:
+        print_progress(progress)
+
+    pause = float(ENV.get("DELETE_BATCH_PAUSE_SECONDS", 0))
+    if pause:
+        sleep(pause)
+
+    return cursor.rowcount
+
+
+def delete_archived_recordings(cutoff_time: datetime, id_range: tuple[int, int],
+                               batch_size: int = None) -> dict:
+    """
+    Removes the recordings a run archived: those taken before its cutoff with ids in
+    its range. The range is walked in windows of batch_size ids (DELETE_BATCH_SIZE,
+    default 5000), so each batch is a seek on the primary key that never revisits
+    rows already deleted, and an interrupted delete can just be run again.
+    Returns the progress of the delete: the recordings and batches, and how long it took.
+    """
     load_dotenv()
+    batch_size = batch_size or int(ENV.get("DELETE_BATCH_SIZE", 5000))
     query = f"""
     DELETE FROM {ENV['SCHEMA_NAME']}.recording
-    WHERE recording_taken < %s
+    WHERE recording_id BETWEEN %s AND %s AND recording_taken < %s
     """
 
-    cutoff_time = datetime.now() - timedelta(days=1)
+    first_id, last_id = id_range
+    progress = start_progress("Archived recordings")
     conn = create_connection()
-    with conn.cursor() as cursor:
-        cursor.execute(query, (cutoff_time,))
-        conn.commit()
-    conn.close()
-    print("Old recordings deleted")
+    try:
+        with conn.cursor() as cursor:
+            for window_start in range(first_id, last_id + 1, batch_size):
+                window_end = min(window_start + batch_size - 1, last_id)
+                delete_batch(conn, cursor, query, (window_start, window_end, cutoff_time),
+                             progress)
+    finally:
+        conn.close()
+    print_progress(progress)
 
+    return progress
 
-def fetch_current_averages(conn, plant_id: int) -> dict:
+
+def delete_old_minute_rollups(cutoff_time: datetime, batch_size: int = None) -> dict:
+    """
+    Removes the per minute rollups from before the cutoff, batch_size at a time
+    (DELETE_BATCH_SIZE, default 5000). The dashboard only charts the last 24 hours
+    from them; the per hour rollups are kept.
+    Returns the progress of the delete: the rows and batches, and how long it took.
     """
-    Fetch the current average temperature, soil moisture, and recording count for a specific plant.
+    load_dotenv()
+    batch_size = batch_size or int(ENV.get("DELETE_BATCH_SIZE", 5000))
+    query = f"""
+    DELETE TOP (%s) FROM {ENV['SCHEMA_NAME']}.recording_minute
+    WHERE bucket_start < %s
     """
-    with conn.cursor() as cursor:
-        cursor.execute(f"""
-            SELECT average_temperature, average_soil_moisture, recording_count
-            FROM {ENV['SCHEMA_NAME']}.plant_average
-            WHERE plant_id = %s
-        """, (plant_id,))
-        data = cursor.fetchone()
 
-    return data
+    progress = start_progress("Minute rollups")
+    conn = create_connection()
+    try:
+        with conn.cursor() as cursor:
+            while delete_batch(conn, cursor, query, (batch_size, cutoff_time),
+                               progress) >= batch_size:
+                pass
+    finally:
+        conn.close()
+    print_progress(progress)
+
+    return progress
+
+
+def to_params(rows: pd.DataFrame) -> list[tuple]:
+    """Returns the rows as tuples of plain Python values, with missing values as None."""
+    values = rows.astype(object)
+    return list(values.where(values.notna(), None).itertuples(index=False, name=None))
+
+
+def stage_statement(table: str, columns: list[str], row_count: int) -> str:
+    """Returns a multi-row insert of row_count rows into a staging table."""
+    placeholders = ", ".join([f"({', '.join(['%s'] * len(columns))})"] * row_count)
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES {placeholders}"
+
+
+def stage_rows(cursor, table: str, columns: list[str], rows: list[tuple]) -> None:
+    """Inserts the rows into a staging table, 1000 at a time as
+    SQL Server allows at most 1000 rows in one VALUES clause."""
+    for start in range(0, len(rows), 1000):
+        batch = rows[start:start + 1000]
+        cursor.execute(stage_statement(table, columns, len(batch)),
+                       tuple(value for row in batch for value in row))
 
 
-def update_plant_average(conn, plant_id: int, avg_temp: float, avg_soil_moisture: float, recordings: int) -> None:
+def merge_m2(prefix: str) -> str:
+    """Returns the SQL that merges the sum of squared deviations for one metric (Chan et al.),
+    weighted by the number of readings of that metric."""
+    metric = METRIC_PREFIXES[prefix]
+    return f"""t.{metric}_m2 + COALESCE(s.new_{prefix}_m2, 0)
+            + COALESCE(SQUARE(s.new_avg_{prefix} - t.average_{metric})
+                       * CAST(t.{metric}_count AS FLOAT) * s.new_{prefix}_count
+                       / NULLIF(t.{metric}_count + s.new_{prefix}_count, 0), 0)"""
+
+
+def merge_average(prefix: str) -> str:
+    """Returns the SQL that merges the average of one metric, weighted by the number of
+    readings of that metric, keeping the old average if there are no new readings."""
+    metric = METRIC_PREFIXES[prefix]
+    return f"""COALESCE(
+            (t.average_{metric} * t.{metric}_count + s.new_avg_{prefix} * s.new_{prefix}_count)
+            / NULLIF(t.{metric}_count + s.new_{prefix}_count, 0), t.average_{metric})"""
+
+
+def merge_averages_statement() -> str:
     """
-    Updates the average temperature, soil moisture, and recording count for a specific plant.
+    Returns the MERGE that folds the staged statistics into plant_average:
+    averages weighted by the number of readings of each metric (which leaves out
+    missing readings), the combined sums of squared deviations from which the
+    variance is found, and the lowest and highest readings.
+    Every expression reads the values from before the update.
+    """
+    return f"""
+    MERGE {ENV['SCHEMA_NAME']}.plant_average WITH (HOLDLOCK) AS t
+    USING {AVERAGE_STAGING_TABLE} AS s
+    ON t.plant_id = s.plant_id
+    WHEN MATCHED THEN UPDATE SET
+        average_temperature = {merge_average('temp')},
+        average_soil_moisture = {merge_average('soil_moisture')},
+        temperature_m2 = {merge_m2('temp')},
+        soil_moisture_m2 = {merge_m2('soil_moisture')},
+        min_temperature = CASE WHEN s.new_min_temp < t.min_temperature
+            OR t.min_temperature IS NULL THEN s.new_min_temp ELSE t.min_temperature END,
+        max_temperature = CASE WHEN s.new_max_temp > t.max_temperature
+            OR t.max_temperature IS NULL THEN s.new_max_temp ELSE t.max_temperature END,
+        min_soil_moisture = CASE WHEN s.new_min_soil_moisture < t.min_soil_moisture
+            OR t.min_soil_moisture IS NULL THEN s.new_min_soil_moisture
+            ELSE t.min_soil_moisture END,
+        max_soil_moisture = CASE WHEN s.new_max_soil_moisture > t.max_soil_moisture
+            OR t.max_soil_moisture IS NULL THEN s.new_max_soil_moisture
+            ELSE t.max_soil_moisture END,
+        recording_count = t.recording_count + s.new_recordings,
+        temperature_count = t.temperature_count + s.new_temp_count,
+        soil_moisture_count = t.soil_moisture_count + s.new_soil_moisture_count
+    WHEN NOT MATCHED THEN
+        INSERT (plant_id, average_temperature, average_soil_moisture, recording_count,
+                temperature_count, soil_moisture_count, temperature_m2, soil_moisture_m2,
+                min_temperature, max_temperature,
+                min_soil_moisture, max_soil_moisture)
+        VALUES (s.plant_id, COALESCE(s.new_avg_temp, 0), COALESCE(s.new_avg_soil_moisture, 0),
+                s.new_recordings, s.new_temp_count, s.new_soil_moisture_count,
+                COALESCE(s.new_temp_m2, 0),
+                COALESCE(s.new_soil_moisture_m2, 0), s.new_min_temp, s.new_max_temp,
+                s.new_min_soil_moisture, s.new_max_soil_moisture);
     """
-    with conn.cursor() as cursor:
-        cursor.execute(f"""
-            UPDATE {ENV['SCHEMA_NAME']}.plant_average
-            SET average_temperature = %s, average_soil_moisture = %s, recording_count = %s
-            WHERE plant_id = %s
-        """, (avg_temp, avg_soil_moisture, recordings, plant_id))
-    conn.commit()
 
 
-def insert_new_plant_average(conn, plant_id: int, avg_temp: float, avg_soil_moisture: float, recordings: int) -> None:
+def merge_histograms_statement() -> str:
+    """Returns the MERGE that adds the staged histogram counts to plant_histogram."""
+    return f"""
+    MERGE {ENV['SCHEMA_NAME']}.plant_histogram WITH (HOLDLOCK) AS t
+    USING {HISTOGRAM_STAGING_TABLE} AS s
+    ON t.plant_id = s.plant_id AND t.metric = s.metric AND t.bin = s.bin
+    WHEN MATCHED THEN UPDATE SET bin_count = t.bin_count + s.bin_count
+    WHEN NOT MATCHED THEN
+        INSERT (plant_id, metric, bin, bin_count)
+        VALUES (s.plant_id, s.metric, s.bin, s.bin_count);
     """
-    Inserts a new record for the plant with its average temperature, soil moisture, and recording count.
-    """
-    with conn.cursor() as cursor:
-        cursor.execute(f"""
-            INSERT INTO {ENV['SCHEMA_NAME']}.plant_average (plant_id, average_temperature, average_soil_moisture, recording_count)
-            VALUES (%s, %s, %s, %s)
-        """, (plant_id, avg_temp, avg_soil_moisture, recordings))
-    conn.commit()
 
 
 def calculate_new_averages(recordings: pd.DataFrame) -> pd.DataFrame:
     """
-    Groups the dataframe by plant_id and calculates new averages for temperature and soil moisture.
+    Groups the dataframe by plant_id and calculates new averages for temperature and soil moisture,
+    with the sum of squared deviations from the average and the lowest and highest readings.
+    The readings of each metric are counted separately, as either can be missing.
     """
-    return recordings.groupby('plant_id').agg(
+    grouped = recordings.groupby('plant_id').agg(
         new_avg_temp=('temperature', 'mean'),
         new_avg_soil_moisture=('soil_moisture', 'mean'),
-        new_recordings=('plant_id', 'size')
+        new_recordings=('plant_id', 'size'),
+        temp_var=('temperature', 'var'),
+        new_temp_count=('temperature', 'count'),
+        soil_moisture_var=('soil_moisture', 'var'),
+        new_soil_moisture_count=('soil_moisture', 'count'),
+        new_min_temp=('temperature', 'min'),
+        new_max_temp=('temperature', 'max'),
+        new_min_soil_moisture=('soil_moisture', 'min'),
+        new_max_soil_moisture=('soil_moisture', 'max')
     ).reset_index()
 
+    for prefix in METRIC_PREFIXES:
+        grouped[f'new_{prefix}_m2'] = (grouped[f'{prefix}_var']
+                                       * (grouped[f'new_{prefix}_count'] - 1)).fillna(0.0)
+
+    return grouped[AVERAGE_COLUMNS]
+
+
+def combine_averages(partial_averages: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Combines the statistics calculated for each batch of recordings into one set per plant,
+    weighting each batch's averages by its number of readings of each metric.
+    """
+    if not partial_averages:
+        return calculate_new_averages(pd.DataFrame(columns=['plant_id', 'temperature',
+                                                            'soil_moisture']))
+
+    partials = pd.concat(partial_averages, ignore_index=True)
+    for prefix in METRIC_PREFIXES:
+        partials[f'{prefix}_total'] = (partials[f'new_avg_{prefix}']
+                                       * partials[f'new_{prefix}_count']).fillna(0.0)
+
+    combined = partials.groupby('plant_id').agg(
+        temp_total=('temp_total', 'sum'),
+        soil_moisture_total=('soil_moisture_total', 'sum'),
+        new_recordings=('new_recordings', 'sum'),
+        new_temp_count=('new_temp_count', 'sum'),
+        new_soil_moisture_count=('new_soil_moisture_count', 'sum'),
+        new_min_temp=('new_min_temp', 'min'),
+        new_max_temp=('new_max_temp', 'max'),
+        new_min_soil_moisture=('new_min_soil_moisture', 'min'),
+        new_max_soil_moisture=('new_max_soil_moisture', 'max')
+    )
+    for prefix in METRIC_PREFIXES:
+        combined[f'new_avg_{prefix}'] = (combined[f'{prefix}_total']
+                                         / combined[f'new_{prefix}_count'])
+
+    for prefix in METRIC_PREFIXES:
+        combined[f'new_{prefix}_m2'] = pooled_m2(partials, prefix,
+                                                 combined[f'new_avg_{prefix}'])
+
+    return combined.reset_index()[AVERAGE_COLUMNS]
+
 
 def process_and_update_averages(recordings: pd.DataFrame) -> None:
     """
     Processes the plant data and updates or inserts average records into the SQL Server database.
     """
-    conn = create_connection()
     if not recordings.empty:
+        update_averages(calculate_new_averages(recordings), calculate_histograms(recordings))
+
 
-        grouped_df = calculate_new_averages(recordings)
-
-        # Iterate over each plant and update or insert records
-        for _, row in grouped_df.iterrows():
-            plant_id = int(row['plant_id'])
-            new_avg_temp = float(row['new_avg_temp'])
-            new_avg_soil_moisture = float(row['new_avg_soil_moisture'])
-            new_recordings = int(row['new_recordings'])
-
-            current_averages = fetch_current_averages(conn, plant_id)
-
-            if current_averages:
-                # If the plant exists, calculate the updated averages
-                old_avg_temp = current_averages['average_temperature']
-                old_avg_soil_moisture = current_averages['average_soil_moisture']
-                old_recordings = current_averages['recording_count']
-                total_recordings = old_recordings + new_recordings
-
-                # Calculate the weighted average
-                updated_avg_temp = ((old_avg_temp * old_recordings) +
-                                    (new_avg_temp * new_recordings)) / total_recordings
-                updated_avg_soil_moisture = ((old_avg_soil_moisture * old_recordings) + (
-                    new_avg_soil_moisture * new_recordings)) / total_recordings
-
-                # Update the record in the database
-                update_plant_average(
-                    conn, plant_id, updated_avg_temp, updated_avg_soil_moisture, total_recordings)
-            else:
-                # If the plant doesn't exist, insert a new record
-                insert_new_plant_average(
-                    conn, plant_id, new_avg_temp, new_avg_soil_moisture, new_recordings)
+def update_averages(grouped_df: pd.DataFrame, histograms: pd.DataFrame = None,
+                    run_id: str = None) -> None:
+    """
+    Folds the new statistics for each plant into the plant_average table, and the
+    histogram counts into plant_histogram, in one transaction: each is staged in a
+    temporary table in bulk, then a single MERGE updates the existing rows and
+    inserts the new ones. With run_id, the run's checkpoint is moved on to 'averaged'
+    in the same transaction, so a resumed run never counts its recordings twice.
+    """
+    if grouped_df.empty and run_id is None:
+        return
 
+    histograms = histograms if histograms is not None else pd.DataFrame(
+        columns=HISTOGRAM_COLUMNS)
+
+    conn = create_connection()
+    try:
+        with conn.cursor() as cursor:
+            if not grouped_df.empty:
+                stage_and_merge_averages(cursor, grouped_df)
+
+            if not histograms.empty:
+                stage_and_merge_histograms(cursor, histograms)
+
+            if run_id is not None:
+                set_stage(cursor, run_id, "averaged")
         conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
         conn.close()
-        print("Averages updated.")
+
+    print(f"Averages updated for {len(grouped_df)} plants.")
+
+
+def stage_and_merge_averages(cursor, grouped_df: pd.DataFrame) -> None:
+    """Stages the new statistics for each plant and merges them into plant_average."""
+    cursor.execute(f"""
+    CREATE TABLE {AVERAGE_STAGING_TABLE} (
+        plant_id SMALLINT NOT NULL PRIMARY KEY,
+        new_avg_temp FLOAT,
+        new_avg_soil_moisture FLOAT,
+        new_recordings INT NOT NULL,
+        new_temp_count INT NOT NULL,
+        new_soil_moisture_count INT NOT NULL,
+        new_temp_m2 FLOAT,
+        new_soil_moisture_m2 FLOAT,
+        new_min_temp FLOAT,
+        new_max_temp FLOAT,
+        new_min_soil_moisture FLOAT,
+        new_max_soil_moisture FLOAT)
+    """)
+    stage_rows(cursor, AVERAGE_STAGING_TABLE, AVERAGE_COLUMNS,
+               to_params(grouped_df[AVERAGE_COLUMNS]))
+    cursor.execute(merge_averages_statement())
+    cursor.execute(f"DROP TABLE {AVERAGE_STAGING_TABLE}")
+
+
+def stage_and_merge_histograms(cursor, histograms: pd.DataFrame) -> None:
+    """Stages the new histogram counts and merges them into plant_histogram."""
+    cursor.execute(f"""
+    CREATE TABLE {HISTOGRAM_STAGING_TABLE} (
+        plant_id SMALLINT NOT NULL,
+        metric VARCHAR(20) NOT NULL,
+        bin SMALLINT NOT NULL,
+        bin_count INT NOT NULL,
+        PRIMARY KEY (plant_id, metric, bin))
+    """)
+    stage_rows(cursor, HISTOGRAM_STAGING_TABLE, HISTOGRAM_COLUMNS,
+               to_params(histograms[HISTOGRAM_COLUMNS]))
+    cursor.execute(merge_histograms_statement())
+    cursor.execute(f"DROP TABLE {HISTOGRAM_STAGING_TABLE}")
 
 
 if __name__ == "__main__":
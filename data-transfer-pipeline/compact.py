@@ -0,0 +1,132 @@
+"""Compacts the small daily archive files for a month into fewer, larger files."""
+import struct
+from io import BytesIO
+from os import environ as ENV
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from archive import (read_manifest_version, write_manifest, add_to_manifest,
+                     compacted_key, delete_keys)
+from load import ArchiveFile, MEGABYTE
+
+
+def plan_compaction(manifest: dict, year: int, month: int, target_bytes: int) -> dict:
+    """
+    Returns the files in the month smaller than the target size, grouped by plant bucket
+    and in time order. Buckets with only one such file are left alone.
+    """
+    groups = {}
+    for file in manifest["files"]:
+        if (file["year"], file["month"]) == (year, month) and file["bytes"] < target_bytes:
+            groups.setdefault(file["bucket"], []).append(file)
+
+    return {bucket: sorted(files, key=lambda file: file["min_recording_taken"])
+            for bucket, files in groups.items() if len(files) > 1}
+
+
+def read_archive_file(s3, bucket_name: str, key: str) -> pd.DataFrame:
+    """Returns the recordings in one archive file."""
+    body = s3.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+    return pq.read_table(BytesIO(body)).to_pandas()
+
+
+def read_footer_row_count(s3, bucket_name: str, key: str) -> int:
+    """Returns the number of rows in a parquet file, reading only its footer."""
+    tail = s3.get_object(Bucket=bucket_name, Key=key, Range="bytes=-8")["Body"].read()
+    footer_length = struct.unpack("<I", tail[:4])[0]
+    footer = s3.get_object(Bucket=bucket_name, Key=key,
+                           Range=f"bytes=-{footer_length + 8}")["Body"].read()
+    # The metadata only needs the footer, behind the magic bytes that start every file.
+    return pq.read_metadata(BytesIO(b"PAR1" + footer)).num_rows
+
+
+def write_compacted(s3, bucket_name: str, files: list[dict], run_id: str,
+                    target_bytes: int, row_group_rows: int) -> list[dict]:
+    """
+    Copies the recordings in the files into new files of about target_bytes each,
+    in row groups of at least row_group_rows sorted by plant and time.
+    Returns the manifest entries of the new files, which are removed again if anything fails.
+    """
+    year, month, bucket = files[0]["year"], files[0]["month"], files[0]["bucket"]
+    written = []
+    current = None
+    pending = []
+
+    try:
+        for position, file in enumerate(files, start=1):
+            pending.append(read_archive_file(s3, bucket_name, file["key"]))
+            if sum(len(recordings) for recordings in pending) < row_group_rows \
+                    and position < len(files):
+                continue
+
+            if current is None:
+                current = ArchiveFile(s3, bucket_name,
+                                      compacted_key(year, month, bucket, run_id, len(written)),
+                                      (year, month, None, bucket), file["plant_buckets"])
+            current.write(pd.concat(pending, ignore_index=True).sort_values(
+                ["plant_id", "recording_taken"]))
+            pending = []
+
+            if current.upload.tell() >= target_bytes:
+                written.append(current.close())
+                current = None
+
+        if current is not None:
+            written.append(current.close())
+    except Exception:
+        if current is not None:
+            current.abort()
+        delete_keys(s3, bucket_name, [file["key"] for file in written])
+        raise
+
+    return written
+
+
+def verify_compacted(s3, bucket_name: str, originals: list[dict], written: list[dict]) -> None:
+    """Raises a ValueError unless the new files hold as many rows as the originals,
+    counting from the footers of the uploaded files rather than what was written."""
+    expected = sum(file["rows"] for file in originals)
+    uploaded = sum(read_footer_row_count(s3, bucket_name, file["key"]) for file in written)
+
+    if uploaded != expected:
+        raise ValueError(f"Compacted files hold {uploaded} rows, expected {expected}.")
+
+
+def compact_month(s3, bucket_name: str, year: int, month: int, run_id: str) -> dict:
+    """
+    Merges the month's small archive files into files of about ARCHIVE_COMPACT_TARGET_MB
+    (default 128). The new files are checked against the originals, then the manifest
+    is swapped in one put, which fails if the manifest changed since it was read.
+    Only then are the originals deleted.
+    Returns the number of files replaced and written, and the rows moved.
+    """
+    target_bytes = int(float(ENV.get("ARCHIVE_COMPACT_TARGET_MB", 128)) * MEGABYTE)
+    row_group_rows = int(ENV.get("ARCHIVE_COMPACT_ROW_GROUP_ROWS", 250_000))
+
+    manifest, etag = read_manifest_version(s3, bucket_name)
+    originals = []
+    written = []
+
+    try:
+        for files in plan_compaction(manifest, year, month, target_bytes).values():
+            new_files = write_compacted(s3, bucket_name, files, run_id,
+                                        target_bytes, row_group_rows)
+            written += new_files
+            verify_compacted(s3, bucket_name, files, new_files)
+            originals += files
+
+        if written:
+            original_keys = {file["key"] for file in originals}
+            write_manifest(s3, bucket_name, add_to_manifest(
+                {**manifest, "files": [file for file in manifest["files"]
+                                       if file["key"] not in original_keys]}, written),
+                if_match=etag)
+    except Exception:
+        delete_keys(s3, bucket_name, [file["key"] for file in written])
+        raise
+
+    delete_keys(s3, bucket_name, [file["key"] for file in originals])
+
+    return {"files_replaced": len(originals), "files_written": len(written),
+            "rows": sum(file["rows"] for file in written)}
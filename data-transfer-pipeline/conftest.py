@@ -0,0 +1,61 @@
+# pylint: skip-file
+from io import BytesIO
+
+import pytest
+from botocore.exceptions import ClientError
+
+
+class FakeS3:
+    """An in-memory stand-in for the S3 calls made by the archive."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+        self.versions = {}
+
+    def etag(self, Bucket, Key):
+        return f'"{Key}-{self.versions.get((Bucket, Key), 0)}"'
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **kwargs):
+        if (IfMatch and IfMatch != self.etag(Bucket, Key)) or \
+                (IfNoneMatch == "*" and (Bucket, Key) in self.objects):
+            raise ClientError({"Error": {"Code": "PreconditionFailed", "Message": Key}},
+                              "PutObject")
+        self.objects[(Bucket, Key)] = bytes(Body)
+        self.versions[(Bucket, Key)] = self.versions.get((Bucket, Key), 0) + 1
+
+    def get_object(self, Bucket, Key, Range=None):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": Key}}, "GetObject")
+        body = self.objects[(Bucket, Key)]
+        if Range:
+            body = body[int(Range.removeprefix("bytes=")):]
+        return {"Body": BytesIO(body), "ETag": self.etag(Bucket, Key)}
+
+    def delete_objects(self, Bucket, Delete):
+        for item in Delete["Objects"]:
+            self.objects.pop((Bucket, item["Key"]), None)
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = f"upload-{len(self.uploads) + len(self.objects) + 1}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId][PartNumber] = bytes(Body)
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[(Bucket, Key)] = b"".join(
+            parts[part["PartNumber"]] for part in MultipartUpload["Parts"])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+        self.aborted.append(Key)
+
+
+@pytest.fixture
+def fake_s3():
+    return FakeS3()
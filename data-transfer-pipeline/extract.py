@@ -1,4 +1,5 @@
 """Script to extract old recordings from the short term storage."""
+from collections.abc import Iterator
 from datetime import datetime, timedelta
 from os import environ as ENV
 
@@ -7,6 +8,14 @@ from dotenv import load_dotenv
 import pymssql
 
 
+RECORDING_DTYPES = {"recording_id": "int64",
+                    "plant_id": "int16",
+                    "recording_taken": "datetime64[us]",
+                    "last_watered": "datetime64[us]",
+                    "soil_moisture": "float64",
+                    "temperature": "float64"}
+
+
 def create_connection():
     """Returns a connection to connect to the database. """
     conn = pymssql.connect(
@@ -19,23 +28,43 @@ def create_connection():
     return conn
 
 
-def extract_recordings() -> pd.DataFrame:
-    '''Returns the recordings over 24 hours old as a dataframe.'''
+def to_batch(rows: list[dict]) -> pd.DataFrame:
+    '''Returns the rows as a dataframe with fixed column types.'''
+    return pd.DataFrame.from_records(rows, columns=list(RECORDING_DTYPES)).astype(RECORDING_DTYPES)
+
+
+def extract_recording_batches(cutoff_time: datetime = None, chunk_size: int = None,
+                              id_range: tuple[int, int] = None) -> Iterator[pd.DataFrame]:
+    '''Yields the recordings older than the cutoff (by default 24 hours ago)
+    as dataframes of at most chunk_size rows (EXTRACT_CHUNK_SIZE, default 50000),
+    so only one chunk is held in memory at a time. With id_range, only the recordings
+    with ids from the first to the last of the range (inclusive) are included.
+    They are sorted by day, then plant, then time, which is the order they are archived in.'''
     load_dotenv()
-    cutoff_time = datetime.now() - timedelta(days=1)
+    cutoff_time = cutoff_time or datetime.now() - timedelta(days=1)
+    chunk_size = chunk_size or int(ENV.get("EXTRACT_CHUNK_SIZE", 50_000))
+    id_condition = "AND recording_id BETWEEN %s AND %s" if id_range else ""
     query = f'''
     SELECT recording_id, plant_id, recording_taken, last_watered, soil_moisture, temperature
     FROM {ENV['SCHEMA_NAME']}.recording
-    WHERE recording_taken < %s
+    WHERE recording_taken < %s {id_condition}
+    ORDER BY CAST(recording_taken AS DATE), plant_id, recording_taken
     '''
 
     conn = create_connection()
-    with conn.cursor() as cursor:
-        cursor.execute(query, (cutoff_time,))
-        res = cursor.fetchall()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, (cutoff_time, *(id_range or ())))
+            while rows := cursor.fetchmany(chunk_size):
+                yield to_batch(rows)
+    finally:
+        conn.close()
+
 
-    conn.close()
-    df = pd.DataFrame(res)
+def extract_recordings(cutoff_time: datetime = None) -> pd.DataFrame:
+    '''Returns the recordings over 24 hours old as a dataframe.'''
+    batches = list(extract_recording_batches(cutoff_time))
+    df = pd.concat(batches, ignore_index=True) if batches else to_batch([])
     print("Recordings extracted!")
 
     return df
@@ -1,38 +1,232 @@
 """Script to load the data as a parquet file to the s3 bucket."""
-from io import BytesIO
+from collections.abc import Iterable
 from os import environ as ENV
-from datetime import datetime, timedelta
+from datetime import datetime
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from boto3 import client
 from dotenv import load_dotenv
 
+from archive import split_partitions, archive_key, update_manifest
 
-def create_filepath() -> str:
-    """Creates a file path for yesterdays date."""
-    yesterday = datetime.now() - timedelta(days=1)
-    year = yesterday.strftime("%Y")
-    month = yesterday.strftime("%m")
-    day = yesterday.strftime("%d")
-    filepath = f'plant_recordings/{year}/{month}/{day}/recording.parquet'
-    return filepath
 
+MEGABYTE = 1024 * 1024
+ARCHIVE_SCHEMA = pa.schema([("recording_id", pa.int64()),
+                            ("plant_id", pa.int16()),
+                            ("recording_taken", pa.timestamp("us")),
+                            ("last_watered", pa.timestamp("us")),
+                            ("soil_moisture", pa.float64()),
+                            ("temperature", pa.float64())])
 
-def load_to_s3(recordings: pd.DataFrame) -> None:
-    """Loads the dataframe to the s3 bucket as a parquet file."""
 
-    recording_parquet = BytesIO()
+class MultipartUpload:
+    """
+    A write-only file that uploads to S3 in parts as it is written to, so only
+    one part is held in memory at a time. Files smaller than one part are
+    uploaded with a single put when closed.
+    """
+
+    def __init__(self, s3, bucket_name: str, key: str, part_size: int = None):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.key = key
+        # S3 rejects parts other than the last that are smaller than 5MB.
+        self.part_size = max(part_size or int(float(ENV.get("ARCHIVE_PART_SIZE_MB", 8))
+                                              * MEGABYTE), 5 * MEGABYTE)
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = None
+        self.position = 0
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        """Adds the data to the buffer, uploading a part whenever a full one is buffered."""
+        self.buffer.extend(data)
+        self.position += len(data)
+        while len(self.buffer) >= self.part_size:
+            self.upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def tell(self) -> int:
+        """Returns the number of bytes written so far."""
+        return self.position
+
+    def flush(self) -> None:
+        """Parts are only uploaded once full, so there is nothing to flush."""
+
+    def upload_part(self, data: bytes) -> None:
+        """Uploads one part, starting the multipart upload on the first."""
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(
+                Bucket=self.bucket_name, Key=self.key)["UploadId"]
+
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(Bucket=self.bucket_name, Key=self.key,
+                                       UploadId=self.upload_id, PartNumber=part_number,
+                                       Body=data)
+        self.parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+
+    def close(self) -> None:
+        """Uploads whatever is left in the buffer and completes the upload."""
+        if self.closed:
+            return
+
+        if self.upload_id is None:
+            self.s3.put_object(Bucket=self.bucket_name, Key=self.key, Body=bytes(self.buffer))
+        else:
+            if self.buffer:
+                self.upload_part(bytes(self.buffer))
+            self.s3.complete_multipart_upload(Bucket=self.bucket_name, Key=self.key,
+                                              UploadId=self.upload_id,
+                                              MultipartUpload={"Parts": self.parts})
+        self.buffer.clear()
+        self.closed = True
+
+    def abort(self) -> None:
+        """Abandons the upload, so S3 doesn't keep the parts already sent."""
+        if self.upload_id is not None and not self.closed:
+            self.s3.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key,
+                                           UploadId=self.upload_id)
+        self.buffer.clear()
+        self.closed = True
+
+
+def get_s3_client():
+    """Returns an S3 client, pointed at S3_ENDPOINT_URL if it is set (e.g. a local stand-in)."""
+    return client(service_name="s3",
+                  aws_access_key_id=ENV["AWS_ACCESS_KEY"],
+                  aws_secret_access_key=ENV["AWS_SECRET_KEY"],
+                  endpoint_url=ENV.get("S3_ENDPOINT_URL") or None)
+
+
+def create_parquet_writer(file) -> pq.ParquetWriter:
+    """Returns a writer for an archive parquet file, where every table written is one row group."""
+    return pq.ParquetWriter(
+        file, ARCHIVE_SCHEMA,
+        compression=ENV.get("ARCHIVE_COMPRESSION", "zstd"),
+        compression_level=int(ENV.get("ARCHIVE_COMPRESSION_LEVEL", 3)),
+        # Plant ids repeat on every row, the readings and times rarely do.
+        use_dictionary=["plant_id"],
+        write_statistics=True)
+
+
+class ArchiveFile:
+    """
+    One parquet file in the archive, uploaded as it is written, which keeps
+    the row count and ranges of plants and times that go in the manifest.
+    """
+
+    def __init__(self, s3, bucket_name: str, key: str, partition: tuple = None,
+                 plant_buckets: int = 0):
+        self.key = key
+        self.partition = partition
+        self.plant_buckets = plant_buckets
+        self.upload = MultipartUpload(s3, bucket_name, key)
+        self.writer = create_parquet_writer(self.upload)
+        self.rows = 0
+        self.plant_ids = []
+        self.recording_taken = []
+
+    def write(self, recordings: pd.DataFrame) -> None:
+        """Writes the recordings as one row group."""
+        self.writer.write_table(pa.Table.from_pandas(recordings, schema=ARCHIVE_SCHEMA,
+                                                     preserve_index=False))
+        self.rows += len(recordings)
+        self.plant_ids += [recordings["plant_id"].min(), recordings["plant_id"].max()]
+        self.recording_taken += [recordings["recording_taken"].min(),
+                                 recordings["recording_taken"].max()]
+
+    def close(self) -> dict:
+        """Finishes the file and returns its manifest entry."""
+        self.writer.close()
+        self.upload.close()
+
+        year, month, day, bucket = self.partition or (None, None, None, None)
+        return {"key": self.key, "year": year, "month": month, "day": day,
+                "bucket": bucket, "plant_buckets": self.plant_buckets,
+                "rows": self.rows, "bytes": self.upload.tell(),
+                "min_plant_id": int(min(self.plant_ids)) if self.rows else None,
+                "max_plant_id": int(max(self.plant_ids)) if self.rows else None,
+                "min_recording_taken": min(self.recording_taken).isoformat()
+                if self.rows else None,
+                "max_recording_taken": max(self.recording_taken).isoformat()
+                if self.rows else None}
+
+    def abort(self) -> None:
+        """Abandons the file without leaving anything in the bucket."""
+        self.upload.abort()
+
+
+def write_partitions(s3, bucket_name: str, batches: Iterable[pd.DataFrame], run_id: str,
+                     plant_buckets: int = 0) -> list[dict]:
+    """
+    Writes the batches to one archive file per partition, returning their manifest entries.
+    The batches must be sorted by the day the recordings were taken, so that each day's
+    files can be finished as soon as the next day starts.
+    """
+    open_files = {}
+    files = []
+    latest_day = None
+
+    try:
+        for batch in batches:
+            for partition, recordings in split_partitions(batch, plant_buckets):
+                if latest_day and partition[:3] < latest_day:
+                    raise ValueError("The recordings must be sorted by the day they were taken.")
+
+                if partition not in open_files:
+                    for earlier in [open_partition for open_partition in open_files
+                                    if open_partition[:3] < partition[:3]]:
+                        files.append(open_files[earlier].close())
+                        del open_files[earlier]
+                    open_files[partition] = ArchiveFile(s3, bucket_name,
+                                                        archive_key(partition, run_id),
+                                                        partition, plant_buckets)
+
+                open_files[partition].write(recordings)
+                latest_day = partition[:3]
+
+        for partition in list(open_files):
+            files.append(open_files[partition].close())
+            del open_files[partition]
+    except Exception:
+        # A file stays open until its close succeeds, so a failed close is aborted too.
+        for archive_file in open_files.values():
+            archive_file.abort()
+        raise
+
+    return files
+
+
+def load_to_s3(recordings: pd.DataFrame | Iterable[pd.DataFrame], run_id: str = None) -> int:
+    """
+    Loads the dataframe, or batches of dataframes, to the s3 bucket as parquet files
+    partitioned by the day each recording was taken (and by plant bucket if
+    ARCHIVE_PLANT_BUCKETS is set), then adds the files to the archive manifest
+    without overwriting a concurrent compaction's changes.
+    Files are uploaded in parts as they are written and aborted if anything fails.
+    Returns the number of recordings uploaded.
+    """
+
+    if isinstance(recordings, pd.DataFrame):
+        recordings = [recordings.sort_values(["plant_id", "recording_taken"]).sort_values(
+            "recording_taken", key=lambda taken: taken.dt.normalize(), kind="stable")]
 
-    recordings.to_parquet(recording_parquet, index=False)
-    recording_parquet.seek(0)
     load_dotenv()
-    s3 = client(service_name="s3",
-                aws_access_key_id=ENV["AWS_ACCESS_KEY"],
-                aws_secret_access_key=ENV["AWS_SECRET_KEY"])
+    s3 = get_s3_client()
     bucket_name = ENV['BUCKET_NAME']
-    key = create_filepath()
-    s3.upload_fileobj(Fileobj=recording_parquet, Bucket=bucket_name, Key=key)
-    print("Recordings uploaded.")
+    run_id = run_id or datetime.now().strftime("%Y%m%dT%H%M%S")
+
+    files = write_partitions(s3, bucket_name, recordings, run_id,
+                             int(ENV.get("ARCHIVE_PLANT_BUCKETS", 0)))
+    update_manifest(s3, bucket_name, files)
+
+    rows = sum(file["rows"] for file in files)
+    print(f"{rows} recordings uploaded to {len(files)} files.")
+    return rows
 
 
 if __name__ == "__main__":
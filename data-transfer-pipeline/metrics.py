@@ -0,0 +1,55 @@
+"""Collects the timings and counts of the daily transfer, and emits them as one log line
+in CloudWatch embedded metric format (EMF), so they become metrics without any API calls."""
+import json
+from contextlib import contextmanager
+from os import environ as ENV
+from time import perf_counter, time
+
+
+METRICS = {"stages": {}, "counters": {}}
+
+
+def reset_metrics() -> None:
+    """Forgets the timings and counts collected so far."""
+    METRICS["stages"] = {}
+    METRICS["counters"] = {}
+
+
+@contextmanager
+def timed_stage(stage: str):
+    """Adds the milliseconds spent in the block to the stage, even if it raises."""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        METRICS["stages"][stage] = (METRICS["stages"].get(stage, 0.0)
+                                    + (perf_counter() - start) * 1000)
+
+
+def increment(counter: str, amount: int = 1) -> None:
+    """Adds to a counter, such as the recordings archived or deleted."""
+    METRICS["counters"][counter] = METRICS["counters"].get(counter, 0) + amount
+
+
+def emf_record(dimensions: dict) -> dict:
+    """Returns the metrics as an EMF record, with each stage as <stage>Time
+    in milliseconds and each counter as a count."""
+    values = {f"{stage}Time": round(ms, 1) for stage, ms in METRICS["stages"].items()}
+    units = {name: "Milliseconds" for name in values}
+    values.update(METRICS["counters"])
+    units.update({counter: "Count" for counter in METRICS["counters"]})
+
+    return {"_aws": {"Timestamp": int(time() * 1000),
+                     "CloudWatchMetrics": [{
+                         "Namespace": ENV.get("METRICS_NAMESPACE", "LMNHPlants/Transfer"),
+                         "Dimensions": [list(dimensions)],
+                         "Metrics": [{"Name": name, "Unit": unit}
+                                     for name, unit in units.items()]}]},
+            **dimensions, **values}
+
+
+def emit_metrics(dimensions: dict) -> dict:
+    """Prints the EMF record as one line of JSON and returns it."""
+    record = emf_record(dimensions)
+    print(json.dumps(record))
+    return record
@@ -0,0 +1,135 @@
+"""Manages the day partitions of the recording table, so whole archived days are removed at once."""
+from datetime import datetime, timedelta
+from os import environ as ENV
+
+from dotenv import load_dotenv
+
+from extract import create_connection
+
+
+PARTITION_FUNCTION = "pf_recording_day"
+PARTITION_SCHEME = "ps_recording_day"
+
+
+def find_partitions(cursor) -> list[dict]:
+    """
+    Returns the partition number and the start and end of every partition of the
+    recording table with both ends bounded, in time order. With RANGE RIGHT,
+    partition n starts at boundary n - 1 and ends at boundary n.
+    Returns nothing if the table isn't partitioned.
+    """
+    cursor.execute("""
+    SELECT boundary.boundary_id + 1 AS partition_number,
+           CAST(boundary.value AS DATETIME2) AS partition_start,
+           CAST(next_boundary.value AS DATETIME2) AS partition_end
+    FROM sys.partition_functions AS f
+    JOIN sys.partition_range_values AS boundary ON boundary.function_id = f.function_id
+    JOIN sys.partition_range_values AS next_boundary
+        ON next_boundary.function_id = f.function_id
+        AND next_boundary.boundary_id = boundary.boundary_id + 1
+    WHERE f.name = %s
+    ORDER BY boundary.boundary_id
+    """, (PARTITION_FUNCTION,))
+    return cursor.fetchall()
+
+
+def find_last_boundary(cursor) -> datetime:
+    """Returns the start of the newest partition, or None if there are no boundaries."""
+    cursor.execute("""
+    SELECT MAX(CAST(boundary.value AS DATETIME2)) AS last_boundary
+    FROM sys.partition_functions AS f
+    JOIN sys.partition_range_values AS boundary ON boundary.function_id = f.function_id
+    WHERE f.name = %s
+    """, (PARTITION_FUNCTION,))
+    row = cursor.fetchone()
+    return row["last_boundary"] if row else None
+
+
+def has_unarchived_recordings(cursor, partition: dict, id_range: tuple[int, int]) -> bool:
+    """
+    Returns True if the partition holds any recordings outside the run's id range,
+    such as late readings that arrived after the run started.
+    The table is locked until the cursor's transaction ends, so no reading can be
+    written to the partition between the check and emptying it.
+    """
+    cursor.execute(f"""
+    SELECT TOP 1 recording_id
+    FROM {ENV['SCHEMA_NAME']}.recording WITH (TABLOCKX, HOLDLOCK)
+    WHERE recording_taken >= %s AND recording_taken < %s
+        AND (recording_id < %s OR recording_id > %s)
+    """, (partition["partition_start"], partition["partition_end"], *id_range))
+    return cursor.fetchone() is not None
+
+
+def truncate_archived_days(cutoff_time: datetime, id_range: tuple[int, int]) -> list[datetime]:
+    """
+    Empties the partitions of the whole days before the cutoff whose recordings were all
+    archived by the run, then merges their boundaries away. Both are metadata only changes,
+    so take the same time however many recordings there are. Days holding recordings the
+    run didn't archive are left for the batched delete.
+    Each day is checked and emptied in one transaction under a table lock, so a late
+    reading can't be emptied with it. Loads wait for the lock, which is held only
+    for the check and the TRUNCATE.
+    Returns the start of each day emptied.
+    """
+    load_dotenv()
+    emptied = []
+
+    conn = create_connection()
+    try:
+        with conn.cursor() as cursor:
+            for partition in find_partitions(cursor):
+                if partition["partition_end"] > cutoff_time:
+                    break
+                if has_unarchived_recordings(cursor, partition, id_range):
+                    conn.rollback()
+                    continue
+
+                cursor.execute(f"""
+                TRUNCATE TABLE {ENV['SCHEMA_NAME']}.recording
+                WITH (PARTITIONS ({int(partition['partition_number'])}))
+                """)
+                conn.commit()
+                emptied.append(partition["partition_start"])
+
+            for partition_start in emptied:
+                cursor.execute(f"ALTER PARTITION FUNCTION {PARTITION_FUNCTION}() "
+                               "MERGE RANGE (%s)", (partition_start,))
+                conn.commit()
+    finally:
+        conn.close()
+    print(f"{len(emptied)} archived days emptied.")
+
+    return emptied
+
+
+def add_day_partitions(days_ahead: int = None) -> list[datetime]:
+    """
+    Adds a partition for each day from the newest partition until PARTITION_DAYS_AHEAD
+    (default 3) days from now. Splitting the empty partition at the end is metadata only.
+    Returns the start of each day added.
+    """
+    load_dotenv()
+    days_ahead = days_ahead if days_ahead is not None else int(
+        ENV.get("PARTITION_DAYS_AHEAD", 3))
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    added = []
+
+    conn = create_connection()
+    try:
+        with conn.cursor() as cursor:
+            last_boundary = find_last_boundary(cursor)
+            day = last_boundary + timedelta(days=1) if last_boundary else today
+
+            while day <= today + timedelta(days=days_ahead):
+                cursor.execute(f"ALTER PARTITION SCHEME {PARTITION_SCHEME} NEXT USED [PRIMARY]")
+                cursor.execute(f"ALTER PARTITION FUNCTION {PARTITION_FUNCTION}() "
+                               "SPLIT RANGE (%s)", (day,))
+                conn.commit()
+                added.append(day)
+                day += timedelta(days=1)
+    finally:
+        conn.close()
+    print(f"{len(added)} day partitions added.")
+
+    return added
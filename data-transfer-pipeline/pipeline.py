@@ -1,22 +1,121 @@
 """The full pipeline for extracting old data and putting it into s3."""
+import sys
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timedelta
+from os import environ as ENV
 from time import perf_counter
 
-from extract import extract_recordings
-from load import load_to_s3
-from clean import delete_outdataed_recordings, process_and_update_averages
+import pandas as pd
+from dotenv import load_dotenv
+
+from extract import extract_recording_batches
+from load import load_to_s3, get_s3_client
+from compact import compact_month
+from checkpoint import get_runs, mark_stage
+from partitions import truncate_archived_days, add_day_partitions
+from clean import (delete_archived_recordings, delete_old_minute_rollups,
+                   calculate_new_averages,
+                   combine_averages, update_averages)
+from stats import calculate_histograms, combine_histograms
+from metrics import reset_metrics, timed_stage, increment, emit_metrics
+
+
+def track_averages(batches: Iterable[pd.DataFrame], partial_averages: list[pd.DataFrame],
+                   partial_histograms: list[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """Passes on each batch of recordings, keeping the statistics for each as it goes."""
+    for batch in batches:
+        partial_averages.append(calculate_new_averages(batch))
+        partial_histograms.append(calculate_histograms(batch))
+        yield batch
+
+
+def transfer_run(run: dict) -> None:
+    """
+    Carries a run through the stages it hasn't finished yet: archiving its recordings,
+    folding them into the averages, then deleting them: whole days by emptying their
+    partitions, and the rest in batches. Each stage is checkpointed once
+    done, so a crashed run can be resumed. The archive files are named after the run,
+    so archiving again only replaces them, and the recordings stay in the RDS until the
+    averages are updated, so the statistics can always be recalculated from them.
+    Each stage is timed, and the recordings it moved counted.
+    """
+    id_range = (run["first_recording_id"], run["last_recording_id"])
+    increment("Runs")
+    if run["stage"] != "started":
+        increment("RunsResumed")
+
+    if run["stage"] in ("started", "archived"):
+        partial_averages = []
+        partial_histograms = []
+        batches = track_averages(extract_recording_batches(run["cutoff_time"],
+                                                           id_range=id_range),
+                                 partial_averages, partial_histograms)
+        with timed_stage("Archive"):
+            if run["stage"] == "started":
+                increment("RecordingsArchived", load_to_s3(batches, run_id=run["run_id"]))
+                mark_stage(run["run_id"], "archived")
+            else:
+                for _ in batches:
+                    pass
+        with timed_stage("Averages"):
+            update_averages(combine_averages(partial_averages),
+                            combine_histograms(partial_histograms), run_id=run["run_id"])
+
+    with timed_stage("Truncate"):
+        increment("DaysTruncated", len(truncate_archived_days(run["cutoff_time"], id_range)))
+    with timed_stage("Delete"):
+        increment("RecordingsDeleted",
+                  delete_archived_recordings(run["cutoff_time"], id_range)["rows"])
+    with timed_stage("Rollups"):
+        increment("RollupsDeleted", delete_old_minute_rollups(run["cutoff_time"])["rows"])
+    mark_stage(run["run_id"], "deleted")
 
 
 def full_pipeline():
-    """Runs the full pipeline."""
+    """Runs the full pipeline, streaming the recordings in batches
+    so memory use doesn't grow with the number of recordings.
+    Every run left unfinished by a crash is finished first, oldest first.
+    The timings and counts are logged in embedded metric format, even if it fails."""
+    reset_metrics()
     start = perf_counter()
-    recordings = extract_recordings()
-    load_to_s3(recordings)
-    delete_outdataed_recordings()
-    process_and_update_averages(recordings)
+    try:
+        with timed_stage("Pipeline"):
+            with timed_stage("Partitions"):
+                increment("PartitionsAdded", len(add_day_partitions()))
+            for run in get_runs(datetime.now() - timedelta(days=1)):
+                transfer_run(run)
+    except Exception:
+        increment("PipelineErrors")
+        raise
+    finally:
+        emit_metrics({"Pipeline": "transfer"})
     end = perf_counter()
     print("Pipeline complete.")
     print(end - start)
 
 
+def compaction_pipeline(year: int, month: int) -> None:
+    """Merges the small daily archive files for a month into larger files."""
+    start = perf_counter()
+    load_dotenv()
+    summary = compact_month(get_s3_client(), ENV["BUCKET_NAME"], year, month,
+                            datetime.now().strftime("%Y%m%dT%H%M%S"))
+    end = perf_counter()
+    print(f"Compacted {summary['files_replaced']} files into {summary['files_written']} "
+          f"({summary['rows']} recordings) for {year}-{month:02d}.")
+    print(end - start)
+
+
+def previous_month() -> datetime:
+    """Returns the first day of last month."""
+    return (datetime.now().replace(day=1) - timedelta(days=1)).replace(day=1)
+
+
 if __name__ == "__main__":
-    full_pipeline()
+    # `python3 pipeline.py compact [YYYY-MM]` compacts a month, by default last month.
+    if len(sys.argv) > 1 and sys.argv[1] == "compact":
+        month_to_compact = (datetime.strptime(sys.argv[2], "%Y-%m")
+                            if len(sys.argv) > 2 else previous_month())
+        compaction_pipeline(month_to_compact.year, month_to_compact.month)
+    else:
+        full_pipeline()
@@ -0,0 +1,173 @@
+"""Answers historical questions from the parquet archive without loading whole days into memory."""
+import json
+import sys
+from collections.abc import Iterator
+from datetime import datetime
+from os import environ as ENV
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import fs
+from dotenv import load_dotenv
+
+from archive import MANIFEST_KEY, prune_files
+from load import ARCHIVE_SCHEMA
+
+
+METRICS = ["temperature", "soil_moisture"]
+AGGREGATES = ["sum", "count", "min", "max"]
+# How each aggregate is combined when merging partial results.
+MERGE_AGGREGATES = {"sum": "sum", "count": "sum", "min": "min", "max": "max"}
+
+# The hourly aggregates of each archive file, kept between queries.
+QUERY_CACHE = {}
+
+
+def get_archive_filesystem() -> fs.FileSystem:
+    """Returns a filesystem for reading the archive bucket, pointed at
+    S3_ENDPOINT_URL if it is set (e.g. a local stand-in)."""
+    return fs.S3FileSystem(access_key=ENV["AWS_ACCESS_KEY"],
+                           secret_key=ENV["AWS_SECRET_KEY"],
+                           region=ENV.get("AWS_REGION", "eu-west-2"),
+                           endpoint_override=ENV.get("S3_ENDPOINT_URL") or None)
+
+
+def read_archive_manifest(filesystem: fs.FileSystem, root: str) -> dict:
+    """Returns the archive manifest, or an empty one if there isn't one yet."""
+    try:
+        with filesystem.open_input_stream(f"{root}/{MANIFEST_KEY}") as stream:
+            return json.loads(stream.read())
+    except FileNotFoundError:
+        return {"files": []}
+
+
+def recording_filter(plant_ids: list[int] = None, start: datetime = None,
+                     end: datetime = None) -> ds.Expression:
+    """Returns the filter for the plants and time range, which is pushed down
+    to skip row groups whose statistics rule them out."""
+    conditions = []
+    if plant_ids:
+        conditions.append(ds.field("plant_id").isin(plant_ids))
+    if start:
+        conditions.append(ds.field("recording_taken") >= pa.scalar(start, pa.timestamp("us")))
+    if end:
+        conditions.append(ds.field("recording_taken") < pa.scalar(end, pa.timestamp("us")))
+
+    condition = None
+    for next_condition in conditions:
+        condition = next_condition if condition is None else condition & next_condition
+    return condition
+
+
+def scan_recordings(filesystem: fs.FileSystem, root: str, keys: list[str],
+                    columns: list[str], plant_ids: list[int] = None, start: datetime = None,
+                    end: datetime = None) -> Iterator[pa.RecordBatch]:
+    """Yields the matching recordings from the archive files a batch at a time,
+    reading only the columns and row groups that are needed."""
+    dataset = ds.dataset([f"{root}/{key}" for key in keys], schema=ARCHIVE_SCHEMA,
+                         format="parquet", filesystem=filesystem)
+    yield from dataset.to_batches(columns=columns,
+                                  filter=recording_filter(plant_ids, start, end))
+
+
+def aggregate_batch(batch: pa.RecordBatch, metrics: list[str]) -> pa.Table:
+    """Returns the sum, count, min and max of each metric per plant and hour."""
+    table = pa.Table.from_batches([batch])
+    table = table.append_column("hour", pc.floor_temporal(table["recording_taken"], unit="hour"))
+    return table.group_by(["plant_id", "hour"]).aggregate(
+        [(metric, aggregate) for metric in metrics for aggregate in AGGREGATES])
+
+
+def merge_aggregates(tables: list[pa.Table], metrics: list[str]) -> pa.Table:
+    """Combines partial hourly aggregates into one row per plant and hour."""
+    names = [f"{metric}_{aggregate}" for metric in metrics for aggregate in AGGREGATES]
+    if not tables:
+        return pa.table({"plant_id": pa.array([], pa.int16()),
+                         "hour": pa.array([], pa.timestamp("us")),
+                         **{name: pa.array([], pa.int64() if name.endswith("_count")
+                                           else pa.float64()) for name in names}})
+
+    merged = pa.concat_tables(tables).group_by(["plant_id", "hour"]).aggregate(
+        [(f"{metric}_{aggregate}", MERGE_AGGREGATES[aggregate])
+         for metric in metrics for aggregate in AGGREGATES])
+    # group_by names each result <column>_<aggregation>, and puts the keys last.
+    return merged.select([*[f"{name}_{MERGE_AGGREGATES[name.rsplit('_', 1)[1]]}"
+                            for name in names], "plant_id", "hour"]).rename_columns(
+        [*names, "plant_id", "hour"])
+
+
+def cutting_bounds(file: dict, start: datetime, end: datetime) -> tuple[datetime, datetime]:
+    """
+    Returns the start and end that cut through an hour of the file, or None for either
+    that doesn't. Whole hours are left out of the scan and filtered once aggregated,
+    so the file's aggregates can be reused by any query. Only a bound within an hour
+    needs filtering by the scan.
+    """
+    def within_an_hour(bound: datetime) -> bool:
+        return bound is not None and bound != bound.replace(minute=0, second=0, microsecond=0)
+
+    first = datetime.fromisoformat(file["min_recording_taken"])
+    last = datetime.fromisoformat(file["max_recording_taken"])
+    return (start if within_an_hour(start) and first < start else None,
+            end if within_an_hour(end) and last >= end else None)
+
+
+def aggregate_file(filesystem: fs.FileSystem, root: str, file: dict,
+                   plant_ids: list[int], metrics: list[str],
+                   start: datetime = None, end: datetime = None) -> pa.Table:
+    """Returns the hourly aggregates of one archive file's recordings from start up to
+    end (by default all of them), from the cache if it has been read before.
+    Files only change if a run is repeated, which changes their size."""
+    cache_key = (file["key"], file["bytes"], file["rows"],
+                 tuple(sorted(plant_ids)) if plant_ids else None, tuple(metrics), start, end)
+
+    if cache_key not in QUERY_CACHE:
+        if len(QUERY_CACHE) >= int(ENV.get("QUERY_CACHE_FILES", 1000)):
+            QUERY_CACHE.pop(next(iter(QUERY_CACHE)))
+        QUERY_CACHE[cache_key] = merge_aggregates(
+            [aggregate_batch(batch, metrics)
+             for batch in scan_recordings(filesystem, root, [file["key"]],
+                                          ["plant_id", "recording_taken", *metrics], plant_ids,
+                                          start, end)
+             if batch.num_rows], metrics)
+
+    return QUERY_CACHE[cache_key]
+
+
+def hourly_aggregates(filesystem: fs.FileSystem, root: str, start: datetime, end: datetime,
+                      plant_ids: list[int] = None, metrics: list[str] = None) -> pd.DataFrame:
+    """
+    Returns the count, mean, min and max of each metric per plant for every hour
+    from start up to end, for the given plants or all of them. If start or end falls
+    within an hour, that hour only counts the recordings within the bounds.
+    Only the files the manifest says could match are read, and each file's
+    aggregates are cached, so repeating or widening a query only reads new files.
+    """
+    metrics = metrics or METRICS
+    plant_id = plant_ids[0] if plant_ids and len(plant_ids) == 1 else None
+    files = prune_files(read_archive_manifest(filesystem, root), plant_id, start, end)
+
+    hourly = merge_aggregates([aggregate_file(filesystem, root, file, plant_ids, metrics,
+                                              *cutting_bounds(file, start, end))
+                               for file in files], metrics).to_pandas()
+    first_hour = start.replace(minute=0, second=0, microsecond=0)
+    hourly = hourly[(hourly["hour"] >= first_hour) & (hourly["hour"] < end)].copy()
+
+    for metric in metrics:
+        hourly[f"{metric}_mean"] = hourly[f"{metric}_sum"] / hourly[f"{metric}_count"]
+
+    return hourly[["plant_id", "hour",
+                   *[f"{metric}_{aggregate}" for metric in metrics
+                     for aggregate in ["count", "mean", "min", "max"]]]
+                  ].sort_values(["plant_id", "hour"], ignore_index=True)
+
+
+if __name__ == "__main__":
+    # `python3 query.py PLANT_ID START END`, e.g. `python3 query.py 8 2024-10-01 2024-10-08`.
+    load_dotenv()
+    print(hourly_aggregates(get_archive_filesystem(), ENV["BUCKET_NAME"],
+                            datetime.fromisoformat(sys.argv[2]),
+                            datetime.fromisoformat(sys.argv[3]),
+                            plant_ids=[int(sys.argv[1])]).to_string())
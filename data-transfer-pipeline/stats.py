@@ -0,0 +1,47 @@
+"""Running statistics for the plant readings that can be merged a batch at a time."""
+import numpy as np
+import pandas as pd
+
+
+# The columns of the per-plant statistics for each metric.
+METRIC_PREFIXES = {"temp": "temperature", "soil_moisture": "soil_moisture"}
+
+# Each metric's histogram has fixed bins of (lowest edge, highest edge, width).
+# Readings outside the range are counted in the first or last bin.
+# The dashboard keeps a copy of these bins to read the histograms back.
+HISTOGRAM_BINS = {"temperature": (-20.0, 60.0, 1.0), "soil_moisture": (0.0, 100.0, 1.0)}
+HISTOGRAM_COLUMNS = ["plant_id", "metric", "bin", "bin_count"]
+
+
+def pooled_m2(partials: pd.DataFrame, prefix: str, pooled_mean: pd.Series) -> pd.Series:
+    """
+    Returns the sum of squared deviations of each plant's readings from the combined
+    partial statistics (Chan et al.): the partial sums plus each partial's count of
+    readings of the metric times the squared distance of its mean from the pooled mean.
+    pooled_mean must be indexed by plant_id.
+    """
+    spread = partials[f"new_{prefix}_count"] * (
+        partials[f"new_avg_{prefix}"] - partials["plant_id"].map(pooled_mean)) ** 2
+    return (partials[f"new_{prefix}_m2"].fillna(0) + spread.fillna(0)).groupby(
+        partials["plant_id"]).sum()
+
+
+def calculate_histograms(recordings: pd.DataFrame) -> pd.DataFrame:
+    """Returns the number of readings in each histogram bin for each plant and metric."""
+    histograms = []
+    for metric, (lowest, highest, width) in HISTOGRAM_BINS.items():
+        values = recordings[["plant_id", metric]].dropna()
+        bins = np.floor((values[metric].clip(lowest, highest - width / 2) - lowest) / width)
+        histograms.append(values.groupby(["plant_id", bins.astype(int).rename("bin")])
+                          .size().rename("bin_count").reset_index().assign(metric=metric))
+
+    return pd.concat(histograms, ignore_index=True)[HISTOGRAM_COLUMNS]
+
+
+def combine_histograms(partial_histograms: list[pd.DataFrame]) -> pd.DataFrame:
+    """Adds together the histograms calculated for each batch of recordings."""
+    if not partial_histograms:
+        return pd.DataFrame(columns=HISTOGRAM_COLUMNS)
+
+    return pd.concat(partial_histograms, ignore_index=True).groupby(
+        ["plant_id", "metric", "bin"], as_index=False)["bin_count"].sum()[HISTOGRAM_COLUMNS]
@@ -0,0 +1,138 @@
+# pylint: skip-file
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from botocore.exceptions import ClientError
+
+from archive import (split_partitions, partition_path, archive_key, compacted_key,
+                     read_manifest, read_manifest_version, write_manifest, add_to_manifest,
+                     prune_files, delete_keys, update_manifest)
+
+
+def manifest_entry(key, day, min_plant_id, max_plant_id, bucket=None, plant_buckets=0):
+    return {'key': key, 'year': 2024, 'month': 1, 'day': day, 'bucket': bucket,
+            'plant_buckets': plant_buckets, 'rows': 10, 'bytes': 100,
+            'min_plant_id': min_plant_id, 'max_plant_id': max_plant_id,
+            'min_recording_taken': f'2024-01-{day:02d}T00:00:00',
+            'max_recording_taken': f'2024-01-{day:02d}T23:59:00'}
+
+
+def test_split_partitions():
+    recordings = pd.DataFrame({
+        'plant_id': [1, 2, 3, 1],
+        'recording_taken': pd.to_datetime(['2024-01-01 23:59', '2024-01-01 23:59',
+                                           '2024-01-02 00:00', '2024-01-02 00:01'])
+    })
+
+    partitions = [(partition, len(rows)) for partition, rows in split_partitions(recordings)]
+    bucketed = [(partition, len(rows))
+                for partition, rows in split_partitions(recordings, plant_buckets=2)]
+
+    assert partitions == [((2024, 1, 1, None), 2), ((2024, 1, 2, None), 2)]
+    assert bucketed == [((2024, 1, 1, 1), 1), ((2024, 1, 1, 0), 1), ((2024, 1, 2, 1), 2)]
+
+
+def test_archive_key():
+    assert partition_path((2024, 1, 2, None)) == 'plant_recordings/year=2024/month=01/day=02'
+    assert archive_key((2024, 10, 2, 3), 'run') == \
+        'plant_recordings/year=2024/month=10/day=02/bucket=3/recording-run.parquet'
+    assert compacted_key(2024, 10, None, 'run', 2) == \
+        'plant_recordings/year=2024/month=10/compacted-run-002.parquet'
+
+
+def test_read_manifest_missing(fake_s3):
+    assert read_manifest(fake_s3, 'test-bucket') == {'files': []}
+
+
+def test_write_and_read_manifest(fake_s3):
+    manifest = {'files': [manifest_entry('a', 1, 1, 50)]}
+
+    write_manifest(fake_s3, 'test-bucket', manifest)
+
+    assert read_manifest(fake_s3, 'test-bucket') == manifest
+
+
+def test_write_manifest_if_match(fake_s3):
+    write_manifest(fake_s3, 'test-bucket', {'files': []})
+    _, etag = read_manifest_version(fake_s3, 'test-bucket')
+    write_manifest(fake_s3, 'test-bucket', {'files': [manifest_entry('a', 1, 1, 50)]})
+
+    with pytest.raises(ClientError):
+        write_manifest(fake_s3, 'test-bucket', {'files': []}, if_match=etag)
+
+    assert len(read_manifest(fake_s3, 'test-bucket')['files']) == 1
+
+
+def test_update_manifest_creates(fake_s3):
+    update_manifest(fake_s3, 'test-bucket', [manifest_entry('a', 1, 1, 50)])
+
+    assert [file['key'] for file in read_manifest(fake_s3, 'test-bucket')['files']] == ['a']
+
+
+def test_update_manifest_retries_after_concurrent_write(fake_s3):
+    write_manifest(fake_s3, 'test-bucket', {'files': [manifest_entry('original', 1, 1, 50)]})
+    read_object = fake_s3.get_object
+
+    def compact_after_first_read(**kwargs):
+        response = read_object(**kwargs)
+        if fake_s3.versions[('test-bucket', kwargs['Key'])] == 1:
+            write_manifest(fake_s3, 'test-bucket',
+                           {'files': [manifest_entry('compacted', 1, 1, 50)]})
+        return response
+
+    fake_s3.get_object = compact_after_first_read
+
+    update_manifest(fake_s3, 'test-bucket', [manifest_entry('new', 2, 1, 50)])
+
+    assert [file['key'] for file in read_manifest(fake_s3, 'test-bucket')['files']] == \
+        ['compacted', 'new']
+
+
+def test_update_manifest_gives_up(fake_s3, monkeypatch):
+    monkeypatch.setenv('ARCHIVE_MANIFEST_ATTEMPTS', '2')
+    write_manifest(fake_s3, 'test-bucket', {'files': []})
+    read_object = fake_s3.get_object
+
+    def always_changed(**kwargs):
+        response = read_object(**kwargs)
+        write_manifest(fake_s3, 'test-bucket', {'files': []})
+        return response
+
+    fake_s3.get_object = always_changed
+
+    with pytest.raises(ClientError):
+        update_manifest(fake_s3, 'test-bucket', [manifest_entry('new', 2, 1, 50)])
+
+
+def test_delete_keys(fake_s3):
+    for index in range(1500):
+        fake_s3.put_object(Bucket='test-bucket', Key=f'file-{index}', Body=b'')
+
+    delete_keys(fake_s3, 'test-bucket', [f'file-{index}' for index in range(1200)])
+
+    assert len(fake_s3.objects) == 300
+
+
+def test_add_to_manifest_replaces_same_key():
+    manifest = {'files': [manifest_entry('b', 2, 1, 50), manifest_entry('a', 1, 1, 50)]}
+
+    updated = add_to_manifest(manifest, [manifest_entry('b', 2, 1, 10)])
+
+    assert [file['key'] for file in updated['files']] == ['a', 'b']
+    assert updated['files'][1]['max_plant_id'] == 10
+
+
+def test_prune_files():
+    manifest = {'files': [manifest_entry('day1', 1, 1, 50),
+                          manifest_entry('day2', 2, 1, 20),
+                          manifest_entry('day3-bucket0', 3, 2, 50, bucket=0, plant_buckets=2),
+                          manifest_entry('day3-bucket1', 3, 1, 49, bucket=1, plant_buckets=2)]}
+
+    def keys(**kwargs):
+        return [file['key'] for file in prune_files(manifest, **kwargs)]
+
+    assert keys() == ['day1', 'day2', 'day3-bucket0', 'day3-bucket1']
+    assert keys(start=datetime(2024, 1, 2), end=datetime(2024, 1, 3)) == ['day2']
+    assert keys(plant_id=30) == ['day1', 'day3-bucket0']
+    assert keys(plant_id=31, start=datetime(2024, 1, 2, 12)) == ['day3-bucket1']
@@ -0,0 +1,109 @@
+# pylint: skip-file
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from checkpoint import find_unfinished_runs, start_run, set_stage, mark_stage, get_runs
+
+
+def fake_connection():
+    fake_conn = MagicMock()
+    fake_cursor = MagicMock()
+    fake_conn.cursor.return_value.__enter__.return_value = fake_cursor
+    return fake_conn, fake_cursor
+
+
+@patch.dict('checkpoint.ENV', {'SCHEMA_NAME': 'alpha'})
+def test_start_run_pins_cutoff_and_ids():
+    fake_conn, fake_cursor = fake_connection()
+    fake_cursor.fetchone.return_value = {'first_recording_id': 11, 'last_recording_id': 95}
+    cutoff_time = datetime(2024, 10, 1, 9, 30)
+
+    run = start_run(fake_conn, cutoff_time)
+
+    assert run == {'run_id': '20241001T093000-11', 'cutoff_time': cutoff_time,
+                   'first_recording_id': 11, 'last_recording_id': 95, 'stage': 'started'}
+    insert = fake_cursor.execute.call_args_list[1]
+    assert 'INSERT INTO alpha.transfer_checkpoint' in insert.args[0]
+    assert insert.args[1] == ('20241001T093000-11', cutoff_time, 11, 95, 'started')
+    fake_conn.commit.assert_called_once()
+
+
+@patch.dict('checkpoint.ENV', {'SCHEMA_NAME': 'alpha'})
+def test_start_run_nothing_to_transfer():
+    fake_conn, fake_cursor = fake_connection()
+    fake_cursor.fetchone.return_value = {'first_recording_id': None,
+                                         'last_recording_id': None}
+
+    assert start_run(fake_conn, datetime(2024, 10, 1)) is None
+    fake_conn.commit.assert_not_called()
+
+
+@patch.dict('checkpoint.ENV', {'SCHEMA_NAME': 'alpha'})
+def test_set_stage():
+    fake_cursor = MagicMock()
+
+    set_stage(fake_cursor, 'run-1', 'archived')
+
+    assert 'UPDATE alpha.transfer_checkpoint' in fake_cursor.execute.call_args.args[0]
+    assert fake_cursor.execute.call_args.args[1] == ('archived', 'run-1')
+
+
+def test_set_stage_unknown():
+    fake_cursor = MagicMock()
+
+    with pytest.raises(ValueError):
+        set_stage(fake_cursor, 'run-1', 'archive')
+
+    fake_cursor.execute.assert_not_called()
+
+
+@patch('checkpoint.create_connection')
+def test_mark_stage_unknown(fake_create_connection):
+    with pytest.raises(ValueError):
+        mark_stage('run-1', 'finished')
+
+    fake_create_connection.assert_not_called()
+
+
+@patch.dict('checkpoint.ENV', {'SCHEMA_NAME': 'alpha'})
+def test_find_unfinished_runs_returns_every_run():
+    fake_conn, fake_cursor = fake_connection()
+    runs = [{'run_id': 'older', 'stage': 'started'}, {'run_id': 'old', 'stage': 'archived'}]
+    fake_cursor.fetchall.return_value = runs
+
+    assert find_unfinished_runs(fake_conn) == runs
+    query = fake_cursor.execute.call_args.args[0]
+    assert 'TOP' not in query
+    assert 'ORDER BY cutoff_time' in query
+    assert fake_cursor.execute.call_args.args[1] == ('deleted',)
+
+
+@patch('checkpoint.start_run')
+@patch('checkpoint.find_unfinished_runs')
+@patch('checkpoint.create_connection')
+def test_get_runs_resumes_unfinished_runs_first(fake_create_connection, fake_find, fake_start):
+    unfinished = [{'run_id': 'older', 'stage': 'started'},
+                  {'run_id': 'old', 'stage': 'archived'}]
+    fake_find.return_value = unfinished
+    fake_start.return_value = {'run_id': 'new', 'stage': 'started'}
+
+    assert list(get_runs(datetime(2024, 10, 2))) == [*unfinished, fake_start.return_value]
+    assert fake_create_connection.return_value.close.call_count == 2
+
+
+@patch('checkpoint.start_run')
+@patch('checkpoint.find_unfinished_runs')
+@patch('checkpoint.create_connection')
+def test_get_runs_starts_new_run_after_unfinished_runs(fake_create_connection, fake_find,
+                                                       fake_start):
+    fake_find.return_value = [{'run_id': 'old', 'stage': 'archived'}]
+    fake_start.return_value = None
+
+    runs = get_runs(datetime(2024, 10, 2))
+    assert next(runs)['run_id'] == 'old'
+    fake_start.assert_not_called()
+
+    assert list(runs) == []
+    fake_start.assert_called_once()
@@ -1,64 +1,48 @@
 from unittest.mock import patch, MagicMock
+import numpy as np
 import pandas as pd
+import pytest
 
-from clean import delete_outdataed_recordings, fetch_current_averages, update_plant_average, \
-    insert_new_plant_average, calculate_new_averages, process_and_update_averages
+from clean import delete_archived_recordings, \
+    delete_old_minute_rollups, \
+    calculate_new_averages, \
+    process_and_update_averages, combine_averages, update_averages, stage_statement, \
+    merge_averages_statement, AVERAGE_COLUMNS
 
 
+@patch.dict('clean.ENV', {'SCHEMA_NAME': 'alpha', 'DELETE_BATCH_PAUSE_SECONDS': '0.5'})
+@patch('clean.sleep')
 @patch('clean.create_connection')
-def test_delete_outdated_recordings(fake_create_connection):
-    fake_conn = MagicMock()
-    fake_create_connection.return_value = fake_conn
-    fake_cursor = MagicMock()
-    fake_conn.cursor.return_value.__enter__.return_value = fake_cursor
-
-    delete_outdataed_recordings()
-
-    assert fake_cursor.execute.called
-    assert fake_conn.commit.called
-
-
-@patch('clean.create_connection')
-def test_fetch_current_averages(fake_create_connection):
-    fake_conn = MagicMock()
-    fake_create_connection.return_value = fake_conn
-    fake_cursor = MagicMock()
-    fake_conn.cursor.return_value.__enter__.return_value = fake_cursor
-
-    fake_cursor.fetchone.return_value = (25.0, 30.0, 100)
-
-    result = fetch_current_averages(fake_conn, plant_id=1)
-
-    assert fake_cursor.execute.called
-    assert result == (25.0, 30.0, 100)
-
-
-@patch('clean.create_connection')
-def test_update_plant_average(fake_create_connection):
-    fake_conn = MagicMock()
-    fake_create_connection.return_value = fake_conn
-    fake_cursor = MagicMock()
-    fake_conn.cursor.return_value.__enter__.return_value = fake_cursor
+def test_delete_archived_recordings_in_id_windows(fake_create_connection, fake_sleep):
+    fake_conn = fake_create_connection.return_value
+    fake_cursor = fake_conn.cursor.return_value.__enter__.return_value
+    fake_cursor.rowcount = 40
+    cutoff_time = pd.Timestamp('2024-10-01')
 
-    update_plant_average(fake_conn, plant_id=1, avg_temp=22.5,
-                         avg_soil_moisture=40.0, recordings=50)
+    progress = delete_archived_recordings(cutoff_time, (5, 254), batch_size=100)
 
-    assert fake_cursor.execute.called
-    assert fake_conn.commit.called
+    assert [call.args[1] for call in fake_cursor.execute.call_args_list] == [
+        (5, 104, cutoff_time), (105, 204, cutoff_time), (205, 254, cutoff_time)]
+    assert 'recording_id BETWEEN %s AND %s' in fake_cursor.execute.call_args.args[0]
+    assert (progress['rows'], progress['batches']) == (120, 3)
+    assert fake_conn.commit.call_count == 3
+    fake_sleep.assert_called_with(0.5)
+    fake_conn.close.assert_called_once()
 
 
+@patch.dict('clean.ENV', {'SCHEMA_NAME': 'alpha'})
 @patch('clean.create_connection')
-def test_insert_new_plant_average(fake_create_connection):
-    fake_conn = MagicMock()
-    fake_create_connection.return_value = fake_conn
-    fake_cursor = MagicMock()
-    fake_conn.cursor.return_value.__enter__.return_value = fake_cursor
+def test_delete_old_minute_rollups(fake_create_connection):
+    fake_cursor = fake_create_connection.return_value.cursor.return_value.__enter__.return_value
+    fake_cursor.rowcount = 12
+    cutoff_time = pd.Timestamp('2024-10-01')
 
-    insert_new_plant_average(
-        fake_conn, plant_id=1, avg_temp=22.5, avg_soil_moisture=40.0, recordings=50)
+    progress = delete_old_minute_rollups(cutoff_time, batch_size=100)
 
-    assert fake_cursor.execute.called
-    assert fake_conn.commit.called
+    query, params = fake_cursor.execute.call_args.args
+    assert 'DELETE TOP (%s) FROM alpha.recording_minute' in query
+    assert params == (100, cutoff_time)
+    assert progress['rows'] == 12
 
 
 def test_calculate_new_averages():
@@ -75,27 +59,29 @@ def test_calculate_new_averages():
         'plant_id': [1, 2],
         'new_avg_temp': [25.5, 31.0],
         'new_avg_soil_moisture': [41.0, 51.0],
-        'new_recordings': [2, 2]
+        'new_recordings': [2, 2],
+        'new_temp_count': [2, 2],
+        'new_soil_moisture_count': [2, 2],
+        'new_temp_m2': [0.5, 2.0],
+        'new_soil_moisture_m2': [2.0, 2.0],
+        'new_min_temp': [25.0, 30.0],
+        'new_max_temp': [26.0, 32.0],
+        'new_min_soil_moisture': [40.0, 50.0],
+        'new_max_soil_moisture': [42.0, 52.0]
     }
     expected_df = pd.DataFrame(expected_data)
 
     pd.testing.assert_frame_equal(result_df, expected_df)
 
 
+@patch.dict('clean.ENV', {'SCHEMA_NAME': 'alpha'})
 @patch('clean.create_connection')
-@patch('clean.fetch_current_averages')
-@patch('clean.update_plant_average')
-@patch('clean.insert_new_plant_average')
-def test_process_and_update_averages(mock_insert_new, mock_update, mock_fetch_current, mock_create_connection):
+def test_process_and_update_averages(mock_create_connection):
 
     fake_conn = MagicMock()
     mock_create_connection.return_value = fake_conn
-
-    mock_fetch_current.side_effect = [
-        {'average_temperature': 25.0,
-            'average_soil_moisture': 40.0, 'recording_count': 100},
-        None
-    ]
+    fake_cursor = MagicMock()
+    fake_conn.cursor.return_value.__enter__.return_value = fake_cursor
 
     data = {
         'plant_id': [1, 2],
@@ -106,11 +92,161 @@ def test_process_and_update_averages(mock_insert_new, mock_update, mock_fetch_cu
 
     process_and_update_averages(recordings)
 
-    mock_fetch_current.assert_any_call(fake_conn, 1)
-    mock_fetch_current.assert_any_call(fake_conn, 2)
+    statements = [call.args[0] for call in fake_cursor.execute.call_args_list]
+    assert len(statements) == 8
+    assert 'CREATE TABLE #plant_average_staging' in statements[0]
+    assert 'INSERT INTO #plant_average_staging' in statements[1]
+    assert fake_cursor.execute.call_args_list[1].args[1] == (
+        1, 26.0, 42.0, 1, 1, 1, 0.0, 0.0, 26.0, 26.0, 42.0, 42.0,
+        2, 32.0, 52.0, 1, 1, 1, 0.0, 0.0, 32.0, 32.0, 52.0, 52.0)
+    assert 'MERGE alpha.plant_average' in statements[2]
+    assert 'DROP TABLE #plant_average_staging' in statements[3]
+    assert 'CREATE TABLE #plant_histogram_staging' in statements[4]
+    assert fake_cursor.execute.call_args_list[5].args[1] == (
+        1, 'temperature', 46, 1, 2, 'temperature', 52, 1,
+        1, 'soil_moisture', 42, 1, 2, 'soil_moisture', 52, 1)
+    assert 'MERGE alpha.plant_histogram' in statements[6]
 
-    assert mock_update.called
+    fake_conn.commit.assert_called_once()
+    fake_conn.close.assert_called_once()
+
+
+@patch.dict('clean.ENV', {'SCHEMA_NAME': 'alpha'})
+@patch('clean.create_connection')
+def test_update_averages_stages_in_batches(mock_create_connection):
+    fake_conn = MagicMock()
+    mock_create_connection.return_value = fake_conn
+    fake_cursor = MagicMock()
+    fake_conn.cursor.return_value.__enter__.return_value = fake_cursor
 
-    assert mock_insert_new.called
+    grouped_df = pd.DataFrame({
+        'plant_id': range(1500),
+        'new_avg_temp': [20.0] * 1499 + [None],
+        'new_avg_soil_moisture': 50.0,
+        'new_recordings': 3
+    }).reindex(columns=AVERAGE_COLUMNS)
 
+    update_averages(grouped_df)
+
+    stages = [call.args[1] for call in fake_cursor.execute.call_args_list
+              if 'INSERT INTO #plant_average_staging' in call.args[0]]
+    assert [len(params) for params in stages] == [12000, 6000]
+    assert stages[1][-11] is None
+    assert type(stages[0][0]) is int
     fake_conn.commit.assert_called_once()
+
+
+@patch.dict('clean.ENV', {'SCHEMA_NAME': 'alpha'})
+@patch('clean.create_connection')
+def test_update_averages_rolls_back_on_error(mock_create_connection):
+    fake_conn = MagicMock()
+    mock_create_connection.return_value = fake_conn
+    fake_cursor = MagicMock()
+    fake_conn.cursor.return_value.__enter__.return_value = fake_cursor
+    fake_cursor.execute.side_effect = [None, None, Exception("Deadlock")]
+
+    with pytest.raises(Exception):
+        update_averages(pd.DataFrame({'plant_id': [1], 'new_avg_temp': [20.0],
+                                      'new_avg_soil_moisture': [50.0], 'new_recordings': [3]})
+                        .reindex(columns=AVERAGE_COLUMNS))
+
+    fake_conn.rollback.assert_called_once()
+    fake_conn.commit.assert_not_called()
+    fake_conn.close.assert_called_once()
+
+
+@patch.dict('clean.ENV', {'SCHEMA_NAME': 'alpha'})
+@patch.dict('checkpoint.ENV', {'SCHEMA_NAME': 'alpha'})
+@patch('clean.create_connection')
+def test_update_averages_checkpoints_run_in_same_transaction(mock_create_connection):
+    fake_conn = mock_create_connection.return_value
+    fake_cursor = fake_conn.cursor.return_value.__enter__.return_value
+
+    update_averages(pd.DataFrame(columns=AVERAGE_COLUMNS), run_id='run-1')
+
+    fake_cursor.execute.assert_called_once()
+    assert 'UPDATE alpha.transfer_checkpoint' in fake_cursor.execute.call_args.args[0]
+    assert fake_cursor.execute.call_args.args[1] == ('averaged', 'run-1')
+    fake_conn.commit.assert_called_once()
+
+
+def test_stage_statement():
+    statement = stage_statement('#staging', ['a', 'b'], 3)
+
+    assert statement.startswith('INSERT INTO #staging (a, b) VALUES')
+    assert statement.count('(%s, %s)') == 3
+
+
+def test_combine_averages():
+    first = calculate_new_averages(pd.DataFrame({
+        'plant_id': [1, 1, 2],
+        'temperature': [25.0, 26.0, 30.0],
+        'soil_moisture': [40.0, 42.0, 50.0]
+    }))
+    second = calculate_new_averages(pd.DataFrame({
+        'plant_id': [2, 3],
+        'temperature': [32.0, 10.0],
+        'soil_moisture': [52.0, 60.0]
+    }))
+
+    result_df = combine_averages([first, second])
+
+    expected_df = pd.DataFrame({
+        'plant_id': [1, 2, 3],
+        'new_avg_temp': [25.5, 31.0, 10.0],
+        'new_avg_soil_moisture': [41.0, 51.0, 60.0],
+        'new_recordings': [2, 2, 1],
+        'new_temp_count': [2, 2, 1],
+        'new_soil_moisture_count': [2, 2, 1],
+        'new_temp_m2': [0.5, 2.0, 0.0],
+        'new_soil_moisture_m2': [2.0, 2.0, 0.0],
+        'new_min_temp': [25.0, 30.0, 10.0],
+        'new_max_temp': [26.0, 32.0, 10.0],
+        'new_min_soil_moisture': [40.0, 50.0, 60.0],
+        'new_max_soil_moisture': [42.0, 52.0, 60.0]
+    })
+
+    pd.testing.assert_frame_equal(result_df, expected_df)
+
+
+def test_combine_averages_matches_single_pass():
+    rng = np.random.default_rng(3)
+    recordings = pd.DataFrame({'plant_id': rng.integers(0, 5, 10_000),
+                               'temperature': rng.normal(20, 5, 10_000),
+                               'soil_moisture': rng.uniform(0, 100, 10_000)})
+
+    combined = combine_averages([calculate_new_averages(recordings[start:start + 999])
+                                 for start in range(0, 10_000, 999)])
+
+    pd.testing.assert_frame_equal(combined, calculate_new_averages(recordings))
+
+
+def test_combine_averages_with_missing_readings():
+    rng = np.random.default_rng(5)
+    recordings = pd.DataFrame({'plant_id': rng.integers(0, 5, 10_000),
+                               'temperature': rng.normal(20, 5, 10_000),
+                               'soil_moisture': rng.uniform(0, 100, 10_000)})
+    recordings.loc[rng.random(10_000) < 0.3, 'temperature'] = None
+    recordings.loc[:4_999, 'soil_moisture'] = None
+
+    combined = combine_averages([calculate_new_averages(recordings[start:start + 999])
+                                 for start in range(0, 10_000, 999)])
+
+    pd.testing.assert_frame_equal(combined, calculate_new_averages(recordings))
+    assert (combined['new_temp_count'] < combined['new_recordings']).all()
+    assert np.allclose(combined['new_avg_temp'],
+                       recordings.groupby('plant_id')['temperature'].mean())
+
+
+def test_merge_averages_weights_by_readings():
+    with patch.dict('clean.ENV', {'SCHEMA_NAME': 'alpha'}):
+        statement = merge_averages_statement()
+
+    assert 't.temperature_count + s.new_temp_count' in statement
+    assert 't.soil_moisture_count + s.new_soil_moisture_count' in statement
+    assert 't.recording_count + s.new_recordings' in statement
+    assert 'NULLIF(t.temperature_count + s.new_temp_count, 0)' in statement
+
+
+def test_combine_averages_no_batches():
+    assert combine_averages([]).empty
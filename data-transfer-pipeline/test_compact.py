@@ -0,0 +1,135 @@
+# pylint: skip-file
+from io import BytesIO
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from botocore.exceptions import ClientError
+
+from archive import read_manifest, write_manifest, add_to_manifest
+from compact import plan_compaction, read_footer_row_count, compact_month
+from extract import RECORDING_DTYPES
+from load import write_partitions
+
+
+def fake_month(days: int, per_day: int = 48, plant_buckets: int = 0):
+    ids = np.arange(days * per_day)
+    recordings = pd.DataFrame({
+        'recording_id': ids, 'plant_id': ids % 7,
+        'recording_taken': pd.Timestamp('2024-10-01') + pd.to_timedelta(ids * 86400 // per_day,
+                                                                         unit='s'),
+        'last_watered': pd.NaT, 'soil_moisture': ids % 100 * 1.0, 'temperature': ids % 40 * 1.0
+    }).astype(RECORDING_DTYPES)
+    return recordings
+
+
+def archive_month(fake_s3, recordings, plant_buckets=0, run_id='daily'):
+    files = write_partitions(fake_s3, 'test-bucket', [recordings], run_id, plant_buckets)
+    write_manifest(fake_s3, 'test-bucket',
+                   add_to_manifest(read_manifest(fake_s3, 'test-bucket'), files))
+    return files
+
+
+def read_all(fake_s3, files):
+    return pd.concat([pq.read_table(BytesIO(fake_s3.objects[('test-bucket', file['key'])]))
+                      .to_pandas() for file in files], ignore_index=True)
+
+
+def test_plan_compaction():
+    manifest = {'files': [
+        {'key': 'a', 'year': 2024, 'month': 10, 'bucket': None, 'bytes': 10,
+         'min_recording_taken': '2024-10-02T00:00:00'},
+        {'key': 'b', 'year': 2024, 'month': 10, 'bucket': None, 'bytes': 10,
+         'min_recording_taken': '2024-10-01T00:00:00'},
+        {'key': 'big', 'year': 2024, 'month': 10, 'bucket': None, 'bytes': 1000,
+         'min_recording_taken': '2024-10-03T00:00:00'},
+        {'key': 'alone', 'year': 2024, 'month': 10, 'bucket': 1, 'bytes': 10,
+         'min_recording_taken': '2024-10-01T00:00:00'},
+        {'key': 'other month', 'year': 2024, 'month': 9, 'bucket': None, 'bytes': 10,
+         'min_recording_taken': '2024-09-01T00:00:00'}]}
+
+    plan = plan_compaction(manifest, 2024, 10, target_bytes=100)
+
+    assert {bucket: [file['key'] for file in files] for bucket, files in plan.items()} == \
+        {None: ['b', 'a']}
+
+
+def test_read_footer_row_count(fake_s3):
+    (file,) = archive_month(fake_s3, fake_month(1))
+
+    assert read_footer_row_count(fake_s3, 'test-bucket', file['key']) == 48
+
+
+def test_compact_month(fake_s3):
+    recordings = fake_month(30)
+    originals = archive_month(fake_s3, recordings)
+
+    summary = compact_month(fake_s3, 'test-bucket', 2024, 10, 'compaction')
+
+    manifest = read_manifest(fake_s3, 'test-bucket')
+    assert summary == {'files_replaced': 30, 'files_written': 1, 'rows': 30 * 48}
+    assert [file['key'] for file in manifest['files']] == \
+        ['plant_recordings/year=2024/month=10/compacted-compaction-000.parquet']
+    assert manifest['files'][0]['day'] is None
+    assert manifest['files'][0]['min_recording_taken'] == '2024-10-01T00:00:00'
+    for file in originals:
+        assert ('test-bucket', file['key']) not in fake_s3.objects
+
+    compacted = read_all(fake_s3, manifest['files'])
+    pd.testing.assert_frame_equal(
+        compacted.sort_values('recording_id', ignore_index=True), recordings)
+
+
+@patch.dict('os.environ', {'ARCHIVE_COMPACT_TARGET_MB': '0.004',
+                           'ARCHIVE_COMPACT_ROW_GROUP_ROWS': '24'})
+def test_compact_month_target_size(fake_s3):
+    archive_month(fake_s3, fake_month(10), plant_buckets=2)
+
+    summary = compact_month(fake_s3, 'test-bucket', 2024, 10, 'compaction')
+
+    manifest = read_manifest(fake_s3, 'test-bucket')
+    assert summary['files_replaced'] == 20
+    assert summary['files_written'] > 2
+    assert sum(file['rows'] for file in manifest['files']) == 480
+    assert {file['bucket'] for file in manifest['files']} == {0, 1}
+    for file in manifest['files']:
+        assert '/bucket=' in file['key']
+
+
+@patch('compact.read_footer_row_count')
+def test_compact_month_keeps_originals_if_counts_differ(fake_count, fake_s3):
+    fake_count.return_value = 1
+    originals = archive_month(fake_s3, fake_month(3))
+    manifest = read_manifest(fake_s3, 'test-bucket')
+
+    with pytest.raises(ValueError):
+        compact_month(fake_s3, 'test-bucket', 2024, 10, 'compaction')
+
+    assert read_manifest(fake_s3, 'test-bucket') == manifest
+    assert len(fake_s3.objects) == len(originals) + 1
+
+
+def test_compact_month_manifest_changed(fake_s3):
+    originals = archive_month(fake_s3, fake_month(3))
+
+    def add_day_while_compacting(*args, **kwargs):
+        archive_month(fake_s3, fake_month(4)[-48:], run_id='late')
+        return 48 * 3
+
+    with patch('compact.verify_compacted', side_effect=add_day_while_compacting):
+        with pytest.raises(ClientError):
+            compact_month(fake_s3, 'test-bucket', 2024, 10, 'compaction')
+
+    manifest = read_manifest(fake_s3, 'test-bucket')
+    assert len(manifest['files']) == 4
+    assert len(fake_s3.objects) == len(originals) + 2
+
+
+def test_compact_month_nothing_to_do(fake_s3):
+    archive_month(fake_s3, fake_month(1))
+
+    summary = compact_month(fake_s3, 'test-bucket', 2024, 10, 'compaction')
+
+    assert summary == {'files_replaced': 0, 'files_written': 0, 'rows': 0}
@@ -1,9 +1,10 @@
 # pylint: skip-file
+from datetime import datetime
 from unittest.mock import patch, MagicMock
 
 import pandas as pd
 
-from extract import extract_recordings, create_connection
+from extract import extract_recordings, extract_recording_batches, create_connection
 
 
 @patch('pymssql.connect')
@@ -37,17 +38,18 @@ def test_extract_recordings(fake_create_connection):
     fake_create_connection.return_value = fake_conn
     fake_conn.cursor.return_value.__enter__.return_value = fake_cursor
 
-    fake_cursor.fetchall.return_value = [
+    fake_cursor.fetchmany.side_effect = [[
         {'recording_id': 1, 'plant_id': 1, 'recording_taken': '2024-01-01 12:00:00',
             'last_watered': '2024-01-01 08:00:00', 'soil_moisture': 80.5, 'temperature': 20.3},
         {'recording_id': 2, 'plant_id': 2, 'recording_taken': '2024-01-01 13:00:00',
             'last_watered': '2024-01-01 09:00:00', 'soil_moisture': 82.1, 'temperature': 21.5},
-    ]
+    ], []]
 
     result = extract_recordings()
 
     assert fake_cursor.execute.called
-    assert fake_cursor.fetchall.called
+    assert fake_cursor.fetchmany.called
+    assert not fake_cursor.fetchall.called
 
     assert isinstance(result, pd.DataFrame)
     assert len(result) == 2
@@ -57,3 +59,51 @@ def test_extract_recordings(fake_create_connection):
     assert 'last_watered' in result.columns
     assert 'soil_moisture' in result.columns
     assert 'temperature' in result.columns
+
+
+@patch('extract.create_connection')
+def test_extract_recording_batches(fake_create_connection):
+    fake_conn = MagicMock()
+    fake_cursor = MagicMock()
+    fake_create_connection.return_value = fake_conn
+    fake_conn.cursor.return_value.__enter__.return_value = fake_cursor
+
+    rows = [{'recording_id': i, 'plant_id': i % 3, 'recording_taken': '2024-01-01 12:00:00',
+             'last_watered': None, 'soil_moisture': None, 'temperature': 20.0}
+            for i in range(5)]
+    fake_cursor.fetchmany.side_effect = [rows[:2], rows[2:4], rows[4:], []]
+
+    batches = list(extract_recording_batches(chunk_size=2))
+
+    fake_cursor.fetchmany.assert_called_with(2)
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert str(batches[0]['plant_id'].dtype) == 'int16'
+    assert str(batches[0]['last_watered'].dtype) == 'datetime64[us]'
+    assert str(batches[0]['soil_moisture'].dtype) == 'float64'
+    fake_conn.close.assert_called_once()
+
+
+@patch('extract.create_connection')
+def test_extract_recording_batches_id_range(fake_create_connection):
+    fake_cursor = fake_create_connection.return_value.cursor.return_value.__enter__.return_value
+    fake_cursor.fetchmany.return_value = []
+    cutoff_time = datetime(2024, 1, 2)
+
+    list(extract_recording_batches(cutoff_time, id_range=(10, 20)))
+
+    query, params = fake_cursor.execute.call_args.args
+    assert 'recording_id BETWEEN %s AND %s' in query
+    assert params == (cutoff_time, 10, 20)
+
+
+@patch('extract.create_connection')
+def test_extract_recordings_empty(fake_create_connection):
+    fake_conn = MagicMock()
+    fake_create_connection.return_value = fake_conn
+    fake_conn.cursor.return_value.__enter__.return_value.fetchmany.return_value = []
+
+    result = extract_recordings()
+
+    assert result.empty
+    assert list(result.columns) == ['recording_id', 'plant_id', 'recording_taken',
+                                    'last_watered', 'soil_moisture', 'temperature']
@@ -1,9 +1,26 @@
 # pylint: skip-file
-from unittest.mock import patch, MagicMock
+from io import BytesIO
+from unittest.mock import patch
 
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from botocore.exceptions import ClientError
 
-from load import load_to_s3
+from archive import MANIFEST_KEY, read_manifest
+from extract import to_batch, RECORDING_DTYPES
+from load import load_to_s3, write_partitions, ArchiveFile, MultipartUpload, MEGABYTE
+
+
+def fake_batch(size: int, start: int = 0, seconds_apart: int = 1) -> pd.DataFrame:
+    rng = np.random.default_rng(start)
+    ids = np.arange(start, start + size)
+    return pd.DataFrame({'recording_id': ids, 'plant_id': ids % 50,
+                         'recording_taken': pd.Timestamp('2024-01-01')
+                         + pd.to_timedelta(ids * seconds_apart, unit='s'),
+                         'last_watered': pd.NaT, 'soil_moisture': rng.uniform(0, 100, size),
+                         'temperature': rng.uniform(0, 40, size)}).astype(RECORDING_DTYPES)
 
 
 @patch('load.client')
@@ -12,24 +29,164 @@ from load import load_to_s3
     'AWS_SECRET_KEY': 'fake_secret_key',
     'BUCKET_NAME': 'test-bucket'
 })
-def test_load_to_s3(fake_boto_client):
-    fake_s3_client = MagicMock()
-    fake_boto_client.return_value = fake_s3_client
+def test_load_to_s3(fake_boto_client, fake_s3):
+    fake_boto_client.return_value = fake_s3
 
-    df = pd.DataFrame({
-        'recording_id': [1],
-        'plant_id': [1],
-        'recording_taken': ['2024-01-01 12:00:00'],
-        'last_watered': ['2024-01-01 08:00:00'],
-        'soil_moisture': [80.5],
-        'temperature': [20.3]
-    })
+    df = to_batch([{
+        'recording_id': 1,
+        'plant_id': 1,
+        'recording_taken': '2024-01-01 12:00:00',
+        'last_watered': '2024-01-01 08:00:00',
+        'soil_moisture': 80.5,
+        'temperature': 20.3
+    }])
 
-    load_to_s3(df)
+    load_to_s3(df, run_id='run')
 
     fake_boto_client.assert_called_once_with(
         service_name='s3',
         aws_access_key_id='fake_access_key',
-        aws_secret_access_key='fake_secret_key'
+        aws_secret_access_key='fake_secret_key',
+        endpoint_url=None
     )
-    fake_s3_client.upload_fileobj.assert_called_once()
+    assert set(fake_s3.objects) == {
+        ('test-bucket', 'plant_recordings/year=2024/month=01/day=01/recording-run.parquet'),
+        ('test-bucket', MANIFEST_KEY)}
+
+
+@patch('load.get_s3_client')
+@patch.dict('os.environ', {'BUCKET_NAME': 'test-bucket', 'ARCHIVE_PART_SIZE_MB': '5'})
+def test_load_to_s3_multipart(fake_get_s3_client, fake_s3):
+    fake_get_s3_client.return_value = fake_s3
+
+    rows = load_to_s3((fake_batch(100_000, start, seconds_apart=0)
+                       for start in range(0, 1_000_000, 100_000)), run_id='run')
+
+    assert rows == 1_000_000
+    assert not fake_s3.uploads
+    assert len(fake_s3.objects) == 2
+    body = fake_s3.objects[('test-bucket',
+                            'plant_recordings/year=2024/month=01/day=01/recording-run.parquet')]
+    assert len(body) > 5 * MEGABYTE
+
+    parquet = pq.ParquetFile(BytesIO(body))
+    assert parquet.metadata.num_rows == 1_000_000
+    assert parquet.metadata.num_row_groups == 10
+    assert parquet.metadata.row_group(0).column(0).compression == 'ZSTD'
+    assert parquet.metadata.row_group(0).column(0).statistics.has_min_max
+
+
+@patch('load.get_s3_client')
+@patch.dict('os.environ', {'BUCKET_NAME': 'test-bucket', 'ARCHIVE_PART_SIZE_MB': '5'})
+def test_load_to_s3_aborts_on_failure(fake_get_s3_client, fake_s3):
+    fake_get_s3_client.return_value = fake_s3
+
+    def failing_batches():
+        for start in range(0, 1_000_000, 100_000):
+            yield fake_batch(100_000, start, seconds_apart=0)
+        raise ConnectionError("Lost the database")
+
+    with pytest.raises(ConnectionError):
+        load_to_s3(failing_batches())
+
+    assert not fake_s3.objects
+    assert not fake_s3.uploads
+    assert len(fake_s3.aborted) == 1
+
+
+@patch.dict('os.environ', {'ARCHIVE_PART_SIZE_MB': '5'})
+def test_write_partitions_aborts_failed_close(fake_s3):
+    def failing_complete(**kwargs):
+        raise ClientError({'Error': {'Code': 'InternalError', 'Message': 'S3 failed'}},
+                          'CompleteMultipartUpload')
+    fake_s3.complete_multipart_upload = failing_complete
+    batches = [fake_batch(100_000, start, seconds_apart=0)
+               for start in range(0, 1_000_000, 100_000)]
+
+    with pytest.raises(ClientError):
+        write_partitions(fake_s3, 'test-bucket', batches, 'run')
+
+    assert not fake_s3.uploads
+    assert len(fake_s3.aborted) == 1
+
+
+def test_multipart_upload_part_sizes(fake_s3):
+    upload = MultipartUpload(fake_s3, 'test-bucket', 'key', part_size=5 * MEGABYTE)
+
+    for _ in range(12):
+        upload.write(b'x' * MEGABYTE)
+    (part_sizes,) = [[len(part) for part in parts.values()] for parts in fake_s3.uploads.values()]
+    upload.close()
+
+    assert part_sizes == [5 * MEGABYTE, 5 * MEGABYTE]
+    assert upload.tell() == 12 * MEGABYTE
+    assert fake_s3.objects[('test-bucket', 'key')] == b'x' * 12 * MEGABYTE
+
+
+def test_multipart_upload_small_file(fake_s3):
+    upload = MultipartUpload(fake_s3, 'test-bucket', 'key')
+
+    upload.write(b'small')
+    upload.close()
+    upload.close()
+
+    assert fake_s3.objects == {('test-bucket', 'key'): b'small'}
+
+
+def test_archive_file(fake_s3):
+    archive_file = ArchiveFile(fake_s3, 'test-bucket', 'key', (2024, 1, 1, None))
+
+    archive_file.write(fake_batch(3))
+    archive_file.write(fake_batch(2, 3))
+    entry = archive_file.close()
+
+    parquet = pq.ParquetFile(BytesIO(fake_s3.objects[('test-bucket', 'key')]))
+    assert parquet.metadata.num_row_groups == 2
+    assert parquet.metadata.num_rows == 5
+    assert entry['rows'] == 5
+    assert entry['bytes'] == len(fake_s3.objects[('test-bucket', 'key')])
+    assert (entry['min_plant_id'], entry['max_plant_id']) == (0, 4)
+    assert entry['min_recording_taken'] == '2024-01-01T00:00:00'
+    assert entry['max_recording_taken'] == '2024-01-01T00:00:04'
+    assert (entry['year'], entry['month'], entry['day'], entry['bucket']) == (2024, 1, 1, None)
+
+
+def test_write_partitions(fake_s3):
+    # Four days of recordings, one every hour, in batches that cross midnight.
+    recordings = fake_batch(96, seconds_apart=3600)
+    batches = [recordings[start:start + 30] for start in range(0, 96, 30)]
+
+    files = write_partitions(fake_s3, 'test-bucket', batches, 'run', plant_buckets=4)
+
+    assert len(files) == 16
+    assert sum(file['rows'] for file in files) == 96
+    assert files[0]['key'] == \
+        'plant_recordings/year=2024/month=01/day=01/bucket=0/recording-run.parquet'
+    for file in files:
+        rows = pq.read_table(BytesIO(fake_s3.objects[('test-bucket', file['key'])])).to_pandas()
+        assert (rows['plant_id'] % 4 == file['bucket']).all()
+        assert (rows['recording_taken'].dt.day == file['day']).all()
+
+
+def test_write_partitions_unsorted(fake_s3):
+    recordings = fake_batch(48, seconds_apart=3600)
+
+    with pytest.raises(ValueError):
+        write_partitions(fake_s3, 'test-bucket', [recordings[24:], recordings[:24]], 'run')
+
+    assert not fake_s3.uploads
+    assert not fake_s3.objects
+
+
+@patch('load.get_s3_client')
+@patch.dict('os.environ', {'BUCKET_NAME': 'test-bucket'})
+def test_load_to_s3_updates_manifest(fake_get_s3_client, fake_s3):
+    fake_get_s3_client.return_value = fake_s3
+
+    load_to_s3(fake_batch(48, seconds_apart=3600), run_id='first')
+    load_to_s3(fake_batch(24, seconds_apart=3600), run_id='first')
+    load_to_s3(fake_batch(24, seconds_apart=3600), run_id='second')
+
+    manifest = read_manifest(fake_s3, 'test-bucket')
+    assert [(file['day'], file['rows']) for file in manifest['files']] == \
+        [(1, 24), (1, 24), (2, 24)]
@@ -0,0 +1,62 @@
+# pylint: skip-file
+import json
+from unittest.mock import patch
+
+import pytest
+
+from metrics import METRICS, reset_metrics, timed_stage, increment, emf_record, emit_metrics
+
+
+def test_timed_stage_adds_up():
+    reset_metrics()
+    with patch('metrics.perf_counter', side_effect=[1.0, 1.5, 2.0, 2.25]):
+        with timed_stage('Delete'):
+            pass
+        with timed_stage('Delete'):
+            pass
+
+    assert METRICS['stages'] == {'Delete': 750.0}
+
+
+def test_timed_stage_records_failures():
+    reset_metrics()
+    with pytest.raises(ValueError):
+        with timed_stage('Archive'):
+            raise ValueError('Failed')
+
+    assert 'Archive' in METRICS['stages']
+
+
+def test_increment():
+    reset_metrics()
+    increment('Runs')
+    increment('RecordingsDeleted', 5000)
+    increment('RecordingsDeleted', 20)
+
+    assert METRICS['counters'] == {'Runs': 1, 'RecordingsDeleted': 5020}
+
+
+def test_emf_record():
+    reset_metrics()
+    METRICS['stages']['Archive'] = 1234.56
+    increment('RecordingsArchived', 72000)
+
+    record = emf_record({'Pipeline': 'transfer'})
+    declared = record['_aws']['CloudWatchMetrics'][0]
+
+    assert declared['Dimensions'] == [['Pipeline']]
+    assert declared['Metrics'] == [{'Name': 'ArchiveTime', 'Unit': 'Milliseconds'},
+                                   {'Name': 'RecordingsArchived', 'Unit': 'Count'}]
+    assert record['Pipeline'] == 'transfer'
+    assert record['ArchiveTime'] == 1234.6
+    assert record['RecordingsArchived'] == 72000
+
+
+def test_emit_metrics_prints_json():
+    reset_metrics()
+    increment('Runs')
+
+    with patch('builtins.print') as fake_print:
+        emit_metrics({'Pipeline': 'transfer'})
+
+    assert json.loads(fake_print.call_args.args[0])['Runs'] == 1
@@ -0,0 +1,91 @@
+# pylint: skip-file
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+
+from partitions import has_unarchived_recordings, truncate_archived_days, add_day_partitions
+
+
+def fake_partition(number, day):
+    return {'partition_number': number, 'partition_start': datetime(2024, 10, day),
+            'partition_end': datetime(2024, 10, day + 1)}
+
+
+@patch.dict('partitions.ENV', {'SCHEMA_NAME': 'alpha'})
+@patch('partitions.has_unarchived_recordings')
+@patch('partitions.find_partitions')
+@patch('partitions.create_connection')
+def test_truncate_archived_days(fake_create_connection, fake_find, fake_unarchived):
+    fake_cursor = fake_create_connection.return_value.cursor.return_value.__enter__.return_value
+    fake_find.return_value = [fake_partition(2, 1), fake_partition(3, 2), fake_partition(4, 3)]
+    # The second day holds a late reading the run didn't archive.
+    fake_unarchived.side_effect = [False, True]
+
+    emptied = truncate_archived_days(datetime(2024, 10, 3, 9), (1, 500))
+
+    assert emptied == [datetime(2024, 10, 1)]
+    statements = [call.args[0] for call in fake_cursor.execute.call_args_list]
+    assert 'TRUNCATE TABLE alpha.recording' in statements[0]
+    assert 'WITH (PARTITIONS (2))' in statements[0]
+    assert 'MERGE RANGE' in statements[1]
+    assert fake_cursor.execute.call_args.args[1] == (datetime(2024, 10, 1),)
+    assert fake_unarchived.call_count == 2
+    # The late reading's day releases its lock without emptying anything.
+    fake_create_connection.return_value.rollback.assert_called_once()
+    assert fake_create_connection.return_value.commit.call_count == 2
+    fake_create_connection.return_value.close.assert_called_once()
+
+
+@patch.dict('partitions.ENV', {'SCHEMA_NAME': 'alpha'})
+@patch('partitions.find_partitions')
+@patch('partitions.create_connection')
+def test_truncate_archived_days_checks_and_truncates_in_one_transaction(fake_create_connection,
+                                                                         fake_find):
+    fake_conn = fake_create_connection.return_value
+    fake_cursor = fake_conn.cursor.return_value.__enter__.return_value
+    fake_find.return_value = [fake_partition(2, 1)]
+    fake_cursor.fetchone.return_value = None
+
+    truncate_archived_days(datetime(2024, 10, 3), (1, 500))
+
+    steps = [call for call in fake_conn.mock_calls
+             if call[0] in ('commit', 'cursor().__enter__().execute')]
+    assert 'WITH (TABLOCKX, HOLDLOCK)' in steps[0].args[0]
+    assert 'TRUNCATE TABLE' in steps[1].args[0]
+    assert steps[2][0] == 'commit'
+
+
+@patch.dict('partitions.ENV', {'SCHEMA_NAME': 'alpha'})
+def test_has_unarchived_recordings():
+    fake_cursor = MagicMock()
+    fake_cursor.fetchone.return_value = {'recording_id': 501}
+
+    assert has_unarchived_recordings(fake_cursor, fake_partition(2, 1), (1, 500))
+    statement, params = fake_cursor.execute.call_args.args
+    assert 'alpha.recording WITH (TABLOCKX, HOLDLOCK)' in statement
+    assert params == (datetime(2024, 10, 1), datetime(2024, 10, 2), 1, 500)
+
+
+@patch('partitions.find_partitions')
+@patch('partitions.create_connection')
+def test_truncate_archived_days_unpartitioned(fake_create_connection, fake_find):
+    fake_find.return_value = []
+
+    assert truncate_archived_days(datetime(2024, 10, 3), (1, 500)) == []
+
+
+@patch('partitions.datetime')
+@patch('partitions.find_last_boundary')
+@patch('partitions.create_connection')
+def test_add_day_partitions(fake_create_connection, fake_last_boundary, fake_datetime):
+    fake_cursor = fake_create_connection.return_value.cursor.return_value.__enter__.return_value
+    fake_datetime.now.return_value = datetime(2024, 10, 5, 14, 30)
+    fake_last_boundary.return_value = datetime(2024, 10, 6)
+
+    added = add_day_partitions(days_ahead=3)
+
+    assert added == [datetime(2024, 10, 7), datetime(2024, 10, 8)]
+    splits = [call.args for call in fake_cursor.execute.call_args_list
+              if 'SPLIT RANGE' in call.args[0]]
+    assert [split[1] for split in splits] == [(datetime(2024, 10, 7),),
+                                              (datetime(2024, 10, 8),)]
+    assert 'NEXT USED' in fake_cursor.execute.call_args_list[0].args[0]
@@ -1,19 +1,154 @@
 # pylint: skip-file
+from datetime import datetime
 from unittest.mock import patch
 import pandas as pd
+import pytest
 
-from pipeline import full_pipeline
+from metrics import METRICS, reset_metrics
+from pipeline import full_pipeline, transfer_run, track_averages, compaction_pipeline
 
 
-@patch('pipeline.extract_recordings')
+@patch('pipeline.add_day_partitions')
+@patch('pipeline.transfer_run')
+@patch('pipeline.get_runs')
+def test_full_pipeline(fake_get_runs, fake_transfer_run, fake_add_partitions):
+    fake_get_runs.return_value = [{'run_id': 'old'}, {'run_id': 'new'}]
+
+    full_pipeline()
+
+    fake_get_runs.assert_called_once()
+    fake_add_partitions.assert_called_once()
+    assert [call.args[0]['run_id'] for call in fake_transfer_run.call_args_list] == ['old', 'new']
+
+
+def fake_run(stage):
+    return {'run_id': 'run-1', 'cutoff_time': datetime(2024, 10, 1),
+            'first_recording_id': 1, 'last_recording_id': 9, 'stage': stage}
+
+
+@patch('pipeline.truncate_archived_days')
+@patch('pipeline.delete_old_minute_rollups')
+@patch('pipeline.mark_stage')
+@patch('pipeline.extract_recording_batches')
 @patch('pipeline.load_to_s3')
-@patch('pipeline.delete_outdataed_recordings')
-def test_full_pipeline(fake_delete, fake_load, fake_extract):
+@patch('pipeline.delete_archived_recordings')
+@patch('pipeline.update_averages')
+def test_transfer_run_new(fake_update, fake_delete, fake_load, fake_extract, fake_mark,
+                          fake_delete_rollups, fake_truncate):
+    fake_extract.return_value = iter([])
 
-    fake_extract.return_value = pd.DataFrame()
+    transfer_run(fake_run('started'))
+
+    fake_extract.assert_called_once_with(datetime(2024, 10, 1), id_range=(1, 9))
+    assert fake_load.call_args.kwargs['run_id'] == 'run-1'
+    assert fake_update.call_args.kwargs['run_id'] == 'run-1'
+    fake_truncate.assert_called_once_with(datetime(2024, 10, 1), (1, 9))
+    fake_delete.assert_called_once_with(datetime(2024, 10, 1), (1, 9))
+    fake_delete_rollups.assert_called_once_with(datetime(2024, 10, 1))
+    assert [call.args for call in fake_mark.call_args_list] == [('run-1', 'archived'),
+                                                                ('run-1', 'deleted')]
 
-    full_pipeline()
 
-    fake_extract.assert_called_once()
-    fake_load.assert_called_once()
+@patch('pipeline.truncate_archived_days')
+@patch('pipeline.delete_old_minute_rollups')
+@patch('pipeline.mark_stage')
+@patch('pipeline.extract_recording_batches')
+@patch('pipeline.load_to_s3')
+@patch('pipeline.delete_archived_recordings')
+@patch('pipeline.update_averages')
+def test_transfer_run_resumes_after_archive(fake_update, fake_delete, fake_load,
+                                            fake_extract, fake_mark, fake_delete_rollups,
+                                            fake_truncate):
+    fake_extract.return_value = iter([pd.DataFrame({'plant_id': [1], 'temperature': [20.0],
+                                                    'soil_moisture': [40.0]})])
+
+    transfer_run(fake_run('archived'))
+
+    fake_load.assert_not_called()
+    assert fake_update.call_args.args[0]['new_recordings'].tolist() == [1]
+    fake_delete.assert_called_once()
+    fake_mark.assert_called_once_with('run-1', 'deleted')
+
+
+@patch('pipeline.truncate_archived_days')
+@patch('pipeline.delete_old_minute_rollups')
+@patch('pipeline.mark_stage')
+@patch('pipeline.extract_recording_batches')
+@patch('pipeline.delete_archived_recordings')
+@patch('pipeline.update_averages')
+def test_transfer_run_resumes_after_averages(fake_update, fake_delete, fake_extract, fake_mark,
+                                             fake_delete_rollups, fake_truncate):
+    transfer_run(fake_run('averaged'))
+
+    fake_extract.assert_not_called()
+    fake_update.assert_not_called()
     fake_delete.assert_called_once()
+    fake_mark.assert_called_once_with('run-1', 'deleted')
+
+
+@patch('pipeline.truncate_archived_days')
+@patch('pipeline.delete_old_minute_rollups')
+@patch('pipeline.mark_stage')
+@patch('pipeline.extract_recording_batches')
+@patch('pipeline.load_to_s3')
+@patch('pipeline.delete_archived_recordings')
+@patch('pipeline.update_averages')
+def test_transfer_run_metrics(fake_update, fake_delete, fake_load, fake_extract, fake_mark,
+                              fake_delete_rollups, fake_truncate):
+    reset_metrics()
+    fake_extract.return_value = iter([])
+    fake_load.return_value = 1440
+    fake_truncate.return_value = [datetime(2024, 9, 30)]
+    fake_delete.return_value = {'rows': 10}
+    fake_delete_rollups.return_value = {'rows': 72000}
+
+    transfer_run(fake_run('started'))
+
+    assert METRICS['counters'] == {'Runs': 1, 'RecordingsArchived': 1440, 'DaysTruncated': 1,
+                                   'RecordingsDeleted': 10, 'RollupsDeleted': 72000}
+    assert set(METRICS['stages']) == {'Archive', 'Averages', 'Truncate', 'Delete', 'Rollups'}
+
+
+@patch('pipeline.emit_metrics')
+@patch('pipeline.add_day_partitions')
+@patch('pipeline.get_runs')
+def test_full_pipeline_emits_metrics_on_failure(fake_get_runs, fake_add_partitions,
+                                                fake_emit):
+    fake_add_partitions.return_value = []
+    fake_get_runs.side_effect = RuntimeError('Database unavailable')
+
+    with pytest.raises(RuntimeError):
+        full_pipeline()
+
+    fake_emit.assert_called_once_with({'Pipeline': 'transfer'})
+    assert METRICS['counters']['PipelineErrors'] == 1
+
+
+def test_track_averages():
+    batches = [pd.DataFrame({'plant_id': [1, 1], 'temperature': [20.0, 22.0],
+                             'soil_moisture': [40.0, 42.0]}),
+               pd.DataFrame({'plant_id': [2], 'temperature': [30.0],
+                             'soil_moisture': [50.0]})]
+    partial_averages = []
+    partial_histograms = []
+
+    passed_on = list(track_averages(iter(batches), partial_averages, partial_histograms))
+
+    assert passed_on == batches
+    assert len(partial_averages) == 2
+    assert partial_averages[0]['new_avg_temp'].tolist() == [21.0]
+    assert len(partial_histograms) == 2
+    assert partial_histograms[1]['bin_count'].sum() == 2
+
+
+@patch('pipeline.get_s3_client')
+@patch('pipeline.compact_month')
+@patch.dict('pipeline.ENV', {'BUCKET_NAME': 'test-bucket'})
+def test_compaction_pipeline(fake_compact, fake_get_s3_client):
+    fake_compact.return_value = {'files_replaced': 30, 'files_written': 1, 'rows': 1440}
+
+    compaction_pipeline(2024, 10)
+
+    fake_compact.assert_called_once()
+    assert fake_compact.call_args.args[:4] == (fake_get_s3_client.return_value,
+                                               'test-bucket', 2024, 10)
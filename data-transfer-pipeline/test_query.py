@@ -0,0 +1,146 @@
+# pylint: skip-file
+from datetime import datetime
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+from pyarrow import fs
+
+from archive import read_manifest, write_manifest, add_to_manifest
+from extract import RECORDING_DTYPES
+from load import write_partitions
+from query import hourly_aggregates, scan_recordings, read_archive_manifest, QUERY_CACHE
+
+
+def fake_days(days: int, per_day: int = 288) -> pd.DataFrame:
+    rng = np.random.default_rng(1)
+    ids = np.arange(days * per_day)
+    return pd.DataFrame({
+        'recording_id': ids, 'plant_id': ids % 5,
+        'recording_taken': pd.Timestamp('2024-10-01') + pd.to_timedelta(ids * 86400 // per_day,
+                                                                         unit='s'),
+        'last_watered': pd.NaT, 'soil_moisture': rng.uniform(0, 100, len(ids)),
+        'temperature': rng.uniform(0, 40, len(ids))
+    }).astype(RECORDING_DTYPES)
+
+
+@pytest.fixture
+def archive(fake_s3, tmp_path):
+    """Writes three days of recordings as an archive in a local folder."""
+    recordings = fake_days(3)
+    files = write_partitions(fake_s3, 'test-bucket', [recordings], 'run')
+    write_manifest(fake_s3, 'test-bucket',
+                   add_to_manifest(read_manifest(fake_s3, 'test-bucket'), files))
+
+    for (_, key), body in fake_s3.objects.items():
+        (tmp_path / key).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / key).write_bytes(body)
+
+    QUERY_CACHE.clear()
+    return fs.LocalFileSystem(), str(tmp_path), recordings
+
+
+def test_read_archive_manifest_missing(tmp_path):
+    assert read_archive_manifest(fs.LocalFileSystem(), str(tmp_path)) == {'files': []}
+
+
+def test_scan_recordings_pushdown(archive):
+    filesystem, root, recordings = archive
+    keys = [file['key'] for file in read_archive_manifest(filesystem, root)['files']]
+
+    batches = list(scan_recordings(filesystem, root, keys, ['plant_id', 'temperature'],
+                                   plant_ids=[2], start=datetime(2024, 10, 2),
+                                   end=datetime(2024, 10, 2, 6)))
+
+    rows = pd.concat([batch.to_pandas() for batch in batches])
+    assert list(rows.columns) == ['plant_id', 'temperature']
+    assert (rows['plant_id'] == 2).all()
+    assert len(rows) == len(recordings[
+        (recordings['plant_id'] == 2)
+        & (recordings['recording_taken'] >= '2024-10-02')
+        & (recordings['recording_taken'] < '2024-10-02 06:00')])
+
+
+def test_hourly_aggregates(archive):
+    filesystem, root, recordings = archive
+    start, end = datetime(2024, 10, 1, 12), datetime(2024, 10, 3)
+
+    result = hourly_aggregates(filesystem, root, start, end, plant_ids=[1, 3])
+
+    selected = recordings[recordings['plant_id'].isin([1, 3])
+                          & (recordings['recording_taken'] >= start)
+                          & (recordings['recording_taken'] < end)]
+    expected = selected.groupby(['plant_id', selected['recording_taken'].dt.floor('h')]).agg(
+        temperature_count=('temperature', 'count'), temperature_mean=('temperature', 'mean'),
+        temperature_min=('temperature', 'min'), temperature_max=('temperature', 'max'),
+        soil_moisture_count=('soil_moisture', 'count'),
+        soil_moisture_mean=('soil_moisture', 'mean'),
+        soil_moisture_min=('soil_moisture', 'min'), soil_moisture_max=('soil_moisture', 'max'),
+    ).reset_index().rename(columns={'recording_taken': 'hour'})
+
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+@pytest.mark.parametrize('start, end', [
+    (datetime(2024, 10, 1, 12), datetime(2024, 10, 1, 12, 30)),
+    (datetime(2024, 10, 1, 12, 30), datetime(2024, 10, 1, 14)),
+    (datetime(2024, 10, 1, 23, 10), datetime(2024, 10, 2, 0, 40)),
+])
+def test_hourly_aggregates_within_an_hour(archive, start, end):
+    filesystem, root, recordings = archive
+
+    result = hourly_aggregates(filesystem, root, start, end, plant_ids=[1])
+
+    selected = recordings[(recordings['plant_id'] == 1)
+                          & (recordings['recording_taken'] >= start)
+                          & (recordings['recording_taken'] < end)]
+    expected = selected.groupby(selected['recording_taken'].dt.floor('h'))['temperature']
+    assert result['hour'].tolist() == list(expected.groups)
+    assert result['temperature_count'].tolist() == expected.count().tolist()
+    assert result['temperature_max'].tolist() == expected.max().tolist()
+
+
+def test_hourly_aggregates_within_an_hour_not_cached_as_whole(archive):
+    filesystem, root, _ = archive
+    whole = hourly_aggregates(filesystem, root, datetime(2024, 10, 1, 12),
+                              datetime(2024, 10, 1, 13), plant_ids=[1])
+
+    half = hourly_aggregates(filesystem, root, datetime(2024, 10, 1, 12),
+                             datetime(2024, 10, 1, 12, 30), plant_ids=[1])
+
+    assert half['temperature_count'][0] < whole['temperature_count'][0]
+
+
+def test_hourly_aggregates_reads_only_matching_files(archive):
+    filesystem, root, _ = archive
+
+    with patch('query.scan_recordings', wraps=scan_recordings) as fake_scan:
+        result = hourly_aggregates(filesystem, root, datetime(2024, 10, 2),
+                                   datetime(2024, 10, 3), plant_ids=[4])
+
+    assert [call.args[2] for call in fake_scan.call_args_list] == \
+        [['plant_recordings/year=2024/month=10/day=02/recording-run.parquet']]
+    assert len(result) == 24
+
+
+def test_hourly_aggregates_cached(archive):
+    filesystem, root, _ = archive
+    first = hourly_aggregates(filesystem, root, datetime(2024, 10, 1), datetime(2024, 10, 4))
+
+    with patch('query.scan_recordings') as fake_scan:
+        second = hourly_aggregates(filesystem, root, datetime(2024, 10, 1, 6),
+                                   datetime(2024, 10, 4))
+
+    fake_scan.assert_not_called()
+    assert len(first) == 3 * 24 * 5
+    assert len(second) == len(first) - 6 * 5
+
+
+def test_hourly_aggregates_no_matching_plants(archive):
+    filesystem, root, _ = archive
+
+    result = hourly_aggregates(filesystem, root, datetime(2024, 10, 1), datetime(2024, 10, 4),
+                               plant_ids=[40, 41])
+
+    assert result.empty
@@ -0,0 +1,68 @@
+# pylint: skip-file
+import numpy as np
+import pandas as pd
+
+from stats import calculate_histograms, combine_histograms, pooled_m2
+
+
+def test_pooled_m2():
+    values = np.array([1.0, 2.0, 4.0, 7.0, 11.0])
+    partials = pd.DataFrame({'plant_id': [1, 1],
+                             'new_recordings': [2, 3],
+                             'new_temp_count': [2, 3],
+                             'new_avg_temp': [values[:2].mean(), values[2:].mean()],
+                             'new_temp_m2': [((values[:2] - values[:2].mean()) ** 2).sum(),
+                                             ((values[2:] - values[2:].mean()) ** 2).sum()]})
+
+    result = pooled_m2(partials, 'temp', pd.Series({1: values.mean()}))
+
+    assert result[1] == ((values - values.mean()) ** 2).sum()
+
+
+def test_calculate_histograms():
+    recordings = pd.DataFrame({'plant_id': [1, 1, 1, 2],
+                               'temperature': [20.2, 20.9, 100.0, -50.0],
+                               'soil_moisture': [0.0, 100.0, None, 55.5]})
+
+    histograms = calculate_histograms(recordings)
+
+    assert histograms.to_dict('records') == [
+        {'plant_id': 1, 'metric': 'temperature', 'bin': 40, 'bin_count': 2},
+        {'plant_id': 1, 'metric': 'temperature', 'bin': 79, 'bin_count': 1},
+        {'plant_id': 2, 'metric': 'temperature', 'bin': 0, 'bin_count': 1},
+        {'plant_id': 1, 'metric': 'soil_moisture', 'bin': 0, 'bin_count': 1},
+        {'plant_id': 1, 'metric': 'soil_moisture', 'bin': 99, 'bin_count': 1},
+        {'plant_id': 2, 'metric': 'soil_moisture', 'bin': 55, 'bin_count': 1}]
+
+
+def test_combine_histograms():
+    recordings = pd.DataFrame({'plant_id': [1, 1, 2, 1],
+                               'temperature': [20.0, 20.5, 20.0, 30.0],
+                               'soil_moisture': [50.0, 50.0, 50.0, 50.0]})
+
+    combined = combine_histograms([calculate_histograms(recordings[:2]),
+                                   calculate_histograms(recordings[2:])])
+
+    pd.testing.assert_frame_equal(
+        combined.sort_values(['plant_id', 'metric', 'bin'], ignore_index=True),
+        calculate_histograms(recordings).sort_values(['plant_id', 'metric', 'bin'],
+                                                     ignore_index=True))
+
+
+def test_combine_histograms_no_batches():
+    assert combine_histograms([]).empty
+
+
+
+def test_pooled_m2_weights_by_readings():
+    values = np.array([1.0, 2.0, 4.0, 7.0, 11.0])
+    partials = pd.DataFrame({'plant_id': [1, 1],
+                             'new_recordings': [4, 3],
+                             'new_temp_count': [2, 3],
+                             'new_avg_temp': [values[:2].mean(), values[2:].mean()],
+                             'new_temp_m2': [((values[:2] - values[:2].mean()) ** 2).sum(),
+                                             ((values[2:] - values[2:].mean()) ** 2).sum()]})
+
+    result = pooled_m2(partials, 'temp', pd.Series({1: values.mean()}))
+
+    assert result[1] == ((values - values.mean()) ** 2).sum()
@@ -0,0 +1,74 @@
+"""Benchmarks the vectorised clean against the previous row-by-row version.
+Run with `python3 benchmark_clean.py` (optionally passing batch sizes)."""
+
+import sys
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from transform import clean
+
+
+BATCH_SIZES = [50, 10_000, 1_000_000]
+
+
+def clean_row_by_row(needs_a_clean: pd.DataFrame) -> pd.DataFrame:
+    """The original clean, which parses and formats each row in Python."""
+    needs_a_clean["recording_taken"] = pd.to_datetime(
+        needs_a_clean["recording_taken"], format="%Y-%m-%d %H:%M:%S", errors='coerce')
+
+    needs_a_clean['last_watered'] = needs_a_clean['last_watered'].apply(
+        lambda row: datetime.strptime(row, "%a, %d %b %Y %H:%M:%S %Z"))
+
+    needs_a_clean['last_watered'] = needs_a_clean['last_watered'].apply(
+        lambda row: row.strftime("%Y-%m-%d %H:%M:%S"))
+
+    needs_a_clean['recording_taken'] = needs_a_clean['recording_taken'].apply(
+        lambda row: row.strftime("%Y-%m-%d %H:%M:%S"))
+
+    return needs_a_clean
+
+
+def make_batch(rows: int) -> pd.DataFrame:
+    """Returns a batch of synthetic recordings shaped like the API output."""
+    rng = np.random.default_rng(42)
+    start = datetime(2024, 10, 1)
+    recorded = pd.Series(start + pd.to_timedelta(np.arange(rows), unit="s"))
+    watered = recorded - pd.to_timedelta(rng.integers(0, 86400, rows), unit="s")
+
+    return pd.DataFrame({
+        "plant_id": rng.integers(0, 51, rows),
+        "recording_taken": recorded.dt.strftime("%Y-%m-%d %H:%M:%S"),
+        "last_watered": watered.dt.strftime("%a, %d %b %Y %H:%M:%S GMT"),
+        "soil_moisture": rng.uniform(0, 100, rows),
+        "temperature": rng.uniform(0, 40, rows)
+    })
+
+
+def time_clean(clean_function, batch: pd.DataFrame, repeats: int) -> float:
+    """Returns the best time in seconds of cleaning a copy of the batch."""
+    timings = []
+    for _ in range(repeats):
+        data = batch.copy()
+        start = perf_counter()
+        clean_function(data)
+        timings.append(perf_counter() - start)
+    return min(timings)
+
+
+def run_benchmark(batch_sizes: list[int]) -> None:
+    """Prints the per-batch time of both clean implementations."""
+    print(f"{'rows':>10} {'row by row':>14} {'vectorised':>14} {'speed up':>10}")
+    for rows in batch_sizes:
+        batch = make_batch(rows)
+        repeats = 1 if rows >= 1_000_000 else 5
+        old_time = time_clean(clean_row_by_row, batch, repeats)
+        new_time = time_clean(clean, batch, repeats)
+        print(f"{rows:>10} {old_time * 1000:>12.2f}ms {new_time * 1000:>12.2f}ms "
+              f"{old_time / new_time:>9.1f}x")
+
+
+if __name__ == "__main__":
+    run_benchmark([int(size) for size in sys.argv[1:]] or BATCH_SIZES)
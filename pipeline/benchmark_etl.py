@@ -0,0 +1,194 @@
+"""Benchmarks extract, clean and load end to end against the fake plants API.
+Run with `python3 benchmark_etl.py` (optionally passing fleet sizes). The fake API is
+configured with the FAKE_API_* env variables (see fake_api.py), and the extract with
+EXTRACT_MODE and the other usual env variables.
+The load goes to a stand-in database that waits BENCHMARK_DB_LATENCY_MS (default 2)
+per statement, or to the database in .env with BENCHMARK_DATABASE=true, in which case
+the fleet can't be larger than the plants in alpha.plant.
+Alerts aren't checked, so no emails are sent."""
+
+import sys
+import tracemalloc
+from contextlib import contextmanager, redirect_stdout
+from io import StringIO
+from os import environ as ENV
+from time import monotonic, perf_counter, sleep
+
+import numpy as np
+
+import discovery
+import extract
+import load
+from fake_api import FakePlantsAPI, behaviour_from_env
+from transform import clean
+
+
+FLEET_SIZES = [50, 500, 2000]
+
+
+class StandInCursor:
+    """Accepts the load's statements, waiting a fixed time for each to run."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.rowcount = 0
+
+    def execute(self, query: str, params=None) -> None:
+        """Waits as if the statement ran, counting the rows an insert would add."""
+        sleep(self.latency)
+        columns = len(load.RECORDING_COLUMNS)
+        self.rowcount = len(params) // columns if params and "INSERT" in query else 0
+
+    def executemany(self, _query: str, params: list) -> None:
+        """Waits as if each row were sent in its own round trip."""
+        sleep(self.latency * len(params))
+        self.rowcount = len(params)
+
+    def fetchone(self):
+        """Returns no rows."""
+        return None
+
+    def fetchall(self) -> list:
+        """Returns no rows."""
+        return []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class StandInConnection:
+    """A database connection that runs nothing, so only the pipeline itself is timed."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def cursor(self) -> StandInCursor:
+        """Returns a cursor with the same statement latency."""
+        return StandInCursor(self.latency)
+
+    def commit(self) -> None:
+        """Waits as if the transaction were committed."""
+        sleep(self.latency)
+
+    def rollback(self) -> None:
+        """Does nothing."""
+
+    def close(self) -> None:
+        """Does nothing."""
+
+
+@contextmanager
+def replaced(module, name: str, value):
+    """Replaces an attribute of a module until the block ends."""
+    original = getattr(module, name)
+    setattr(module, name, value)
+    try:
+        yield
+    finally:
+        setattr(module, name, original)
+
+
+def timed_get_request(latencies: list[float]):
+    """Returns extract.get_request, recording the seconds each call takes."""
+    get_request = extract.get_request
+
+    def wrapper(plant_id):
+        start = perf_counter()
+        try:
+            return get_request(plant_id)
+        finally:
+            latencies.append(perf_counter() - start)
+    return wrapper
+
+
+def timed_get_request_async(latencies: list[float]):
+    """Returns extract.get_request_async, recording the seconds each call takes,
+    including any retries and any wait for a free connection."""
+    get_request_async = extract.get_request_async
+
+    async def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return await get_request_async(*args, **kwargs)
+        finally:
+            latencies.append(perf_counter() - start)
+    return wrapper
+
+
+def run_once(plant_count: int) -> dict:
+    """Runs extract, clean and load for every plant, returning the time of each stage."""
+    discovery.reset_registry()
+    discovery.REGISTRY["live"] = set(range(1, plant_count + 1))
+    discovery.REGISTRY["probed_at"] = monotonic()
+
+    # The pipeline's own progress messages would break up the table.
+    with redirect_stdout(StringIO()):
+        start = perf_counter()
+        recordings = extract.extract()
+        extracted = perf_counter()
+        cleaned = clean(recordings)
+        transformed = perf_counter()
+        load.load(cleaned)
+        loaded = perf_counter()
+
+    return {"rows": len(cleaned), "total": loaded - start, "extract": extracted - start,
+            "clean": transformed - extracted, "load": loaded - transformed}
+
+
+def benchmark_fleet(plant_count: int, runs: int) -> dict:
+    """Returns the throughput, fetch latency and peak memory of the pipeline for a fleet,
+    from the given number of timed runs and one more traced for memory."""
+    latencies = []
+    timings = []
+
+    with replaced(extract, "get_request", timed_get_request(latencies)), \
+            replaced(extract, "get_request_async", timed_get_request_async(latencies)):
+        for _ in range(runs):
+            timings.append(run_once(plant_count))
+
+    # Tracing every allocation slows the run down, so it isn't one of the timed runs.
+    tracemalloc.start()
+    run_once(plant_count)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = sum(timing["total"] for timing in timings)
+    return {"plants/s": plant_count * runs / total,
+            "rows/s": sum(timing["rows"] for timing in timings) / total,
+            "missing": plant_count * runs - sum(timing["rows"] for timing in timings),
+            "p50": np.percentile(latencies, 50) * 1000,
+            "p99": np.percentile(latencies, 99) * 1000,
+            **{stage: np.median([timing[stage] for timing in timings]) * 1000
+               for stage in ("extract", "clean", "load")},
+            "peak": peak / 2 ** 20}
+
+
+def run_benchmark(fleet_sizes: list[int]) -> None:
+    """Prints the throughput, fetch latency and peak memory for each fleet size."""
+    runs = int(ENV.get("BENCHMARK_RUNS", 5))
+    latency = float(ENV.get("BENCHMARK_DB_LATENCY_MS", 2)) / 1000
+    behaviour = behaviour_from_env()
+
+    print(f"{'plants':>7} {'plants/s':>9} {'rows/s':>9} {'missing':>8} {'p50':>9} "
+          f"{'p99':>9} {'extract':>10} {'clean':>9} {'load':>9} {'peak':>9}")
+    for plant_count in fleet_sizes:
+        api = FakePlantsAPI(plant_count, seed=42, **behaviour)
+        with api, replaced(extract, "BASE_URL", api.url):
+            if ENV.get("BENCHMARK_DATABASE", "false").lower() == "true":
+                result = benchmark_fleet(plant_count, runs)
+            else:
+                with replaced(load, "create_connection", lambda: StandInConnection(latency)):
+                    result = benchmark_fleet(plant_count, runs)
+                    load.close_pool()
+
+        print(f"{plant_count:>7} {result['plants/s']:>9.0f} {result['rows/s']:>9.0f} "
+              f"{result['missing']:>8} {result['p50']:>7.1f}ms {result['p99']:>7.1f}ms "
+              f"{result['extract']:>8.1f}ms {result['clean']:>7.1f}ms "
+              f"{result['load']:>7.1f}ms {result['peak']:>7.1f}MB")
+
+
+if __name__ == "__main__":
+    run_benchmark([int(size) for size in sys.argv[1:]] or FLEET_SIZES)
@@ -0,0 +1,69 @@
+"""This script keeps a registry of the plant IDs that are live on the plant API."""
+
+from os import environ as ENV
+from time import monotonic
+
+
+DEFAULT_PLANT_COUNT = 50
+
+# Kept at module level so that it survives between warm lambda invocations.
+REGISTRY = {"live": set(), "misses": {}, "probed_at": None}
+
+
+def reset_registry() -> None:
+    """Forgets every known plant, forcing a full probe on the next run."""
+    REGISTRY["live"] = set()
+    REGISTRY["misses"] = {}
+    REGISTRY["probed_at"] = None
+
+
+def probe_due() -> bool:
+    """Returns True if the gaps and the range above the highest ID should be re-probed."""
+    interval = float(ENV.get("DISCOVERY_REPROBE_SECONDS", 3600))
+    return (not REGISTRY["live"] or REGISTRY["probed_at"] is None
+            or monotonic() - REGISTRY["probed_at"] >= interval)
+
+
+def shard_plant_ids(plant_ids, shard_index: int = 0, shard_count: int = 1) -> list[int]:
+    """Returns the sorted plant IDs that belong to the given shard."""
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise ValueError(f"Invalid shard {shard_index} of {shard_count}.")
+    return sorted(plant_id for plant_id in plant_ids
+                  if plant_id % shard_count == shard_index)
+
+
+def get_plant_ids(shard_index: int = 0, shard_count: int = 1,
+                  full_probe: bool = False) -> list[int]:
+    """Returns the plant IDs to fetch for a shard. A full probe covers every ID up to
+    a window above the highest known plant, otherwise only known-live plants are fetched."""
+    highest = max(REGISTRY["live"], default=DEFAULT_PLANT_COUNT)
+
+    if full_probe:
+        headroom = int(ENV.get("DISCOVERY_HEADROOM", 10))
+        candidates = range(highest + headroom + 1)
+    else:
+        candidates = REGISTRY["live"]
+
+    return shard_plant_ids(candidates, shard_index, shard_count)
+
+
+def update_registry(requested_ids: list[int], live_ids: list[int],
+                    full_probe: bool = False) -> None:
+    """Records which of the requested plants responded. A known plant is only dropped
+    after several consecutive misses so one flaky response doesn't lose its data."""
+    max_misses = int(ENV.get("DISCOVERY_MAX_MISSES", 3))
+    live_ids = set(live_ids)
+
+    for plant_id in live_ids:
+        REGISTRY["live"].add(plant_id)
+        REGISTRY["misses"].pop(plant_id, None)
+
+    for plant_id in set(requested_ids) - live_ids:
+        if plant_id in REGISTRY["live"]:
+            REGISTRY["misses"][plant_id] = REGISTRY["misses"].get(plant_id, 0) + 1
+            if REGISTRY["misses"][plant_id] >= max_misses:
+                REGISTRY["live"].discard(plant_id)
+                REGISTRY["misses"].pop(plant_id)
+
+    if full_probe:
+        REGISTRY["probed_at"] = monotonic()
@@ -1,38 +1,86 @@
 """A script to send an email if the plant has too high temp or too low moisture."""
 from os import environ as ENV
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 from email.mime.text import MIMEText
 
-from dotenv import load_dotenv
 import boto3
+import pandas as pd
+import pymssql
+from botocore.exceptions import BotoCoreError, ClientError
+from dotenv import load_dotenv
 
-from load import create_connection
+from load import pooled_connection
+from metadata import get_plant_metadata, get_plants_metadata
+from metrics import increment
 
 
-def send_email(plant_id: int, value: float, value_type: str, condition:str ) -> None:
-    """
-    Sends an email to the correct botanist if the plants conditions are worrying.
-    Example inputs - plant_id: 1, value: 10000, value_type: 'temperature', condition: 'exceeded'.
-    """
+EMAIL_STYLE = """
+    <head>
+        <style>
+            body {
+                font-family: Arial, sans-serif;
+                line-height: 1.6;
+                color: #333;
+            }
+            .container {
+                padding: 20px;
+                background-color: #f4f4f9;
+                border-radius: 8px;
+                width: 600px;
+                margin: auto;
+            }
+            h2 {
+                color: #4CAF50;
+            }
+            p {
+                margin: 0 0 20px;
+            }
+            td, th {
+                padding: 4px 12px;
+                text-align: left;
+            }
+            .footer {
+                font-size: 0.9em;
+                color: #777;
+            }
+        </style>
+    </head>"""
 
-    load_dotenv()
-    html = generate_html(plant_id, value, value_type, condition)
-    client = boto3.client("ses", region_name="eu-west-2")
+# Kept at module level so it is reused between warm lambda invocations.
+SES = {"client": None}
+# An alert is identified by these columns in alpha.alert_log.
+ALERT_KEY = ["plant_id", "metric", "direction"]
+# SQL Server allows at most 1000 rows in one VALUES clause.
+ALERT_LOG_BATCH_SIZE = 1000
+
+
+def get_ses_client():
+    """Returns the SES client, creating it on first use."""
+    if SES["client"] is None:
+        SES["client"] = boto3.client("ses", region_name="eu-west-2")
+    return SES["client"]
+
+
+def send_message(subject: str, html: str, destination: str) -> None:
+    """Sends an html email through SES to the destination address.
+    If TO_EMAIL is set, every email goes there instead, which is needed
+    while the SES account is in the sandbox and can only send to verified addresses."""
     message = MIMEMultipart()
-    
-    message["Subject"] = f"PLANT ALERT! {condition.upper()} ACCEPTABLE {value_type.upper()} LEVEL "
+
+    message["Subject"] = subject
     body = MIMEText(
         html,
         "html")
     message.attach(body)
 
-    # The addresses the emails will be sent, 
-    # should be specified in your local env variables.
-    client.send_raw_email(
+    # The address the emails are sent from should be specified in your local env variables.
+    get_ses_client().send_raw_email(
         Source=ENV['FROM_EMAIL'],
         Destinations=[
-            ENV['TO_EMAIL']
+            ENV.get('TO_EMAIL') or destination
         ],
         RawMessage={
             'Data': message.as_string()
@@ -40,6 +88,24 @@ def send_email(plant_id: int, value: float, value_type: str, condition:str ) ->
     )
 
 
+def send_email(plant_id: int, value: float, value_type: str, condition:str ) -> None:
+    """
+    Sends an email to the correct botanist if the plants conditions are worrying.
+    Example inputs - plant_id: 1, value: 10000, value_type: 'temperature', condition: 'exceeded'.
+    """
+
+    html = generate_html(plant_id, value, value_type, condition)
+    send_message(f"PLANT ALERT! {condition.upper()} ACCEPTABLE {value_type.upper()} LEVEL ",
+                 html, get_botanist_info(plant_id)['botanist_email'])
+
+
+def describe_reading(value: float, value_type: str, condition: str) -> tuple[str, str]:
+    """Returns the rounded value with its unit, and whether it is higher or lower than expected."""
+    unit = '°C' if value_type == 'temperature' else '%'
+    implication = 'higher' if condition.strip() == 'exceeded' else 'lower'
+    return f"{round(value, 2)}{unit}", implication
+
+
 def generate_html(plant_id: int, value: float, value_type: str, condition:str) -> str:
     """
     Generates the html report to email.
@@ -50,58 +116,23 @@ def generate_html(plant_id: int, value: float, value_type: str, condition:str) -
     botanist_name = extra_info['botanist_name']
     botanist_email = extra_info['botanist_email']
     plant_name = extra_info['plant_name']
-    if value_type == 'temperature':
-        unit = '°C'
-    else:
-        unit = '%'
-
-    if condition.strip() == 'exceeded':
-        implication = 'higher'
-    elif condition.strip() == 'not met':
-        implication = 'lower'
+    reading, implication = describe_reading(value, value_type, condition)
 
-    value = round(value, 2)
-
-    # 'soil moisture' is a string of two items, so in order to capitalise 
+    # 'soil moisture' is a string of two items, so in order to capitalise
     # in this case, it's necessary to split the items in to a list, iterate
     # over it to and capitalise, then join the list into a final string.
     capitalised_value_type = ' '.join(word.capitalize() for word in value_type.split())
 
     html_content = f"""
     <html>
-    <head>
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                line-height: 1.6;
-                color: #333;
-            }}
-            .container {{
-                padding: 20px;
-                background-color: #f4f4f9;
-                border-radius: 8px;
-                width: 600px;
-                margin: auto;
-            }}
-            h2 {{
-                color: #4CAF50;
-            }}
-            p {{
-                margin: 0 0 20px;
-            }}
-            .footer {{
-                font-size: 0.9em;
-                color: #777;
-            }}
-        </style>
-    </head>
+    {EMAIL_STYLE}
     <body>
         <div class="container">
             <h2>Automated Botany Alert: Acceptable {capitalised_value_type} Range {condition.capitalize()}</h2>
             <p>Dear {botanist_name} ({botanist_email}),</p>
             <p>
                 This is an automated email to inform you that the {value_type} for the plant
-                <strong>{plant_name}</strong> with the ID <strong>{plant_id}</strong> has recorded a value of <strong>{value}{unit}</strong>, 
+                <strong>{plant_name}</strong> with the ID <strong>{plant_id}</strong> has recorded a value of <strong>{reading}</strong>,
                 which is <strong>{implication}</strong> than what we expect on our system.
             </p>
             <p>Kind regards,</p>
@@ -116,33 +147,172 @@ def generate_html(plant_id: int, value: float, value_type: str, condition:str) -
     return html_content
 
 
+def generate_digest_html(botanist_name: str, botanist_email: str, alerts: pd.DataFrame) -> str:
+    """
+    Generates one html report listing every alert for a botanist's plants.
+    The alerts need plant_id, plant_name, metric, value and direction columns.
+    """
+
+    rows = []
+    for alert in alerts.sort_values(["plant_id", "metric"]).itertuples(index=False):
+        reading, implication = describe_reading(alert.value, alert.metric, alert.direction)
+        rows.append(f"""
+                <tr>
+                    <td>{alert.plant_name} ({alert.plant_id})</td>
+                    <td>{alert.metric}</td>
+                    <td><strong>{reading}</strong></td>
+                    <td>{implication} than expected</td>
+                </tr>""")
+
+    html_content = f"""
+    <html>
+    {EMAIL_STYLE}
+    <body>
+        <div class="container">
+            <h2>Automated Botany Alert: {len(rows)} Readings Outside the Acceptable Range</h2>
+            <p>Dear {botanist_name} ({botanist_email}),</p>
+            <p>
+                This is an automated email to inform you that the following plants have
+                recorded values outside of what we expect on our system.
+            </p>
+            <table>
+                <tr><th>Plant</th><th>Reading</th><th>Value</th><th></th></tr>{''.join(rows)}
+            </table>
+            <p>Kind regards,</p>
+            <p>The Botany Team</p>
+            <div class="footer">
+                <p>Please do not reply to this email. This is an automated message.</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+    return html_content
+
+
 def get_botanist_info(plant_id: int):
-    """Gets the correct botanist name and email."""
-    load_dotenv()
+    """Gets the correct botanist name and email from the cached plant metadata."""
+    return get_plant_metadata(plant_id)
+
+
+def fetch_last_alerted(plant_ids) -> pd.DataFrame:
+    """Returns when each alert for the plants was last sent, from the alert log
+    shared by every invocation and shard."""
+    query = """
+    SELECT plant_id, metric, direction, last_alerted
+    FROM alpha.alert_log
+    WHERE plant_id IN %s
+    """
+
+    with pooled_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(query, (tuple(int(plant_id) for plant_id in plant_ids),))
+            data = cursor.fetchall()
+
+    return pd.DataFrame(data, columns=[*ALERT_KEY, "last_alerted"])
+
+
+def record_alerts_sent(alerts: pd.DataFrame, now: datetime) -> None:
+    """Records in the alert log that the alerts were sent now, in one MERGE
+    per ALERT_LOG_BATCH_SIZE alerts."""
+    rows = list(alerts[ALERT_KEY].drop_duplicates().itertuples(index=False, name=None))
+
+    with pooled_connection() as conn:
+        with conn.cursor() as cursor:
+            for start in range(0, len(rows), ALERT_LOG_BATCH_SIZE):
+                batch = rows[start:start + ALERT_LOG_BATCH_SIZE]
+                cursor.execute(f"""
+                MERGE alpha.alert_log WITH (HOLDLOCK) AS t
+                USING (VALUES {", ".join(["(%s, %s, %s, %s)"] * len(batch))})
+                    AS s (plant_id, metric, direction, last_alerted)
+                ON t.plant_id = s.plant_id AND t.metric = s.metric
+                    AND t.direction = s.direction
+                WHEN MATCHED THEN UPDATE SET last_alerted = s.last_alerted
+                WHEN NOT MATCHED THEN
+                    INSERT (plant_id, metric, direction, last_alerted)
+                    VALUES (s.plant_id, s.metric, s.direction, s.last_alerted);
+                """, tuple(value for row in batch for value in (int(row[0]), *row[1:], now)))
+        conn.commit()
+
+
+def remove_recent_alerts(alerts: pd.DataFrame, last_alerted: pd.DataFrame,
+                         now: datetime) -> pd.DataFrame:
+    """Returns the alerts that haven't already been sent within the cooldown window
+    (ALERT_COOLDOWN_MINUTES, default 60) for the same plant, metric and direction,
+    given when each was last sent."""
+    cooldown = timedelta(minutes=float(ENV.get("ALERT_COOLDOWN_MINUTES", 60)))
+    alerts = alerts.drop_duplicates(ALERT_KEY, keep="last")
 
-    query = f"""
-        SELECT b.botanist_name, b.botanist_email, p.plant_name
-        FROM {ENV['SCHEMA_NAME']}.plant as p
-        JOIN {ENV['SCHEMA_NAME']}.botanist as b
-        ON b.botanist_id=p.botanist_id
-        WHERE p.plant_id = %s"""
+    sent_at = alerts.merge(last_alerted, on=ALERT_KEY, how="left")["last_alerted"]
+    recently_sent = (now - pd.to_datetime(sent_at) < cooldown).to_numpy()
 
-    conn = create_connection()
-    with conn.cursor() as cursor:
-        cursor.execute(query, (plant_id,))
-        data = cursor.fetchone()
+    return alerts[~recently_sent]
 
-    return data
+
+def send_digest(botanist_name: str, botanist_email: str, alerts: pd.DataFrame) -> None:
+    """Sends one email to a botanist listing all of their alerts."""
+    html = generate_digest_html(botanist_name, botanist_email, alerts)
+    send_message(f"PLANT ALERT! {len(alerts)} READINGS OUTSIDE THE ACCEPTABLE RANGE", html,
+                 botanist_email)
+
+
+def dispatch_alerts(alerts: pd.DataFrame) -> int:
+    """
+    Sends every alert from a run as one digest email per botanist, skipping alerts
+    still inside their cooldown. Returns the number of emails sent.
+    The cooldown is kept in alpha.alert_log, so it holds across cold starts and
+    concurrent invocations. Alerts whose email fails are not logged as sent,
+    so they are retried next run.
+    """
+    now = datetime.now()
+    alerts = remove_recent_alerts(alerts, fetch_last_alerted(alerts["plant_id"].unique()), now)
+    if alerts.empty:
+        return 0
+
+    botanists = get_plants_metadata(alerts["plant_id"].unique())[
+        ["plant_id", "plant_name", "botanist_name", "botanist_email"]]
+    alerts = alerts.merge(botanists, on="plant_id", how="left")
+    alerts[["botanist_name", "botanist_email"]] = alerts[
+        ["botanist_name", "botanist_email"]].fillna("Unknown botanist")
+    alerts["plant_name"] = alerts["plant_name"].fillna("Unknown plant")
+
+    sent = []
+    with ThreadPoolExecutor(max_workers=int(ENV.get("ALERT_WORKERS", 4))) as executor:
+        futures = {executor.submit(send_digest, name, email, botanist_alerts): botanist_alerts
+                   for (name, email), botanist_alerts
+                   in alerts.groupby(["botanist_name", "botanist_email"])}
+
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except (BotoCoreError, ClientError) as err:
+                print(f"Failed to send alert email: {err}")
+                increment("EmailErrors")
+                continue
+
+            sent.append(futures[future])
+
+    increment("EmailsSent", len(sent))
+    if sent:
+        try:
+            record_alerts_sent(pd.concat(sent), now)
+        except pymssql.Error as err:
+            # The emails have gone, so the run carries on; they may be repeated next run.
+            print(f"Failed to record sent alerts: {err}")
+            increment("AlertLogErrors")
+    return len(sent)
 
 
 if __name__ == "__main__":
-    # Test cases, simulating emails being sent when 
+    load_dotenv()
+
+    # Test cases, simulating emails being sent when
     # upper and lower boundaries are exceeded
 
-    # # Soil moisture exceed upper bound of 90. 
+    # # Soil moisture exceed upper bound of 90.
     # send_email(13, 95.2, 'soil moisture', 'exceeded')
 
-    # # Soil moisture doesn't meet lower bound of 30. 
+    # # Soil moisture doesn't meet lower bound of 30.
     # send_email(13, 12.6, 'soil moisture', 'not met')
 
     # Temperature exceeds upper bound of 50.
@@ -5,12 +5,18 @@ from dotenv import load_dotenv
 from extract import extract
 from transform import transform
 from load import load
+from metrics import timed_stage
 
 
-def run():
-    """This function runs all the components."""
+def run(shard_index: int = 0, shard_count: int = 1):
+    """This function runs all the components for one shard of the plants, timing each stage."""
     load_dotenv()
-    load(transform(extract()))
+    with timed_stage("Extract"):
+        recordings = extract(shard_index=shard_index, shard_count=shard_count)
+    with timed_stage("Transform"):
+        recordings = transform(recordings)
+    with timed_stage("Load"):
+        load(recordings)
 
 
 if __name__ == "__main__":
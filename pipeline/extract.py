@@ -1,18 +1,83 @@
 """This script connects to and extracts data from the plant API"""
 
+import asyncio
+import random
+from os import environ as ENV
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import perf_counter
 
+import aiohttp
 import requests
 import pandas as pd
 
+from discovery import probe_due, get_plant_ids, update_registry
+from metrics import increment, record_fetch_latency
 
-BASE_URL = "https://data-eng-plants-api.herokuapp.com/plants/"
+
+COLUMNS = ["plant_id", "recording_taken", "last_watered", "soil_moisture", "temperature"]
+BASE_URL = ENV.get("PLANTS_API_URL", "https://data-eng-plants-api.herokuapp.com/plants/")
+RETRY_STATUSES = {429, 500, 502, 503, 504}
 
 
 def get_request(plant_id) -> dict:
-    """Gets and returns the data for a specific plant ."""
-    result = requests.get(f"{BASE_URL}{plant_id}", timeout=30)
-    return result.json()
+    """Gets and returns the data for a specific plant .
+    A body that isn't valid JSON is returned as an error, like a missing plant."""
+    increment("HttpRequests")
+    start = perf_counter()
+    try:
+        result = requests.get(f"{BASE_URL}{plant_id}", timeout=30)
+    except requests.RequestException:
+        increment("HttpErrors")
+        raise
+    finally:
+        record_fetch_latency(perf_counter() - start)
+
+    try:
+        return result.json()
+    except ValueError as err:
+        increment("HttpErrors")
+        return {"error": repr(err), "plant_id": plant_id}
+
+
+async def get_request_async(session: aiohttp.ClientSession, plant_id: int,
+                            semaphore: asyncio.Semaphore, retries: int = 3,
+                            backoff: float = 0.5) -> dict:
+    """Gets and returns the data for a specific plant over a shared session,
+    retrying network errors and server errors with jittered exponential backoff."""
+    start = perf_counter()
+    try:
+        for attempt in range(retries + 1):
+            increment("HttpRequests")
+            try:
+                async with semaphore:
+                    async with session.get(f"{BASE_URL}{plant_id}") as response:
+                        if response.status not in RETRY_STATUSES:
+                            return await response.json(content_type=None)
+                        error = f"status {response.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+                error = repr(err)
+            increment("HttpErrors")
+
+            if attempt < retries:
+                await asyncio.sleep(random.uniform(0, backoff * 2 ** attempt))
+
+        return {"error": error, "plant_id": plant_id}
+    finally:
+        record_fetch_latency(perf_counter() - start)
+
+
+async def get_all_requests_async(plant_ids: list[int]) -> list[dict]:
+    """Fetches every plant concurrently through one keep-alive connection pool."""
+    concurrency = int(ENV.get("EXTRACT_CONCURRENCY", 20))
+    timeout = aiohttp.ClientTimeout(total=float(ENV.get("EXTRACT_TIMEOUT", 30)))
+    retries = int(ENV.get("EXTRACT_RETRIES", 3))
+
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=60)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        return await asyncio.gather(*[get_request_async(session, plant_id, semaphore, retries)
+                                      for plant_id in plant_ids])
 
 
 def build_entry(data: dict) -> dict:
@@ -25,22 +90,40 @@ def build_entry(data: dict) -> dict:
             }
 
 
-def extract() -> pd.DataFrame:
-    """This function goes through all the plants, extracting the key information,
-    and then turns it into a dataframe ready for cleaning."""
-    plant_count = 50
-    recordings = []
+def extract_threaded(plant_ids: list[int]) -> list[dict]:
+    """Fetches every plant using a pool of threads."""
+    results = []
 
     with ThreadPoolExecutor(max_workers=10) as executor:
         futures = {executor.submit(get_request, plant_id):
-                   plant_id for plant_id in range(plant_count+1)}
+                   plant_id for plant_id in plant_ids}
 
         for future in as_completed(futures):
-            plant_data = future.result()
-            if not plant_data.get("error"):
-                recordings.append(build_entry(plant_data))
+            results.append(future.result())
+
+    return results
+
+
+def extract(mode: str = None, shard_index: int = 0, shard_count: int = 1) -> pd.DataFrame:
+    """This function goes through the plants in this shard, extracting the key information,
+    and then turns it into a dataframe ready for cleaning.
+    The mode ('threads' or 'async') defaults to the EXTRACT_MODE env variable."""
+    full_probe = probe_due()
+    plant_ids = get_plant_ids(shard_index, shard_count, full_probe)
+    mode = mode or ENV.get("EXTRACT_MODE", "threads")
+
+    if mode == "async":
+        results = asyncio.run(get_all_requests_async(plant_ids))
+    else:
+        results = extract_threaded(plant_ids)
+
+    recordings = [build_entry(plant_data) for plant_data in results
+                  if not plant_data.get("error")]
+    increment("PlantsFetched", len(recordings))
+    increment("PlantErrors", len(results) - len(recordings))
+    update_registry(plant_ids, [entry["plant_id"] for entry in recordings], full_probe)
 
-    return pd.DataFrame(recordings).sort_values("plant_id").reset_index(drop=True)
+    return pd.DataFrame(recordings, columns=COLUMNS).sort_values("plant_id").reset_index(drop=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,146 @@
+"""A local stand-in for the plants API, for benchmarking the pipeline end to end.
+Run with `python3 fake_api.py` and point the pipeline at it with
+PLANTS_API_URL=http://localhost:8000/plants/."""
+
+import json
+import random
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from os import environ as ENV
+from threading import Lock, Thread
+from time import sleep
+
+
+FIRST_READING = datetime(2024, 10, 1)
+
+
+class FakePlantsAPI:
+    """
+    Serves a reading for each of plants 1 to plant_count, shaped like the real API.
+    Each response is delayed by latency_ms, give or take up to jitter_ms. A share of the
+    requests (error_rate) fail with a server error, and another share (malformed_rate)
+    get a truncated body that isn't valid JSON. Other plant IDs aren't found.
+    Every request for a plant returns a reading a minute after its previous one,
+    so repeated runs are never deduplicated.
+    """
+
+    def __init__(self, plant_count: int = 50, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0, malformed_rate: float = 0.0, port: int = 0,
+                 seed: int = None):
+        self.plant_count = plant_count
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.readings = {}
+        self.requests = 0
+        self.random = random.Random(seed)
+        self.lock = Lock()
+        self.server = FakePlantsServer(("127.0.0.1", port), FakePlantsHandler)
+        self.server.daemon_threads = True
+        self.server.api = self
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        """Returns the base URL to request plants from, ending in a slash."""
+        return f"http://127.0.0.1:{self.server.server_address[1]}/plants/"
+
+    def start(self) -> "FakePlantsAPI":
+        """Starts serving in a background thread."""
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stops serving and closes the socket."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "FakePlantsAPI":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def next_reading(self, plant_id: int) -> dict:
+        """Returns the plant's next reading, one minute after its last."""
+        with self.lock:
+            self.readings[plant_id] = self.readings.get(plant_id, -1) + 1
+            taken = FIRST_READING + timedelta(minutes=self.readings[plant_id])
+            temperature = round(self.random.uniform(10, 35), 2)
+            soil_moisture = round(self.random.uniform(20, 95), 2)
+
+        return {"plant_id": plant_id,
+                "name": f"Plant {plant_id}",
+                "recording_taken": taken.strftime("%Y-%m-%d %H:%M:%S"),
+                "last_watered": (taken - timedelta(hours=plant_id % 24)).strftime(
+                    "%a, %d %b %Y %H:%M:%S GMT"),
+                "soil_moisture": soil_moisture,
+                "temperature": temperature,
+                "botanist": {"name": "Fake Botanist", "email": "fake@example.com"},
+                "origin_location": ["0.0", "0.0", "Nowhere", "XX", "Etc/UTC"]}
+
+    def respond(self, path: str) -> tuple[int, bytes]:
+        """Returns the status and body of the response to a request for the path."""
+        with self.lock:
+            self.requests += 1
+            delay = max(0.0, self.latency_ms + self.random.uniform(-1, 1) * self.jitter_ms)
+            outcome = self.random.random()
+        sleep(delay / 1000)
+
+        try:
+            plant_id = int(path.rstrip("/").rsplit("/", 1)[1])
+        except (IndexError, ValueError):
+            return 404, json.dumps({"error": "page not found"}).encode()
+
+        if outcome < self.error_rate:
+            return 500, b"Internal Server Error"
+        if not 1 <= plant_id <= self.plant_count:
+            return 404, json.dumps({"error": "plant not found", "plant_id": plant_id}).encode()
+
+        body = json.dumps(self.next_reading(plant_id)).encode()
+        if outcome < self.error_rate + self.malformed_rate:
+            return 200, body[:len(body) // 2]
+        return 200, body
+
+
+class FakePlantsServer(ThreadingHTTPServer):
+    """A threaded server that queues enough connections for the extract's pool of threads.
+    With the default of 5, connections are dropped and retried a second later."""
+
+    request_queue_size = 128
+
+
+class FakePlantsHandler(BaseHTTPRequestHandler):
+    """Answers GET requests from the FakePlantsAPI the server belongs to."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Sends the response to one request, keeping the connection open."""
+        status, body = self.server.api.respond(self.path)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Doesn't log each request, which would slow down the benchmarks."""
+
+
+def behaviour_from_env() -> dict:
+    """Returns the latency, jitter, error rate and malformed rate
+    set by the FAKE_API_* env variables."""
+    return {"latency_ms": float(ENV.get("FAKE_API_LATENCY_MS", 0)),
+            "jitter_ms": float(ENV.get("FAKE_API_JITTER_MS", 0)),
+            "error_rate": float(ENV.get("FAKE_API_ERROR_RATE", 0)),
+            "malformed_rate": float(ENV.get("FAKE_API_MALFORMED_RATE", 0))}
+
+
+if __name__ == "__main__":
+    api = FakePlantsAPI(plant_count=int(ENV.get("FAKE_API_PLANTS", 50)),
+                        port=int(ENV.get("FAKE_API_PORT", 8000)), **behaviour_from_env())
+    print(f"Serving {api.plant_count} fake plants at {api.url}")
+    api.server.serve_forever()
@@ -1,9 +1,28 @@
 """this script is a lambda handler and handles events."""
+from os import environ as ENV
 
 from etl import run
+from load import pool_metrics
+from metrics import reset_metrics, timed_stage, increment, emit_metrics
 
 
 def lambda_handler(event: dict, context) -> dict:
-    """This function processes events"""
-    run()
-    return {}
+    """This function processes events.
+    Each invocation can fetch one shard of the plants, e.g. {"shard_index": 0, "shard_count": 4}.
+    The timings and counts of the run are logged in embedded metric format, even if it fails."""
+    event = event or {}
+    shard_index = int(event.get("shard_index", ENV.get("SHARD_INDEX", 0)))
+    shard_count = int(event.get("shard_count", ENV.get("SHARD_COUNT", 1)))
+
+    reset_metrics()
+    try:
+        with timed_stage("Run"):
+            run(shard_index, shard_count)
+    except Exception:
+        increment("RunErrors")
+        raise
+    finally:
+        metrics = emit_metrics({"Shard": f"{shard_index}/{shard_count}"})
+
+    return {"shard_index": shard_index, "shard_count": shard_count,
+            "connection_pool": pool_metrics(), "metrics": metrics}
@@ -2,11 +2,33 @@
 
 
 from os import environ as ENV
+from contextlib import contextmanager
+from threading import Lock
+from time import monotonic, perf_counter
 
 import pandas as pd
 import pymssql
 from dotenv import load_dotenv
 
+from metrics import increment
+
+
+RECORDING_COLUMNS = ["plant_id", "recording_taken", "last_watered",
+                     "soil_moisture", "temperature"]
+STAGING_TABLE = "#recording_staging"
+NEW_ROWS_ONLY = """
+    WHERE NOT EXISTS (
+        SELECT 1 FROM alpha.recording AS r WITH (UPDLOCK, HOLDLOCK)
+        WHERE r.plant_id = s.plant_id AND r.recording_taken = s.recording_taken)"""
+
+# The per-plant rollups kept for the dashboard, and the unit of time each is bucketed by.
+ROLLUP_TABLES = {"alpha.recording_minute": "MINUTE", "alpha.recording_hour": "HOUR"}
+
+# Kept at module level so that they survive between warm lambda invocations.
+HIGH_WATER_MARKS = {}
+POOL = {"idle": [], "lock": Lock(),
+        "metrics": {"created": 0, "reused": 0, "reconnected": 0, "discarded": 0, "in_use": 0}}
+
 
 def create_connection():
     """Returns a connection to connect to the database. """
@@ -20,26 +42,294 @@ def create_connection():
         as_dict=True)
 
 
-def load(recordings: pd.DataFrame) -> None:
+def is_connection_healthy(conn) -> bool:
+    """Returns True if the connection can still run a query."""
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1 AS healthy")
+            cursor.fetchone()
+        return True
+    except (pymssql.Error, OSError):
+        return False
+
+
+def close_quietly(conn) -> None:
+    """Closes a connection that may already be broken."""
+    try:
+        conn.close()
+    except (pymssql.Error, OSError):
+        pass
+
+
+def count_pool_event(*counters: str, in_use: int = 0) -> None:
+    """Adds one to each of the pool counters and in_use to the connections in use.
+    Threads share the pool, so the counters are only changed under its lock."""
+    with POOL["lock"]:
+        for counter in counters:
+            POOL["metrics"][counter] += 1
+        POOL["metrics"]["in_use"] += in_use
+
+
+def get_connection():
+    """Returns an idle pooled connection, or a new one if there are none.
+    Connections idle for longer than DB_POOL_HEALTHCHECK_SECONDS (default 30)
+    are checked first and replaced if they have gone stale."""
+    healthcheck_after = float(ENV.get("DB_POOL_HEALTHCHECK_SECONDS", 30))
+
+    with POOL["lock"]:
+        idle = POOL["idle"].pop() if POOL["idle"] else None
+
+    if idle:
+        conn, released_at = idle
+        if monotonic() - released_at < healthcheck_after or is_connection_healthy(conn):
+            count_pool_event("reused", in_use=1)
+            return conn
+        close_quietly(conn)
+        count_pool_event("reconnected")
+
+    conn = create_connection()
+    count_pool_event("created", in_use=1)
+    return conn
+
+
+def release_connection(conn, discard: bool = False) -> None:
+    """Returns a connection to the pool, keeping at most DB_POOL_SIZE (default 2) idle."""
+    pool_size = int(ENV.get("DB_POOL_SIZE", 2))
+
+    with POOL["lock"]:
+        POOL["metrics"]["in_use"] -= 1
+        if not discard and len(POOL["idle"]) < pool_size:
+            POOL["idle"].append((conn, monotonic()))
+            return
+        POOL["metrics"]["discarded"] += 1
+
+    close_quietly(conn)
+
+
+@contextmanager
+def pooled_connection():
+    """Lends a pooled connection, rolling back any open transaction if an error is raised."""
+    conn = get_connection()
+    try:
+        yield conn
+    except Exception:
+        try:
+            conn.rollback()
+            release_connection(conn)
+        except (pymssql.Error, OSError):
+            release_connection(conn, discard=True)
+        raise
+    release_connection(conn)
+
+
+def close_pool() -> None:
+    """Closes every idle connection in the pool."""
+    with POOL["lock"]:
+        idle, POOL["idle"] = POOL["idle"], []
+
+    for conn, _ in idle:
+        close_quietly(conn)
+
+
+def pool_metrics() -> dict:
+    """Returns the connection pool counters and the number of idle connections."""
+    with POOL["lock"]:
+        return {**POOL["metrics"], "idle": len(POOL["idle"])}
+
+
+def to_rows(recordings: pd.DataFrame) -> list[tuple]:
+    """Returns the recordings as tuples of plain Python values, with missing values as None."""
+    values = recordings[RECORDING_COLUMNS].astype(object)
+    return list(values.where(values.notna(), None).itertuples(index=False, name=None))
+
+
+def drop_seen_recordings(recordings: pd.DataFrame) -> pd.DataFrame:
+    """Removes duplicate readings within the batch, and readings no newer than
+    the latest one already loaded for that plant."""
+    recordings = recordings.drop_duplicates(["plant_id", "recording_taken"], keep="last")
+    high_water_marks = recordings["plant_id"].map(HIGH_WATER_MARKS)
+    seen = high_water_marks.notna() & (
+        pd.to_datetime(recordings["recording_taken"]) <= pd.to_datetime(high_water_marks))
+    return recordings[~seen]
+
+
+def update_high_water_marks(recordings: pd.DataFrame) -> None:
+    """Records the latest reading loaded for each plant."""
+    latest = pd.to_datetime(recordings["recording_taken"]).groupby(recordings["plant_id"]).max()
+    for plant_id, recording_taken in latest.items():
+        if recording_taken > HIGH_WATER_MARKS.get(plant_id, pd.Timestamp.min):
+            HIGH_WATER_MARKS[plant_id] = recording_taken
+
+
+def insert_statement(table: str, row_count: int, dedup: bool = False) -> str:
+    """Returns an INSERT of row_count rows of parameters. When deduplicating,
+    rows already in the recording table for that plant and time are skipped."""
+    columns = ", ".join(RECORDING_COLUMNS)
+    placeholders = ", ".join(["(%s, %s, %s, %s, %s)"] * row_count)
+
+    if not dedup:
+        return f"INSERT INTO {table} ({columns}) VALUES {placeholders}"
+
+    return f"""
+    INSERT INTO {table} ({columns})
+    SELECT s.plant_id, CAST(s.recording_taken AS DATETIME2),
+           CAST(s.last_watered AS DATETIME2), s.soil_moisture, s.temperature
+    FROM (VALUES {placeholders}) AS s ({columns}){NEW_ROWS_ONLY}"""
+
+
+def insert_executemany(cursor, table: str, rows: list[tuple], dedup: bool = False) -> int:
+    """Inserts the rows with one statement per row, returning the number inserted."""
+    cursor.executemany(insert_statement(table, 1, dedup), rows)
+    return cursor.rowcount
+
+
+def insert_multirow(cursor, table: str, rows: list[tuple], batch_size: int,
+                    dedup: bool = False) -> int:
+    """Inserts the rows with one multi-row VALUES statement per batch,
+    returning the number inserted."""
+    inserted = 0
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        cursor.execute(insert_statement(table, len(batch), dedup),
+                       tuple(value for row in batch for value in row))
+        inserted += cursor.rowcount
+    return inserted
+
+
+def insert_staged(cursor, rows: list[tuple], batch_size: int, dedup: bool = False) -> int:
+    """Inserts the rows into a temporary staging table in batches, then moves
+    them into the recording table with a single INSERT ... SELECT,
+    returning the number inserted."""
+    columns = ", ".join(RECORDING_COLUMNS)
+    cursor.execute(f"""
+    IF OBJECT_ID('tempdb..{STAGING_TABLE}') IS NOT NULL DROP TABLE {STAGING_TABLE};
+    SELECT TOP 0 {columns} INTO {STAGING_TABLE} FROM alpha.recording;
+    """)
+    insert_multirow(cursor, STAGING_TABLE, rows, batch_size)
+    cursor.execute(f"""
+    INSERT INTO alpha.recording ({columns})
+    SELECT {columns} FROM {STAGING_TABLE} AS s{NEW_ROWS_ONLY if dedup else ""};
+    """)
+    inserted = cursor.rowcount
+    cursor.execute(f"DROP TABLE {STAGING_TABLE};")
+    return inserted
+
+
+def rollup_statement(table: str, unit: str) -> str:
+    """
+    Returns the MERGE that recalculates the count, average, min and max of each metric
+    for every plant and bucket of the unit of time (MINUTE or HOUR) in a range of
+    recordings, from the recording table. Recalculating rather than adding on means
+    a retried or partly deduplicated load still leaves the rollups exact.
+    """
+    return f"""
+    MERGE {table} WITH (HOLDLOCK) AS t
+    USING (
+        SELECT r.plant_id, b.bucket_start,
+            COUNT(*) AS recording_count,
+            COUNT(r.temperature) AS temperature_count,
+            AVG(r.temperature) AS average_temperature,
+            MIN(r.temperature) AS min_temperature,
+            MAX(r.temperature) AS max_temperature,
+            COUNT(r.soil_moisture) AS soil_moisture_count,
+            AVG(r.soil_moisture) AS average_soil_moisture,
+            MIN(r.soil_moisture) AS min_soil_moisture,
+            MAX(r.soil_moisture) AS max_soil_moisture
+        FROM alpha.recording AS r
+        CROSS APPLY (SELECT DATEADD({unit}, DATEDIFF({unit}, 0, r.recording_taken), 0)
+                     AS bucket_start) AS b
+        WHERE r.plant_id IN %s AND r.recording_taken >= %s AND r.recording_taken < %s
+        GROUP BY r.plant_id, b.bucket_start) AS s
+    ON t.plant_id = s.plant_id AND t.bucket_start = s.bucket_start
+    WHEN MATCHED THEN UPDATE SET
+        recording_count = s.recording_count,
+        temperature_count = s.temperature_count,
+        average_temperature = s.average_temperature,
+        min_temperature = s.min_temperature,
+        max_temperature = s.max_temperature,
+        soil_moisture_count = s.soil_moisture_count,
+        average_soil_moisture = s.average_soil_moisture,
+        min_soil_moisture = s.min_soil_moisture,
+        max_soil_moisture = s.max_soil_moisture
+    WHEN NOT MATCHED THEN
+        INSERT (plant_id, bucket_start, recording_count,
+                temperature_count, average_temperature, min_temperature, max_temperature,
+                soil_moisture_count, average_soil_moisture, min_soil_moisture, max_soil_moisture)
+        VALUES (s.plant_id, s.bucket_start, s.recording_count,
+                s.temperature_count, s.average_temperature, s.min_temperature, s.max_temperature,
+                s.soil_moisture_count, s.average_soil_moisture, s.min_soil_moisture,
+                s.max_soil_moisture);
+    """
+
+
+def update_rollups(cursor, recordings: pd.DataFrame) -> None:
+    """Recalculates the minute and hour rollups of the plants in the recordings,
+    for every whole hour the recordings were taken in. Without recordings there is
+    nothing to recalculate."""
+    if recordings.empty:
+        return
+
+    taken = pd.to_datetime(recordings["recording_taken"])
+    start = taken.min().floor("h").to_pydatetime()
+    end = (taken.max().floor("h") + pd.Timedelta(hours=1)).to_pydatetime()
+    plant_ids = tuple(int(plant_id) for plant_id in recordings["plant_id"].unique())
+
+    for table, unit in ROLLUP_TABLES.items():
+        cursor.execute(rollup_statement(table, unit), (plant_ids, start, end))
+
+
+def choose_strategy(row_count: int) -> str:
+    """Returns the staging strategy for large loads such as backfills
+    (LOAD_STAGING_THRESHOLD rows, default 100000), otherwise multi-row inserts."""
+    if row_count >= int(ENV.get("LOAD_STAGING_THRESHOLD", 100_000)):
+        return "staging"
+    return "multirow"
+
+
+def load(recordings: pd.DataFrame, strategy: str = None, dedup: bool = True) -> None:
     '''
-    Uploads LMNH plant recording data to 
+    Uploads LMNH plant recording data to
     the recording table in the database.
+    The strategy can be 'executemany', 'multirow' or 'staging', and is
+    otherwise chosen from the number of recordings.
+    With dedup, readings already loaded for a plant and time are skipped,
+    so overlapping or retried runs don't insert them again.
+    The minute and hour rollups read by the dashboard are updated in the
+    same transaction.
     '''
 
-    nice = [tuple(x) for x in recordings.values]
-    insert_query = '''
-    INSERT INTO alpha.recording VALUES (%d, %s, %s, %s, %s)
-    '''
+    if dedup:
+        recordings = drop_seen_recordings(recordings)
+        if recordings.empty:
+            print('No new values to insert')
+            return
 
-    conn = create_connection()
+    rows = to_rows(recordings)
+    strategy = strategy or choose_strategy(len(rows))
+    # SQL Server allows at most 1000 rows in one VALUES clause.
+    batch_size = min(int(ENV.get("LOAD_BATCH_SIZE", 1000)), 1000)
+    start = perf_counter()
+
+    with pooled_connection() as conn:
+        with conn.cursor() as cursor:
+            if strategy == "executemany":
+                inserted = insert_executemany(cursor, "alpha.recording", rows, dedup)
+            elif strategy == "staging":
+                inserted = insert_staged(cursor, rows, batch_size, dedup)
+            else:
+                inserted = insert_multirow(cursor, "alpha.recording", rows, batch_size, dedup)
+
+            update_rollups(cursor, recordings)
 
-    with conn.cursor() as cursor:
-        cursor.executemany(insert_query, nice)
+        conn.commit()
 
-    print(f'Inserted {len(recordings)} values')
+    increment("RowsInserted", inserted)
+    if dedup:
+        update_high_water_marks(recordings)
 
-    conn.commit()
-    conn.close()
+    elapsed = perf_counter() - start
+    print(f'Inserted {inserted} of {len(rows)} values using {strategy} in {elapsed:.2f}s '
+          f'({len(rows) / elapsed if elapsed else 0:.0f} rows/s)')
 
 
 if __name__ == '__main__':
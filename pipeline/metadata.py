@@ -0,0 +1,78 @@
+"""This script caches the plant, botanist and location details, which rarely change."""
+
+from os import environ as ENV
+from time import monotonic
+
+import pandas as pd
+
+from load import pooled_connection
+
+
+METADATA_COLUMNS = ["plant_id", "plant_name", "scientific_name", "image_url",
+                    "botanist_name", "botanist_email", "botanist_phone_no",
+                    "city_name", "country_code", "latitude", "longitude"]
+
+# Kept at module level so that it survives between warm lambda invocations.
+# The missing ids are plants the API reports that the last reload didn't find.
+CACHE = {"metadata": None, "loaded_at": None, "missing": set()}
+
+
+def fetch_plant_metadata() -> pd.DataFrame:
+    """Returns the details of every plant, its botanist and its origin in one query."""
+    query = f"""
+        SELECT p.plant_id, p.plant_name, p.scientific_name, p.image_url,
+               b.botanist_name, b.botanist_email, b.botanist_phone_no,
+               l.city_name, l.country_code, l.latitude, l.longitude
+        FROM {ENV['SCHEMA_NAME']}.plant as p
+        JOIN {ENV['SCHEMA_NAME']}.botanist as b
+        ON b.botanist_id=p.botanist_id
+        JOIN {ENV['SCHEMA_NAME']}.location as l
+        ON l.location_id=p.location_id"""
+
+    with pooled_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(query)
+            data = cursor.fetchall()
+
+    return pd.DataFrame(data, columns=METADATA_COLUMNS).set_index("plant_id", drop=False)
+
+
+def invalidate_metadata() -> None:
+    """Forces the metadata to be reloaded on the next lookup."""
+    CACHE["metadata"] = None
+    CACHE["loaded_at"] = None
+    CACHE["missing"] = set()
+
+
+def get_all_metadata() -> pd.DataFrame:
+    """Returns the cached plant metadata, reloading it once it is older
+    than METADATA_TTL_SECONDS (default 3600)."""
+    ttl = float(ENV.get("METADATA_TTL_SECONDS", 3600))
+
+    if CACHE["metadata"] is None or monotonic() - CACHE["loaded_at"] >= ttl:
+        CACHE["metadata"] = fetch_plant_metadata()
+        CACHE["loaded_at"] = monotonic()
+        CACHE["missing"] = set()
+
+    return CACHE["metadata"]
+
+
+def get_plants_metadata(plant_ids) -> pd.DataFrame:
+    """Returns the metadata for the given plants. An unknown plant, such as one
+    added since the cache was loaded, triggers a single reload. Plants still
+    missing after it don't trigger another until the cache expires."""
+    plant_ids = pd.Index(plant_ids).astype(int)
+    metadata = get_all_metadata()
+
+    if not plant_ids.isin(metadata.index.union(pd.Index(list(CACHE["missing"])))).all():
+        invalidate_metadata()
+        metadata = get_all_metadata()
+        CACHE["missing"] = set(plant_ids[~plant_ids.isin(metadata.index)])
+
+    return metadata[metadata.index.isin(plant_ids)].reset_index(drop=True)
+
+
+def get_plant_metadata(plant_id: int) -> dict:
+    """Returns the metadata for one plant, or None if the plant doesn't exist."""
+    metadata = get_plants_metadata([plant_id])
+    return metadata.iloc[0].to_dict() if not metadata.empty else None
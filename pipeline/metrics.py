@@ -0,0 +1,112 @@
+"""This script collects the timings and counts of a run, and emits them as one log line
+in CloudWatch embedded metric format (EMF), so they become metrics without any API calls."""
+
+import json
+from contextlib import contextmanager
+from os import environ as ENV
+from threading import Lock
+from time import perf_counter, time
+
+import numpy as np
+
+
+# The upper bounds of the fetch latency histogram, in milliseconds.
+LATENCY_BUCKETS_MS = [25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+# CloudWatch accepts at most 100 values for one metric in an EMF record.
+MAX_EMF_VALUES = 100
+
+# Reset at the start of each invocation, as warm invocations share the module.
+METRICS = {"stages": {}, "counters": {}, "fetch_latencies": [], "lock": Lock()}
+
+
+def reset_metrics() -> None:
+    """Forgets the timings and counts of the previous run."""
+    with METRICS["lock"]:
+        METRICS["stages"] = {}
+        METRICS["counters"] = {}
+        METRICS["fetch_latencies"] = []
+
+
+@contextmanager
+def timed_stage(stage: str):
+    """Adds the milliseconds spent in the block to the stage, even if it raises."""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (perf_counter() - start) * 1000
+        with METRICS["lock"]:
+            METRICS["stages"][stage] = METRICS["stages"].get(stage, 0.0) + elapsed
+
+
+def increment(counter: str, amount: int = 1) -> None:
+    """Adds to a counter, such as the HTTP requests made or the emails sent."""
+    with METRICS["lock"]:
+        METRICS["counters"][counter] = METRICS["counters"].get(counter, 0) + amount
+
+
+def record_fetch_latency(seconds: float) -> None:
+    """Records how long one plant took to fetch, including any retries."""
+    with METRICS["lock"]:
+        METRICS["fetch_latencies"].append(seconds * 1000)
+
+
+def latency_histogram(latencies: list[float]) -> dict:
+    """Returns the number of latencies at or below each bucket, like a Prometheus histogram."""
+    histogram = {f"le_{bound}": sum(latency <= bound for latency in latencies)
+                 for bound in LATENCY_BUCKETS_MS}
+    histogram["le_inf"] = len(latencies)
+    return histogram
+
+
+def summarise_metrics() -> dict:
+    """Returns the stage timings, counters and fetch latency statistics of the run."""
+    latencies = METRICS["fetch_latencies"]
+    summary = {"stages_ms": {stage: round(ms, 1) for stage, ms in METRICS["stages"].items()},
+               "counters": dict(METRICS["counters"]),
+               "fetch_latency_ms": {"count": len(latencies),
+                                    "histogram": latency_histogram(latencies)}}
+    if latencies:
+        summary["fetch_latency_ms"].update({
+            "p50": round(float(np.percentile(latencies, 50)), 1),
+            "p99": round(float(np.percentile(latencies, 99)), 1),
+            "max": round(max(latencies), 1)})
+    return summary
+
+
+def latency_values(latencies: list[float]) -> list[float]:
+    """Returns the latencies for an EMF record. Beyond MAX_EMF_VALUES they are replaced
+    by evenly spaced percentiles, which keep the shape of the distribution."""
+    if len(latencies) <= MAX_EMF_VALUES:
+        return [round(latency, 1) for latency in latencies]
+    percentiles = np.linspace(0, 100, MAX_EMF_VALUES)
+    return [round(float(value), 1) for value in np.percentile(latencies, percentiles)]
+
+
+def emf_record(dimensions: dict) -> dict:
+    """Returns the run's metrics as an EMF record, with each stage as <stage>Time
+    in milliseconds, each counter as a count, and the fetch latencies as FetchLatency."""
+    namespace = ENV.get("METRICS_NAMESPACE", "LMNHPlants/Pipeline")
+    summary = summarise_metrics()
+    values = {f"{stage}Time": ms for stage, ms in summary["stages_ms"].items()}
+    units = {name: "Milliseconds" for name in values}
+    values.update(summary["counters"])
+    units.update({counter: "Count" for counter in summary["counters"]})
+    if METRICS["fetch_latencies"]:
+        values["FetchLatency"] = latency_values(METRICS["fetch_latencies"])
+        units["FetchLatency"] = "Milliseconds"
+
+    return {"_aws": {"Timestamp": int(time() * 1000),
+                     "CloudWatchMetrics": [{
+                         "Namespace": namespace,
+                         "Dimensions": [list(dimensions)],
+                         "Metrics": [{"Name": name, "Unit": unit}
+                                     for name, unit in units.items()]}]},
+            **dimensions, **values,
+            "fetch_latency_ms": summary["fetch_latency_ms"]}
+
+
+def emit_metrics(dimensions: dict) -> dict:
+    """Prints the run's EMF record as one line of JSON and returns the summary."""
+    print(json.dumps(emf_record(dimensions)))
+    return summarise_metrics()
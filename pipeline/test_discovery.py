@@ -0,0 +1,74 @@
+"""This file tests the functionality of the discovery script."""
+
+from unittest import TestCase
+from unittest.mock import patch
+
+import pytest
+
+from discovery import (REGISTRY, reset_registry, probe_due, shard_plant_ids,
+                       get_plant_ids, update_registry)
+
+
+class TestShardPlantIds(TestCase):
+    """Tests for the shard plant ids function."""
+
+    def test_shard_plant_ids_splits_evenly(self):
+        """Tests that every plant id ends up in exactly one shard."""
+        shards = [shard_plant_ids(range(10), index, 3) for index in range(3)]
+
+        assert shards == [[0, 3, 6, 9], [1, 4, 7], [2, 5, 8]]
+
+    def test_shard_plant_ids_invalid_shard(self):
+        """Tests that a shard index outside the shard count raises an error."""
+        with pytest.raises(ValueError):
+            shard_plant_ids(range(10), 3, 3)
+
+
+class TestRegistry(TestCase):
+    """Tests for the registry functions."""
+
+    def setUp(self):
+        reset_registry()
+
+    def test_empty_registry_probes_default_range(self):
+        """Tests that a cold registry probes every id up to the headroom
+        above the default plant count."""
+        with patch.dict('discovery.ENV', {'DISCOVERY_HEADROOM': '5'}):
+            plant_ids = get_plant_ids(full_probe=probe_due())
+
+        assert plant_ids == list(range(56))
+
+    def test_warm_registry_fetches_live_plants(self):
+        """Tests that only the known-live plants are fetched between probes."""
+        update_registry(range(10), [1, 2, 5], full_probe=True)
+
+        assert not probe_due()
+        assert get_plant_ids() == [1, 2, 5]
+        assert get_plant_ids(shard_index=1, shard_count=2) == [1, 5]
+
+    def test_probe_window_follows_highest_plant(self):
+        """Tests that a probe looks above the highest known plant."""
+        update_registry(range(80), [3, 70], full_probe=True)
+
+        with patch.dict('discovery.ENV', {'DISCOVERY_HEADROOM': '10'}):
+            plant_ids = get_plant_ids(full_probe=True)
+
+        assert plant_ids[-1] == 80
+
+    def test_probe_due_after_interval(self):
+        """Tests that the registry is re-probed once the interval passes."""
+        update_registry([1], [1], full_probe=True)
+
+        with patch.dict('discovery.ENV', {'DISCOVERY_REPROBE_SECONDS': '0'}):
+            assert probe_due()
+
+    def test_plant_dropped_after_consecutive_misses(self):
+        """Tests that a live plant is only dropped after repeated misses."""
+        update_registry([1, 2], [1, 2], full_probe=True)
+
+        with patch.dict('discovery.ENV', {'DISCOVERY_MAX_MISSES': '2'}):
+            update_registry([1, 2], [1])
+            assert REGISTRY["live"] == {1, 2}
+
+            update_registry([1, 2], [1])
+            assert REGISTRY["live"] == {1}
@@ -1,18 +1,38 @@
+from datetime import datetime, timedelta
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 
-from emailing import send_email, generate_html, get_botanist_info
+import pandas as pd
+import pymssql
+from botocore.exceptions import ClientError
+
+from emailing import (send_email, send_digest, generate_html, get_botanist_info,
+                      generate_digest_html, fetch_last_alerted, record_alerts_sent,
+                      remove_recent_alerts, dispatch_alerts, SES)
+
+
+def fake_connection() -> tuple[MagicMock, MagicMock]:
+    """Returns a fake connection and its cursor."""
+    fake_conn = MagicMock()
+    fake_cursor = MagicMock()
+    fake_conn.cursor.return_value.__enter__.return_value = fake_cursor
+    return fake_conn, fake_cursor
 
 
 class TestEmailingFunction(TestCase):
     """Tests for emailing.py functions"""
 
+    def setUp(self):
+        SES["client"] = None
+
     @patch('emailing.boto3.client')
+    @patch('emailing.get_botanist_info')
     @patch('emailing.generate_html')
     @patch.dict('emailing.ENV', {'FROM_EMAIL': 'test_from@example.com', 'TO_EMAIL': 'test_to@example.com'})
-    def test_send_email(self, fake_generate_html, fake_boto_client):
+    def test_send_email(self, fake_generate_html, fake_get_botanist_info, fake_boto_client):
         """Test that send_email sends an email with the correct parameters."""
         fake_generate_html.return_value = "<html>Test Email Content</html>"
+        fake_get_botanist_info.return_value = {'botanist_email': 'dr.green@example.com'}
 
         fake_ses_client = MagicMock()
         fake_boto_client.return_value = fake_ses_client
@@ -30,6 +50,20 @@ class TestEmailingFunction(TestCase):
                 'Data': fake_ses_client.send_raw_email.call_args[1]['RawMessage']['Data']}
         )
 
+    @patch('emailing.boto3.client')
+    @patch.dict('emailing.ENV', {'FROM_EMAIL': 'test_from@example.com'})
+    def test_send_digest_to_botanist(self, fake_boto_client):
+        """Test that without the TO_EMAIL override the digest goes to the botanist."""
+        alerts = pd.DataFrame({"plant_id": [1], "plant_name": ["Aloe Vera"],
+                               "metric": ["temperature"], "value": [55.0],
+                               "direction": ["exceeded"]})
+
+        with patch.dict('emailing.ENV', {'TO_EMAIL': ''}):
+            send_digest('Dr. Green', 'green@example.com', alerts)
+
+        self.assertEqual(fake_boto_client.return_value.send_raw_email.call_args[1]['Destinations'],
+                         ['green@example.com'])
+
     def test_generate_html(self):
         """Test that generate_html returns the correct HTML content."""
         fake_botanist_info = {
@@ -48,17 +82,10 @@ class TestEmailingFunction(TestCase):
         self.assertIn('75.0°C', html_output)
         self.assertIn('higher', html_output)
 
-    @patch.dict('os.environ', {'SCHEMA_NAME': 'fake_schema'})
-    @patch('emailing.create_connection')
-    def test_get_botanist_info(self, fake_create_connection):
-        """Test that get_botanist_info returns correct data from the database."""
-
-        fake_conn = MagicMock()
-        fake_cursor = MagicMock()
-        fake_conn.cursor.return_value.__enter__.return_value = fake_cursor
-        fake_create_connection.return_value = fake_conn
-
-        fake_cursor.fetchone.return_value = {
+    @patch('emailing.get_plant_metadata')
+    def test_get_botanist_info(self, fake_get_plant_metadata):
+        """Test that get_botanist_info returns the plant's cached metadata."""
+        fake_get_plant_metadata.return_value = {
             'botanist_name': 'Dr. Green',
             'botanist_email': 'dr.green@example.com',
             'plant_name': 'Aloe Vera'
@@ -66,10 +93,161 @@ class TestEmailingFunction(TestCase):
 
         result = get_botanist_info(1)
 
-        fake_cursor.execute.assert_called
-
+        fake_get_plant_metadata.assert_called_once_with(1)
         self.assertEqual(result, {
             'botanist_name': 'Dr. Green',
             'botanist_email': 'dr.green@example.com',
             'plant_name': 'Aloe Vera'
         })
+
+
+class TestAlertDispatch(TestCase):
+    """Tests for the batched alert dispatch."""
+
+    def setUp(self):
+        SES["client"] = None
+        self.alert_log = pd.DataFrame(columns=["plant_id", "metric", "direction",
+                                               "last_alerted"])
+        self.alerts = pd.DataFrame({"plant_id": [1, 2, 3],
+                                    "metric": ["temperature", "soil moisture", "temperature"],
+                                    "value": [55.0, 20.0, 2.0],
+                                    "direction": ["exceeded", "not met", "not met"]})
+        self.botanists = pd.DataFrame({"plant_id": [1, 2, 3],
+                                       "plant_name": ["Aloe Vera", "Cactus", "Fern"],
+                                       "botanist_name": ["Dr. Green", "Dr. Green", "Dr. Brown"],
+                                       "botanist_email": ["green@example.com", "green@example.com",
+                                                          "brown@example.com"]})
+
+    def test_generate_digest_html(self):
+        """Test that the digest lists every alert for the botanist."""
+        alerts = self.alerts.merge(self.botanists, on="plant_id").head(2)
+
+        html_output = generate_digest_html('Dr. Green', 'green@example.com', alerts)
+
+        self.assertIn('Dr. Green', html_output)
+        self.assertIn('2 Readings', html_output)
+        self.assertIn('Aloe Vera (1)', html_output)
+        self.assertIn('55.0°C', html_output)
+        self.assertIn('Cactus (2)', html_output)
+        self.assertIn('20.0%', html_output)
+
+    def test_remove_recent_alerts(self):
+        """Test that alerts inside the cooldown are removed and older ones are kept."""
+        now = datetime(2024, 10, 1, 12, 0)
+        last_alerted = pd.DataFrame({"plant_id": [1, 2],
+                                     "metric": ["temperature", "soil moisture"],
+                                     "direction": ["exceeded", "not met"],
+                                     "last_alerted": [now - timedelta(minutes=5),
+                                                      now - timedelta(hours=2)]})
+
+        with patch.dict('emailing.ENV', {'ALERT_COOLDOWN_MINUTES': '60'}):
+            result = remove_recent_alerts(self.alerts, last_alerted, now)
+
+        self.assertEqual(result['plant_id'].tolist(), [2, 3])
+
+    def test_remove_recent_alerts_none_logged(self):
+        """Test that every alert is kept when none have been sent before."""
+        result = remove_recent_alerts(self.alerts, self.alert_log, datetime(2024, 10, 1))
+
+        self.assertEqual(result['plant_id'].tolist(), [1, 2, 3])
+
+    @patch('emailing.pooled_connection')
+    def test_fetch_last_alerted(self, fake_pooled_connection):
+        """Test that the alert log is read for the alerting plants in one query."""
+        fake_conn, fake_cursor = fake_connection()
+        fake_pooled_connection.return_value.__enter__.return_value = fake_conn
+        fake_cursor.fetchall.return_value = [{"plant_id": 1, "metric": "temperature",
+                                              "direction": "exceeded",
+                                              "last_alerted": datetime(2024, 10, 1)}]
+
+        result = fetch_last_alerted(self.alerts["plant_id"].unique())
+
+        fake_cursor.execute.assert_called_once()
+        self.assertIn("alpha.alert_log", fake_cursor.execute.call_args[0][0])
+        self.assertEqual(fake_cursor.execute.call_args[0][1], ((1, 2, 3),))
+        self.assertEqual(result["last_alerted"].tolist(), [datetime(2024, 10, 1)])
+
+    @patch('emailing.pooled_connection')
+    def test_record_alerts_sent(self, fake_pooled_connection):
+        """Test that the sent alerts are merged into the alert log and committed."""
+        fake_conn, fake_cursor = fake_connection()
+        fake_pooled_connection.return_value.__enter__.return_value = fake_conn
+        now = datetime(2024, 10, 1, 12, 0)
+
+        record_alerts_sent(self.alerts, now)
+
+        statement, params = fake_cursor.execute.call_args[0]
+        self.assertIn("MERGE alpha.alert_log", statement)
+        self.assertEqual(params[:4], (1, "temperature", "exceeded", now))
+        self.assertEqual(len(params), 12)
+        fake_conn.commit.assert_called_once()
+
+    @patch('emailing.record_alerts_sent')
+    @patch('emailing.fetch_last_alerted')
+    @patch('emailing.send_digest')
+    @patch('emailing.get_plants_metadata')
+    def test_dispatch_alerts_one_email_per_botanist(self, fake_get_plants_metadata,
+                                                    fake_send_digest, fake_fetch_last_alerted,
+                                                    fake_record_alerts_sent):
+        """Test that the alerts are grouped into one digest per botanist."""
+        fake_get_plants_metadata.return_value = self.botanists
+        fake_fetch_last_alerted.return_value = self.alert_log
+
+        sent = dispatch_alerts(self.alerts)
+
+        self.assertEqual(sent, 2)
+        fake_get_plants_metadata.assert_called_once()
+        digests = {call[0][0]: call[0][2]['plant_id'].tolist()
+                   for call in fake_send_digest.call_args_list}
+        self.assertEqual(digests, {'Dr. Green': [1, 2], 'Dr. Brown': [3]})
+        fake_record_alerts_sent.assert_called_once()
+
+    @patch('emailing.record_alerts_sent')
+    @patch('emailing.fetch_last_alerted')
+    @patch('emailing.send_digest')
+    @patch('emailing.get_plants_metadata')
+    def test_dispatch_alerts_cooldown(self, fake_get_plants_metadata, fake_send_digest,
+                                      fake_fetch_last_alerted, fake_record_alerts_sent):
+        """Test that a plant staying out of range isn't emailed again every run,
+        as the next run reads back the alerts logged by this one."""
+        fake_get_plants_metadata.return_value = self.botanists
+        alert_log = [self.alert_log]
+        fake_fetch_last_alerted.side_effect = lambda plant_ids: alert_log[-1]
+        fake_record_alerts_sent.side_effect = lambda alerts, now: alert_log.append(
+            alerts[["plant_id", "metric", "direction"]].assign(last_alerted=now))
+
+        dispatch_alerts(self.alerts)
+        sent = dispatch_alerts(self.alerts)
+
+        self.assertEqual(sent, 0)
+        self.assertEqual(fake_send_digest.call_count, 2)
+
+    @patch('emailing.record_alerts_sent')
+    @patch('emailing.fetch_last_alerted')
+    @patch('emailing.send_digest')
+    @patch('emailing.get_plants_metadata')
+    def test_dispatch_alerts_failure_retried(self, fake_get_plants_metadata, fake_send_digest,
+                                             fake_fetch_last_alerted, fake_record_alerts_sent):
+        """Test that alerts whose email failed are sent again on the next run."""
+        fake_get_plants_metadata.return_value = self.botanists
+        fake_fetch_last_alerted.return_value = self.alert_log
+        fake_send_digest.side_effect = ClientError({}, 'SendRawEmail')
+
+        sent = dispatch_alerts(self.alerts)
+
+        self.assertEqual(sent, 0)
+        fake_record_alerts_sent.assert_not_called()
+
+    @patch('emailing.record_alerts_sent')
+    @patch('emailing.fetch_last_alerted')
+    @patch('emailing.send_digest')
+    @patch('emailing.get_plants_metadata')
+    def test_dispatch_alerts_log_failure(self, fake_get_plants_metadata, fake_send_digest,
+                                         fake_fetch_last_alerted, fake_record_alerts_sent):
+        """Test that the run carries on if the sent alerts can't be logged."""
+        fake_get_plants_metadata.return_value = self.botanists
+        fake_fetch_last_alerted.return_value = self.alert_log
+        fake_record_alerts_sent.side_effect = pymssql.OperationalError('Connection lost')
+
+        self.assertEqual(dispatch_alerts(self.alerts), 2)
+        self.assertEqual(fake_send_digest.call_count, 2)
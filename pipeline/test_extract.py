@@ -1,14 +1,41 @@
 """This file tests the functionality of the extract script."""
 
+import asyncio
 from unittest import TestCase
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from concurrent.futures import Future
 
+import aiohttp
 import pandas as pd
 import pytest
 import requests
 
-from extract import get_request, build_entry, extract
+from discovery import reset_registry
+from metrics import METRICS, reset_metrics
+from extract import get_request, get_request_async, build_entry, extract
+
+
+class FakeResponse:
+    """A stand-in for an aiohttp response used as an async context manager."""
+
+    def __init__(self, status: int, body: dict):
+        self.status = status
+        self.json = AsyncMock(return_value=body)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+def run_get_request_async(responses: list, retries: int = 3) -> tuple[dict, MagicMock]:
+    """Runs get_request_async against a fake session returning the given responses."""
+    session = MagicMock()
+    session.get.side_effect = responses
+    result = asyncio.run(get_request_async(session, 1, asyncio.Semaphore(1),
+                                           retries=retries, backoff=0))
+    return result, session
 
 
 class TestGetRequest(TestCase):
@@ -41,6 +68,63 @@ class TestGetRequest(TestCase):
         with pytest.raises(requests.Timeout):
             get_request(plant_id)
 
+    @patch("extract.requests.get")
+    def test_get_request_counts_errors(self, fake_request_get):
+        """Tests that each request is counted and timed, and a timeout counted as an error."""
+        reset_metrics()
+        fake_request_get.side_effect = requests.Timeout
+
+        with pytest.raises(requests.Timeout):
+            get_request(1)
+
+        assert METRICS["counters"] == {"HttpRequests": 1, "HttpErrors": 1}
+        assert len(METRICS["fetch_latencies"]) == 1
+
+    @patch("extract.requests.get")
+    def test_get_request_malformed_body(self, fake_request_get):
+        """Tests that a body that isn't valid JSON is returned as an error for the plant."""
+        fake_request_get.return_value.json.side_effect = ValueError("Expecting value")
+
+        result = get_request(1)
+
+        assert result["plant_id"] == 1
+        assert "Expecting value" in result["error"]
+
+
+class TestGetRequestAsync(TestCase):
+    """Tests for the async get request function."""
+
+    def test_get_request_async_success(self):
+        """Tests that the plant data is returned from a single request."""
+        result, session = run_get_request_async([FakeResponse(200, {"plant_id": 1})])
+
+        assert result == {"plant_id": 1}
+        assert session.get.call_count == 1
+
+    def test_get_request_async_retries_server_errors(self):
+        """Tests that server errors and connection errors are retried."""
+        result, session = run_get_request_async([FakeResponse(503, {}),
+                                                 aiohttp.ClientConnectionError(),
+                                                 FakeResponse(200, {"plant_id": 1})])
+
+        assert result == {"plant_id": 1}
+        assert session.get.call_count == 3
+
+    def test_get_request_async_gives_up(self):
+        """Tests that an error entry is returned once the retries run out."""
+        result, session = run_get_request_async([FakeResponse(500, {})] * 3, retries=2)
+
+        assert "error" in result
+        assert result["plant_id"] == 1
+        assert session.get.call_count == 3
+
+    def test_get_request_async_does_not_retry_missing_plants(self):
+        """Tests that a plant not found response is returned without retrying."""
+        result, session = run_get_request_async([FakeResponse(404, {"error": "not found"})])
+
+        assert result == {"error": "not found"}
+        assert session.get.call_count == 1
+
 
 class TestBuildEntry(TestCase):
     """Tests for the build entry function."""
@@ -84,12 +168,13 @@ class TestBuildEntry(TestCase):
 class TestExtractFunction(TestCase):
     """Tests for the extract function."""
 
+    def setUp(self):
+        reset_registry()
+
     @patch('extract.build_entry')
-    @patch('extract.get_request')
     @patch('extract.as_completed')
     @patch('extract.ThreadPoolExecutor')
-    def test_extract_success(self, fake_executor, fake_as_completed,
-                             fake_get_request, fake_build_entry):
+    def test_extract_success(self, fake_executor, fake_as_completed, fake_build_entry):
         """Tests that the extract function works as intended with three 
         valid entries (reduced size for testing)."""
         plant_data_1 = {"plant_id": 1, "recording_taken": "2024-10-03 12:43:48",
@@ -170,3 +255,39 @@ class TestExtractFunction(TestCase):
                                    ).sort_values("plant_id").reset_index(drop=True)
 
         pd.testing.assert_frame_equal(result_df, expected_df)
+
+    @patch('extract.ThreadPoolExecutor')
+    @patch('extract.get_all_requests_async')
+    def test_extract_async_mode(self, fake_get_all_requests_async, fake_executor):
+        """Tests that the async mode fetches the plants without the thread pool."""
+        fake_get_all_requests_async.return_value = [
+            {"plant_id": 2, "recording_taken": "2024-10-03 12:42:48",
+             "last_watered": "Wed, 02 Oct 2024 13: 58: 32 GMT",
+             "soil_moisture": 30.0, "temperature": 19.8},
+            {"error": "Plant not found"},
+            {"plant_id": 1, "recording_taken": "2024-10-03 12:43:48",
+             "last_watered": "Wed, 02 Oct 2024 13: 54: 32 GMT",
+             "soil_moisture": 30.0, "temperature": 20.0}]
+
+        result_df = extract(mode="async")
+
+        fake_executor.assert_not_called()
+        assert result_df["plant_id"].tolist() == [1, 2]
+
+    @patch('extract.get_all_requests_async')
+    def test_extract_shard_uses_registry(self, fake_get_all_requests_async):
+        """Tests that a shard probes only its own plants, then only requests
+        the live ones on the next run."""
+        fake_get_all_requests_async.return_value = [
+            {"plant_id": 1, "recording_taken": "2024-10-03 12:43:48",
+             "last_watered": "Wed, 02 Oct 2024 13: 54: 32 GMT",
+             "soil_moisture": 30.0, "temperature": 20.0}]
+
+        extract(mode="async", shard_index=1, shard_count=2)
+        probed_ids = fake_get_all_requests_async.call_args[0][0]
+
+        extract(mode="async", shard_index=1, shard_count=2)
+        requested_ids = fake_get_all_requests_async.call_args[0][0]
+
+        assert all(plant_id % 2 == 1 for plant_id in probed_ids)
+        assert requested_ids == [1]
@@ -0,0 +1,55 @@
+"""This file tests the fake plants API used by the benchmarks."""
+
+from unittest import TestCase
+
+import requests
+
+from fake_api import FakePlantsAPI
+
+
+class TestFakePlantsAPI(TestCase):
+    """Tests for the fake plants API."""
+
+    def test_reading_shaped_like_the_api(self):
+        """Tests that a plant's reading has the fields the extract reads."""
+        with FakePlantsAPI(plant_count=3, seed=1) as api:
+            result = requests.get(f"{api.url}2", timeout=5).json()
+
+        assert result["plant_id"] == 2
+        assert result["recording_taken"] == "2024-10-01 00:00:00"
+        assert result["last_watered"].endswith("GMT")
+        assert isinstance(result["temperature"], float)
+        assert isinstance(result["soil_moisture"], float)
+
+    def test_readings_advance_a_minute_per_request(self):
+        """Tests that each request for a plant returns a newer reading."""
+        with FakePlantsAPI(plant_count=3, seed=1) as api:
+            first = requests.get(f"{api.url}1", timeout=5).json()
+            second = requests.get(f"{api.url}1", timeout=5).json()
+
+        assert first["recording_taken"] == "2024-10-01 00:00:00"
+        assert second["recording_taken"] == "2024-10-01 00:01:00"
+
+    def test_unknown_plant_not_found(self):
+        """Tests that a plant outside the fleet returns an error, like the real API."""
+        with FakePlantsAPI(plant_count=3, seed=1) as api:
+            response = requests.get(f"{api.url}4", timeout=5)
+
+        assert response.status_code == 404
+        assert response.json() == {"error": "plant not found", "plant_id": 4}
+
+    def test_error_rate(self):
+        """Tests that every request fails with a server error at an error rate of 1."""
+        with FakePlantsAPI(plant_count=3, error_rate=1, seed=1) as api:
+            response = requests.get(f"{api.url}1", timeout=5)
+
+        assert response.status_code == 500
+
+    def test_malformed_rate(self):
+        """Tests that every body is truncated at a malformed rate of 1."""
+        with FakePlantsAPI(plant_count=3, malformed_rate=1, seed=1) as api:
+            response = requests.get(f"{api.url}1", timeout=5)
+
+        assert response.status_code == 200
+        with self.assertRaises(ValueError):
+            response.json()
@@ -1,24 +1,47 @@
 """This file tests the functionality of the load script."""
 
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 
 import pandas as pd
+import pymssql
+import pytest
 
-from load import load
+from load import load, get_connection, release_connection, pooled_connection, \
+    close_pool, pool_metrics, to_rows, insert_multirow, choose_strategy, \
+    drop_seen_recordings, POOL, HIGH_WATER_MARKS
+
+
+def fake_connection() -> tuple[MagicMock, MagicMock]:
+    """Returns a fake connection and its cursor."""
+    fake_conn = MagicMock()
+    fake_cursor = MagicMock()
+    fake_conn.cursor.return_value.__enter__.return_value = fake_cursor
+    return fake_conn, fake_cursor
+
+
+def fake_recordings(plant_ids: list[int], recording_taken: list[str]) -> pd.DataFrame:
+    """Returns recordings for the given plants and times."""
+    return pd.DataFrame({'plant_id': plant_ids,
+                         'recording_taken': pd.to_datetime(recording_taken),
+                         'last_watered': pd.to_datetime(['2024-09-30'] * len(plant_ids)),
+                         'soil_moisture': [30.0] * len(plant_ids),
+                         'temperature': [22.5] * len(plant_ids)})
 
 
 class TestLoad(TestCase):
     """Tests for the load function."""
 
+    def setUp(self):
+        close_pool()
+        HIGH_WATER_MARKS.clear()
+
     @patch('load.create_connection')
     def test_load_function(self, mock_create_connection):
         """Test that the load function correctly calls the correct methods and functions."""
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-
+        mock_conn, mock_cursor = fake_connection()
         mock_create_connection.return_value = mock_conn
-        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
 
         mock_data = pd.DataFrame({
             'plant_id': [1, 2],
@@ -30,6 +53,241 @@ class TestLoad(TestCase):
 
         load(mock_data)
 
-        mock_cursor.executemany.assert_called_once()
+        insert = mock_cursor.execute.call_args_list[0]
+        assert len(insert[0][1]) == 10
+        assert "WHERE NOT EXISTS" in insert[0][0]
+        mock_conn.commit.assert_called_once()
+        mock_conn.close.assert_not_called()
+        assert pool_metrics()["idle"] == 1
+
+    @patch('load.create_connection')
+    def test_load_executemany(self, mock_create_connection):
+        """Test that the executemany strategy sends one row per statement."""
+        mock_conn, mock_cursor = fake_connection()
+        mock_create_connection.return_value = mock_conn
+
+        load(pd.DataFrame({'plant_id': [1, 2],
+                           'recording_taken': pd.to_datetime(['2024-10-01', '2024-10-02']),
+                           'last_watered': pd.to_datetime(['2024-09-30', '2024-10-01']),
+                           'soil_moisture': [30.0, 45.0],
+                           'temperature': [22.5, 23.0]}), strategy="executemany")
+
+        assert len(mock_cursor.executemany.call_args[0][1]) == 2
+
+    @patch('load.create_connection')
+    def test_load_staging(self, mock_create_connection):
+        """Test that the staging strategy fills a temp table then inserts from it."""
+        mock_conn, mock_cursor = fake_connection()
+        mock_create_connection.return_value = mock_conn
+
+        load(pd.DataFrame({'plant_id': [1],
+                           'recording_taken': pd.to_datetime(['2024-10-01']),
+                           'last_watered': pd.to_datetime(['2024-09-30']),
+                           'soil_moisture': [30.0],
+                           'temperature': [22.5]}), strategy="staging")
+
+        statements = [call[0][0] for call in mock_cursor.execute.call_args_list]
+        assert "INTO #recording_staging" in statements[0]
+        assert "INSERT INTO #recording_staging" in statements[1]
+        assert "FROM #recording_staging" in statements[2]
+        mock_conn.commit.assert_called_once()
+
+
+    @patch('load.create_connection')
+    def test_load_skips_seen_recordings(self, mock_create_connection):
+        """Test that a retried run doesn't send already loaded readings to the database."""
+        mock_conn, mock_cursor = fake_connection()
+        mock_create_connection.return_value = mock_conn
+        mock_cursor.rowcount = 2
+
+        load(fake_recordings([1, 2], ['2024-10-01 12:00', '2024-10-01 12:00']))
+        load(fake_recordings([1, 2], ['2024-10-01 12:00', '2024-10-01 12:01']))
+
+        inserts = [call for call in mock_cursor.execute.call_args_list
+                   if "INSERT INTO alpha.recording" in call[0][0]]
+        assert len(inserts) == 2
+        assert inserts[1][0][1][0] == 2
+
+    @patch('load.create_connection')
+    def test_load_without_dedup(self, mock_create_connection):
+        """Test that dedup can be turned off for a plain insert."""
+        mock_conn, mock_cursor = fake_connection()
+        mock_create_connection.return_value = mock_conn
+
+        load(fake_recordings([1, 1], ['2024-10-01 12:00', '2024-10-01 12:00']), dedup=False)
+
+        statement, params = mock_cursor.execute.call_args_list[0][0]
+        assert "NOT EXISTS" not in statement
+        assert len(params) == 10
+
+
+    @patch('load.create_connection')
+    def test_load_updates_rollups(self, mock_create_connection):
+        """Test that the minute and hour rollups are recalculated for the hours loaded,
+        in the same transaction as the insert."""
+        mock_conn, mock_cursor = fake_connection()
+        mock_create_connection.return_value = mock_conn
+
+        load(fake_recordings([2, 1, 2], ['2024-10-01 12:05', '2024-10-01 12:59',
+                                         '2024-10-01 13:10']))
+
+        statements = [call[0] for call in mock_cursor.execute.call_args_list]
+        assert "MERGE alpha.recording_minute" in statements[1][0]
+        assert "DATEDIFF(MINUTE, 0, r.recording_taken)" in statements[1][0]
+        assert "MERGE alpha.recording_hour" in statements[2][0]
+        assert statements[2][1] == ((2, 1), pd.Timestamp('2024-10-01 12:00'),
+                                    pd.Timestamp('2024-10-01 14:00'))
         mock_conn.commit.assert_called_once()
-        mock_conn.close.assert_called_once()
+
+    @patch('load.create_connection')
+    def test_load_empty_without_dedup(self, mock_create_connection):
+        """Test that no rollups are recalculated when there are no recordings,
+        which would otherwise filter on an empty list of plants."""
+        mock_conn, mock_cursor = fake_connection()
+        mock_create_connection.return_value = mock_conn
+
+        load(fake_recordings([], []), dedup=False)
+
+        statements = [call[0][0] for call in mock_cursor.execute.call_args_list]
+        assert not any("MERGE" in statement for statement in statements)
+
+
+class TestDeduplication(TestCase):
+    """Tests for dropping already seen readings."""
+
+    def setUp(self):
+        HIGH_WATER_MARKS.clear()
+
+    def test_drop_seen_recordings_in_batch(self):
+        """Test that a reading repeated within one batch is only kept once."""
+        recordings = fake_recordings([1, 1, 2], ['2024-10-01 12:00', '2024-10-01 12:00',
+                                                 '2024-10-01 12:00'])
+
+        assert len(drop_seen_recordings(recordings)) == 2
+
+    def test_drop_seen_recordings_high_water_mark(self):
+        """Test that readings no newer than the plant's high-water mark are dropped."""
+        HIGH_WATER_MARKS[1] = pd.Timestamp('2024-10-01 12:00')
+        recordings = fake_recordings([1, 1, 2], ['2024-10-01 12:00', '2024-10-01 12:01',
+                                                 '2024-10-01 11:00'])
+
+        result = drop_seen_recordings(recordings)
+
+        assert result['recording_taken'].tolist() == [pd.Timestamp('2024-10-01 12:01'),
+                                                      pd.Timestamp('2024-10-01 11:00')]
+
+
+class TestBulkInsert(TestCase):
+    """Tests for the bulk insert helpers."""
+
+    def test_to_rows_missing_values(self):
+        """Test that missing values are sent as None rather than NaN or NaT."""
+        rows = to_rows(pd.DataFrame({'plant_id': [1],
+                                     'recording_taken': pd.to_datetime(['2024-10-01']),
+                                     'last_watered': pd.to_datetime([None]),
+                                     'soil_moisture': [float('nan')],
+                                     'temperature': [22.5]}))
+
+        assert rows == [(1, pd.Timestamp('2024-10-01'), None, None, 22.5)]
+        assert isinstance(rows[0][0], int)
+
+    def test_insert_multirow_batches(self):
+        """Test that the rows are split into batches of the given size."""
+        cursor = MagicMock()
+        rows = [(plant_id, None, None, 1.0, 2.0) for plant_id in range(5)]
+
+        insert_multirow(cursor, "alpha.recording", rows, batch_size=2)
+
+        assert cursor.execute.call_count == 3
+        assert cursor.execute.call_args_list[0][0][0].count("(%s, %s, %s, %s, %s)") == 2
+        assert cursor.execute.call_args_list[2][0][1] == (4, None, None, 1.0, 2.0)
+
+    @patch.dict('load.ENV', {'LOAD_STAGING_THRESHOLD': '1000'})
+    def test_choose_strategy(self):
+        """Test that large loads are staged and smaller ones use multi-row inserts."""
+        assert choose_strategy(50) == "multirow"
+        assert choose_strategy(1000) == "staging"
+
+
+class TestConnectionPool(TestCase):
+    """Tests for the connection pool."""
+
+    def setUp(self):
+        close_pool()
+        for metric in POOL["metrics"]:
+            POOL["metrics"][metric] = 0
+
+    @patch('load.create_connection')
+    def test_connection_reused(self, fake_create_connection):
+        """Test that a released connection is reused rather than reconnecting."""
+        fake_conn, _ = fake_connection()
+        fake_create_connection.return_value = fake_conn
+
+        with pooled_connection():
+            pass
+        with pooled_connection() as conn:
+            assert conn is fake_conn
+
+        fake_create_connection.assert_called_once()
+        assert pool_metrics()["reused"] == 1
+        assert pool_metrics()["in_use"] == 0
+
+    @patch.dict('load.ENV', {'DB_POOL_HEALTHCHECK_SECONDS': '0'})
+    @patch('load.create_connection')
+    def test_stale_connection_replaced(self, fake_create_connection):
+        """Test that a connection failing its health check is closed and replaced."""
+        stale_conn, stale_cursor = fake_connection()
+        fresh_conn, _ = fake_connection()
+        stale_cursor.execute.side_effect = pymssql.OperationalError
+        fake_create_connection.side_effect = [stale_conn, fresh_conn]
+
+        release_connection(get_connection())
+        conn = get_connection()
+
+        assert conn is fresh_conn
+        stale_conn.close.assert_called_once()
+        assert pool_metrics()["reconnected"] == 1
+
+    @patch.dict('load.ENV', {'DB_POOL_SIZE': '1'})
+    @patch('load.create_connection')
+    def test_pool_size_limit(self, fake_create_connection):
+        """Test that connections beyond the pool size are closed when released."""
+        fake_create_connection.side_effect = [fake_connection()[0], fake_connection()[0]]
+
+        first, second = get_connection(), get_connection()
+        release_connection(first)
+        release_connection(second)
+
+        second.close.assert_called_once()
+        assert pool_metrics()["idle"] == 1
+
+    @patch('load.create_connection')
+    def test_error_rolls_back(self, fake_create_connection):
+        """Test that an error inside the block rolls back before the connection is reused."""
+        fake_conn, _ = fake_connection()
+        fake_create_connection.return_value = fake_conn
+
+        with pytest.raises(ValueError):
+            with pooled_connection():
+                raise ValueError
+
+        fake_conn.rollback.assert_called_once()
+        assert pool_metrics()["idle"] == 1
+
+    @patch.dict('load.ENV', {'DB_POOL_SIZE': '2'})
+    @patch('load.create_connection')
+    def test_counters_consistent_across_threads(self, fake_create_connection):
+        """Test that the counters add up when many threads borrow from the pool at once."""
+        fake_create_connection.side_effect = lambda: fake_connection()[0]
+
+        def borrow(_):
+            with pooled_connection():
+                pass
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(borrow, range(400)))
+
+        metrics = pool_metrics()
+        assert metrics["in_use"] == 0
+        assert metrics["created"] + metrics["reused"] == 400
+        assert metrics["created"] - metrics["discarded"] == metrics["idle"]
@@ -0,0 +1,103 @@
+"""This file tests the functionality of the metadata script."""
+
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from load import close_pool
+from metadata import (get_all_metadata, get_plants_metadata, get_plant_metadata,
+                      invalidate_metadata)
+
+
+FAKE_METADATA = [{"plant_id": 1, "plant_name": "Aloe Vera", "scientific_name": "Aloe",
+                  "image_url": None, "botanist_name": "Dr. Green",
+                  "botanist_email": "green@example.com", "botanist_phone_no": "123",
+                  "city_name": "Split", "country_code": "HR",
+                  "latitude": 43.5, "longitude": 16.4},
+                 {"plant_id": 2, "plant_name": "Cactus", "scientific_name": "Cactaceae",
+                  "image_url": None, "botanist_name": "Dr. Brown",
+                  "botanist_email": "brown@example.com", "botanist_phone_no": "456",
+                  "city_name": "Reus", "country_code": "ES",
+                  "latitude": 41.2, "longitude": 1.1}]
+
+
+@patch.dict('metadata.ENV', {'SCHEMA_NAME': 'fake_schema', 'METADATA_TTL_SECONDS': '3600'})
+@patch('load.create_connection')
+class TestMetadataCache(TestCase):
+    """Tests for the metadata cache."""
+
+    def setUp(self):
+        close_pool()
+        invalidate_metadata()
+
+    @staticmethod
+    def fake_cursor(fake_create_connection) -> MagicMock:
+        """Returns the cursor of a fake connection returning the fake metadata."""
+        fake_conn = MagicMock()
+        fake_cursor = MagicMock()
+        fake_conn.cursor.return_value.__enter__.return_value = fake_cursor
+        fake_create_connection.return_value = fake_conn
+        fake_cursor.fetchall.return_value = FAKE_METADATA
+        return fake_cursor
+
+    def test_metadata_loaded_once(self, fake_create_connection):
+        """Tests that repeated lookups are served without querying again."""
+        fake_cursor = self.fake_cursor(fake_create_connection)
+
+        get_plant_metadata(1)
+        result = get_plants_metadata([1, 2])
+
+        fake_cursor.execute.assert_called_once()
+        self.assertEqual(result["plant_name"].tolist(), ["Aloe Vera", "Cactus"])
+
+    def test_get_plant_metadata(self, fake_create_connection):
+        """Tests that the details of a single plant are returned as a dict."""
+        self.fake_cursor(fake_create_connection)
+
+        result = get_plant_metadata(2)
+
+        self.assertEqual(result["botanist_email"], "brown@example.com")
+
+    def test_metadata_expires(self, fake_create_connection):
+        """Tests that the metadata is reloaded once the ttl has passed."""
+        fake_cursor = self.fake_cursor(fake_create_connection)
+
+        with patch.dict('metadata.ENV', {'METADATA_TTL_SECONDS': '0'}):
+            get_all_metadata()
+            get_all_metadata()
+
+        self.assertEqual(fake_cursor.execute.call_count, 2)
+
+    def test_metadata_invalidated(self, fake_create_connection):
+        """Tests that the metadata is reloaded after being invalidated."""
+        fake_cursor = self.fake_cursor(fake_create_connection)
+
+        get_all_metadata()
+        invalidate_metadata()
+        get_all_metadata()
+
+        self.assertEqual(fake_cursor.execute.call_count, 2)
+
+    def test_unknown_plant_reloads(self, fake_create_connection):
+        """Tests that looking up a plant missing from the cache reloads it once."""
+        fake_cursor = self.fake_cursor(fake_create_connection)
+
+        result = get_plant_metadata(3)
+
+        self.assertIsNone(result)
+        self.assertEqual(fake_cursor.execute.call_count, 2)
+
+    def test_missing_plant_not_reloaded_again(self, fake_create_connection):
+        """Tests that a plant still missing after a reload doesn't reload the cache
+        on every lookup, until the cache expires."""
+        fake_cursor = self.fake_cursor(fake_create_connection)
+
+        get_plant_metadata(3)
+        get_plants_metadata([1, 3])
+        get_plant_metadata(3)
+
+        self.assertEqual(fake_cursor.execute.call_count, 2)
+
+        with patch.dict('metadata.ENV', {'METADATA_TTL_SECONDS': '0'}):
+            get_plant_metadata(3)
+
+        self.assertGreater(fake_cursor.execute.call_count, 2)
@@ -0,0 +1,118 @@
+"""This file tests the functionality of the metrics script."""
+
+import json
+from unittest import TestCase
+from unittest.mock import patch
+
+import pytest
+
+from metrics import (METRICS, MAX_EMF_VALUES, reset_metrics, timed_stage, increment,
+                     record_fetch_latency, latency_histogram, latency_values,
+                     summarise_metrics, emf_record, emit_metrics)
+
+
+class TestMetrics(TestCase):
+    """Tests for collecting the metrics of a run."""
+
+    def setUp(self):
+        reset_metrics()
+
+    def test_timed_stage_adds_up(self):
+        """Tests that each time a stage runs its milliseconds are added together."""
+        with patch("metrics.perf_counter", side_effect=[1.0, 1.5, 2.0, 2.25]):
+            with timed_stage("Extract"):
+                pass
+            with timed_stage("Extract"):
+                pass
+
+        assert METRICS["stages"] == {"Extract": 750.0}
+
+    def test_timed_stage_records_failures(self):
+        """Tests that a stage is still timed if it raises."""
+        with pytest.raises(ValueError):
+            with timed_stage("Load"):
+                raise ValueError("Failed")
+
+        assert "Load" in METRICS["stages"]
+
+    def test_increment(self):
+        """Tests that counters start at zero and add up."""
+        increment("HttpRequests")
+        increment("HttpRequests", 4)
+
+        assert METRICS["counters"] == {"HttpRequests": 5}
+
+    def test_reset_metrics(self):
+        """Tests that a reset forgets everything from the previous run."""
+        increment("EmailsSent")
+        record_fetch_latency(0.1)
+
+        reset_metrics()
+
+        assert summarise_metrics()["counters"] == {}
+        assert summarise_metrics()["fetch_latency_ms"]["count"] == 0
+
+    def test_latency_histogram(self):
+        """Tests that each bucket counts the latencies at or below it."""
+        histogram = latency_histogram([10, 25, 60, 20_000])
+
+        assert histogram["le_25"] == 2
+        assert histogram["le_100"] == 3
+        assert histogram["le_10000"] == 3
+        assert histogram["le_inf"] == 4
+
+    def test_summary_percentiles(self):
+        """Tests that the summary has the p50, p99 and max fetch latency in milliseconds."""
+        for seconds in (0.01, 0.02, 0.03):
+            record_fetch_latency(seconds)
+
+        latency = summarise_metrics()["fetch_latency_ms"]
+
+        assert latency["count"] == 3
+        assert latency["p50"] == 20.0
+        assert latency["max"] == 30.0
+
+    def test_latency_values_capped(self):
+        """Tests that large runs send at most MAX_EMF_VALUES latencies, from lowest to highest."""
+        values = latency_values(list(range(1000)))
+
+        assert len(values) == MAX_EMF_VALUES
+        assert values[0] == 0
+        assert values[-1] == 999
+
+
+class TestEmfRecord(TestCase):
+    """Tests for the embedded metric format record."""
+
+    def setUp(self):
+        reset_metrics()
+
+    def test_emf_record(self):
+        """Tests that every stage and counter is declared as a metric with its unit."""
+        METRICS["stages"]["Extract"] = 120.0
+        increment("RowsInserted", 50)
+        record_fetch_latency(0.05)
+
+        record = emf_record({"Shard": "0/1"})
+        declared = record["_aws"]["CloudWatchMetrics"][0]
+
+        assert declared["Dimensions"] == [["Shard"]]
+        assert {"Name": "ExtractTime", "Unit": "Milliseconds"} in declared["Metrics"]
+        assert {"Name": "RowsInserted", "Unit": "Count"} in declared["Metrics"]
+        assert {"Name": "FetchLatency", "Unit": "Milliseconds"} in declared["Metrics"]
+        assert record["Shard"] == "0/1"
+        assert record["ExtractTime"] == 120.0
+        assert record["RowsInserted"] == 50
+        assert record["FetchLatency"] == [50.0]
+
+    def test_emit_metrics_prints_json(self):
+        """Tests that the record is printed as a single line of JSON."""
+        increment("EmailsSent", 2)
+
+        with patch("builtins.print") as fake_print:
+            summary = emit_metrics({"Shard": "0/1"})
+
+        line = fake_print.call_args.args[0]
+        assert "\n" not in line
+        assert json.loads(line)["EmailsSent"] == 2
+        assert summary["counters"] == {"EmailsSent": 2}
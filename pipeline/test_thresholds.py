@@ -0,0 +1,89 @@
+"""This file tests the functionality of the thresholds script."""
+
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+import pandas as pd
+
+from load import close_pool
+from thresholds import evaluate_thresholds, load_threshold_overrides, ALERT_COLUMNS
+
+
+class TestEvaluateThresholds(TestCase):
+    """Tests for the evaluate thresholds function."""
+
+    def setUp(self):
+        self.recordings = pd.DataFrame({"plant_id": [1, 2, 3, 4],
+                                        "soil_moisture": [95.0, 25.0, 50.0, 90.0],
+                                        "temperature": [55.0, 5.0, 20.0, 50.0]})
+
+    def test_evaluate_thresholds_defaults(self):
+        """Tests that every default rule is checked, including the boundaries."""
+        alerts = evaluate_thresholds(self.recordings)
+
+        expected = pd.DataFrame({"plant_id": [1, 2, 1, 4, 2],
+                                 "metric": ["temperature", "temperature", "soil moisture",
+                                            "soil moisture", "soil moisture"],
+                                 "value": [55.0, 5.0, 95.0, 90.0, 25.0],
+                                 "direction": ["exceeded", "not met", "exceeded",
+                                               "exceeded", "not met"]})
+
+        pd.testing.assert_frame_equal(alerts, expected)
+
+    def test_evaluate_thresholds_no_alerts(self):
+        """Tests that an empty table with the alert columns is returned
+        when every plant is in range."""
+        alerts = evaluate_thresholds(self.recordings[self.recordings["plant_id"] == 3])
+
+        assert alerts.empty
+        assert list(alerts.columns) == ALERT_COLUMNS
+
+    def test_evaluate_thresholds_with_overrides(self):
+        """Tests that a per-plant threshold replaces the default for that plant only."""
+        overrides = pd.DataFrame({"plant_id": [3], "metric": ["temperature"],
+                                  "direction": ["exceeded"], "threshold": [15.0]})
+
+        alerts = evaluate_thresholds(self.recordings, overrides)
+        temperature_alerts = alerts[(alerts["metric"] == "temperature")
+                                    & (alerts["direction"] == "exceeded")]
+
+        assert temperature_alerts["plant_id"].tolist() == [1, 3]
+
+
+class TestLoadThresholdOverrides(TestCase):
+    """Tests for the load threshold overrides function."""
+
+    @patch.dict('thresholds.ENV', {}, clear=True)
+    def test_load_threshold_overrides_none(self):
+        """Tests that no overrides are returned without any configuration."""
+        assert load_threshold_overrides().empty
+
+    def test_load_threshold_overrides_from_file(self):
+        """Tests that the overrides are read from the json config file."""
+        config = [{"plant_id": 1, "metric": "temperature",
+                   "direction": "exceeded", "threshold": 30.0}]
+
+        with patch('builtins.open', MagicMock()), \
+                patch('thresholds.json.load', return_value=config), \
+                patch.dict('thresholds.ENV', {'THRESHOLDS_FILE': 'thresholds.json'}):
+            overrides = load_threshold_overrides()
+
+        assert overrides.to_dict("records") == config
+
+    @patch('load.create_connection')
+    @patch.dict('thresholds.ENV', {'THRESHOLDS_FROM_DB': 'true'}, clear=True)
+    def test_load_threshold_overrides_from_db(self, fake_create_connection):
+        """Tests that the overrides are read from the database in one query."""
+        close_pool()
+        fake_conn = MagicMock()
+        fake_cursor = MagicMock()
+        fake_conn.cursor.return_value.__enter__.return_value = fake_cursor
+        fake_create_connection.return_value = fake_conn
+        fake_cursor.fetchall.return_value = [{"plant_id": 1, "metric": "temperature",
+                                              "direction": "exceeded", "threshold": 30.0}]
+
+        overrides = load_threshold_overrides()
+
+        fake_cursor.execute.assert_called_once()
+        fake_conn.close.assert_not_called()
+        assert overrides["threshold"].tolist() == [30.0]
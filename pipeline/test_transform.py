@@ -5,7 +5,7 @@ from unittest import TestCase
 import pandas as pd
 import pytest
 
-from transform import transform, clean, check_conditions
+from transform import transform, clean, check_conditions, parse_last_watered
 
 
 class TestTransformFunction(TestCase):
@@ -25,14 +25,14 @@ class TestTransformFunction(TestCase):
         result_df = transform(input_data)
 
         expected_df = pd.DataFrame({"plant_id": [1, 2],
-                                    "recording_taken": ["2024-10-01 12:34:56",
-                                                        "2024-10-02 14:20:30"],
-                                    "last_watered": ["2024-09-30 10:00:00",
-                                                     "2024-10-01 11:00:00"],
+                                    "recording_taken": pd.to_datetime(["2024-10-01 12:34:56",
+                                                                       "2024-10-02 14:20:30"]),
+                                    "last_watered": pd.to_datetime(["2024-09-30 10:00:00",
+                                                                    "2024-10-01 11:00:00"]),
                                     "soil_moisture": [30.0, 45.0],
                                     "temperature": [22.5, 23.0]})
 
-        pd.testing.assert_frame_equal(result_df, expected_df)
+        pd.testing.assert_frame_equal(result_df, expected_df, check_dtype=False)
 
     def test_clean_with_valid_data(self):
         """Tests that transform returns a correct dataframe given the provided
@@ -48,14 +48,14 @@ class TestTransformFunction(TestCase):
         result_df = clean(input_data)
 
         expected_df = pd.DataFrame({"plant_id": [1, 2],
-                                    "recording_taken": ["2024-10-01 12:34:56",
-                                                        "2024-10-02 14:20:30"],
-                                    "last_watered": ["2024-09-30 10:00:00",
-                                                     "2024-10-01 11:00:00"],
+                                    "recording_taken": pd.to_datetime(["2024-10-01 12:34:56",
+                                                                       "2024-10-02 14:20:30"]),
+                                    "last_watered": pd.to_datetime(["2024-09-30 10:00:00",
+                                                                    "2024-10-01 11:00:00"]),
                                     "soil_moisture": [30.0, 45.0],
                                     "temperature": [22.5, 23.0]})
 
-        pd.testing.assert_frame_equal(result_df, expected_df)
+        pd.testing.assert_frame_equal(result_df, expected_df, check_dtype=False)
 
     def test_transform_with_invalid_data(self):
         """Tests that an error is raised when the last watered value is
@@ -81,9 +81,43 @@ class TestTransformFunction(TestCase):
         with pytest.raises(ValueError):
             clean(input_data)
 
-    @patch('transform.send_email')
-    def test_check_conditions_temperature_exceeded(self, fake_send_email):
-        """Tests that an email is sent when the temperature exceeds 50."""
+    def test_clean_with_invalid_recording_taken(self):
+        """Tests that an error is raised when the recording taken value is
+        not a valid date"""
+        input_data = pd.DataFrame({"plant_id": [1],
+                                   "recording_taken": ["yesterday"],
+                                   "last_watered": ["Mon, 30 Sep 2024 10:00:00 GMT"],
+                                   "soil_moisture": [30.0],
+                                   "temperature": [22.5]})
+
+        with pytest.raises(ValueError):
+            clean(input_data)
+
+    def test_clean_returns_native_datetimes(self):
+        """Tests that clean returns naive datetime64 columns converted to UTC."""
+        input_data = pd.DataFrame({"plant_id": [1],
+                                   "recording_taken": ["2024-10-01 12:34:56"],
+                                   "last_watered": ["Mon, 30 Sep 2024 10:00:00 GMT"],
+                                   "soil_moisture": [30.0],
+                                   "temperature": [22.5]})
+
+        result_df = clean(input_data)
+
+        assert pd.api.types.is_datetime64_dtype(result_df["recording_taken"])
+        assert pd.api.types.is_datetime64_dtype(result_df["last_watered"])
+        assert result_df["last_watered"].dt.tz is None
+
+    def test_parse_last_watered_non_fixed_width(self):
+        """Tests that dates the fast path can't slice are still parsed."""
+        result = parse_last_watered(pd.Series(["Tue, 1 Oct 2024 11:00:00 GMT",
+                                               "Mon, 30 Sep 2024 10:00:00 UTC"]))
+
+        assert result.tolist() == [pd.Timestamp("2024-10-01 11:00:00"),
+                                   pd.Timestamp("2024-09-30 10:00:00")]
+
+    @patch('transform.dispatch_alerts')
+    def test_check_conditions_temperature_exceeded(self, fake_dispatch_alerts):
+        """Tests that an alert is dispatched when the temperature exceeds 50."""
         input_data = pd.DataFrame({"plant_id": [1],
                                    "recording_taken": ["2024-10-01 12:34:56"],
                                    "last_watered": ["Mon, 30 Sep 2024 10:00:00 GMT"],
@@ -92,12 +126,13 @@ class TestTransformFunction(TestCase):
 
         check_conditions(input_data)
 
-        # Check if send_email is called for high temperature
-        fake_send_email.assert_called_with(1, 55.0, 'temperature', 'exceeded')
+        # Check if an alert is dispatched for high temperature
+        alerts = fake_dispatch_alerts.call_args[0][0]
+        assert alerts.values.tolist() == [[1, 'temperature', 55.0, 'exceeded']]
 
-    @patch('transform.send_email')
-    def test_check_conditions_temperature_not_met(self, fake_send_email):
-        """Tests that an email is sent when the temperature is below or equal to 5."""
+    @patch('transform.dispatch_alerts')
+    def test_check_conditions_temperature_not_met(self, fake_dispatch_alerts):
+        """Tests that an alert is dispatched when the temperature is below or equal to 5."""
         input_data = pd.DataFrame({"plant_id": [2],
                                    "recording_taken": ["2024-10-02 14:20:30"],
                                    "last_watered": ["Tue, 01 Oct 2024 11:00:00 GMT"],
@@ -106,12 +141,13 @@ class TestTransformFunction(TestCase):
 
         check_conditions(input_data)
 
-        # Check if send_email is called for low temperature
-        fake_send_email.assert_called_with(2, 3.0, 'temperature', 'not met')
+        # Check if an alert is dispatched for low temperature
+        alerts = fake_dispatch_alerts.call_args[0][0]
+        assert alerts.values.tolist() == [[2, 'temperature', 3.0, 'not met']]
 
-    @patch('transform.send_email')
-    def test_check_conditions_soil_moisture_exceeded(self, fake_send_email):
-        """Tests that an email is sent when the soil moisture exceeds 90."""
+    @patch('transform.dispatch_alerts')
+    def test_check_conditions_soil_moisture_exceeded(self, fake_dispatch_alerts):
+        """Tests that an alert is dispatched when the soil moisture exceeds 90."""
         input_data = pd.DataFrame({"plant_id": [1],
                                    "recording_taken": ["2024-10-01 12:34:56"],
                                    "last_watered": ["Mon, 30 Sep 2024 10:00:00 GMT"],
@@ -120,13 +156,13 @@ class TestTransformFunction(TestCase):
 
         check_conditions(input_data)
 
-        # Check if send_email is called for high soil moisture
-        fake_send_email.assert_called_with(
-            1, 95.0, 'soil moisture', 'exceeded')
+        # Check if an alert is dispatched for high soil moisture
+        alerts = fake_dispatch_alerts.call_args[0][0]
+        assert alerts.values.tolist() == [[1, 'soil moisture', 95.0, 'exceeded']]
 
-    @patch('transform.send_email')
-    def test_check_conditions_soil_moisture_not_met(self, fake_send_email):
-        """Tests that an email is sent when the soil moisture is below 30."""
+    @patch('transform.dispatch_alerts')
+    def test_check_conditions_soil_moisture_not_met(self, fake_dispatch_alerts):
+        """Tests that an alert is dispatched when the soil moisture is below 30."""
         input_data = pd.DataFrame({"plant_id": [2],
                                    "recording_taken": ["2024-10-02 14:20:30"],
                                    "last_watered": ["Tue, 01 Oct 2024 11:00:00 GMT"],
@@ -135,5 +171,20 @@ class TestTransformFunction(TestCase):
 
         check_conditions(input_data)
 
-        # Check if send_email is called for low soil moisture
-        fake_send_email.assert_called_with(2, 25.0, 'soil moisture', 'not met')
+        # Check if an alert is dispatched for low soil moisture
+        alerts = fake_dispatch_alerts.call_args[0][0]
+        assert alerts.values.tolist() == [[2, 'soil moisture', 25.0, 'not met']]
+
+    @patch('transform.dispatch_alerts')
+    def test_check_conditions_in_range(self, fake_dispatch_alerts):
+        """Tests that nothing is dispatched when every reading is in range."""
+        input_data = pd.DataFrame({"plant_id": [2],
+                                   "recording_taken": ["2024-10-02 14:20:30"],
+                                   "last_watered": ["Tue, 01 Oct 2024 11:00:00 GMT"],
+                                   "soil_moisture": [50.0],
+                                   "temperature": [22.0]})
+
+        alerts = check_conditions(input_data)
+
+        assert alerts.empty
+        fake_dispatch_alerts.assert_not_called()
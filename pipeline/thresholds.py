@@ -0,0 +1,81 @@
+"""This script checks the recordings against the acceptable range for each plant."""
+
+import json
+import operator
+from os import environ as ENV
+
+import pandas as pd
+
+from load import pooled_connection
+
+
+# The default acceptable ranges, which individual plants can override.
+DEFAULT_THRESHOLDS = pd.DataFrame([
+    {"metric": "temperature", "direction": "exceeded", "comparison": "gt", "threshold": 50.0},
+    {"metric": "temperature", "direction": "not met", "comparison": "le", "threshold": 5.0},
+    {"metric": "soil moisture", "direction": "exceeded", "comparison": "ge", "threshold": 90.0},
+    {"metric": "soil moisture", "direction": "not met", "comparison": "lt", "threshold": 30.0}
+])
+METRIC_COLUMNS = {"temperature": "temperature", "soil moisture": "soil_moisture"}
+COMPARISONS = {"gt": operator.gt, "ge": operator.ge, "lt": operator.lt, "le": operator.le}
+OVERRIDE_COLUMNS = ["plant_id", "metric", "direction", "threshold"]
+ALERT_COLUMNS = ["plant_id", "metric", "value", "direction"]
+
+
+def load_threshold_overrides() -> pd.DataFrame:
+    """Returns the per-plant thresholds, read from the json file at THRESHOLDS_FILE
+    or, if THRESHOLDS_FROM_DB is 'true', from the plant_threshold table."""
+    if ENV.get("THRESHOLDS_FILE"):
+        with open(ENV["THRESHOLDS_FILE"], encoding="utf-8") as file:
+            return pd.DataFrame(json.load(file), columns=OVERRIDE_COLUMNS)
+
+    if ENV.get("THRESHOLDS_FROM_DB", "").lower() == "true":
+        return fetch_threshold_overrides()
+
+    return pd.DataFrame(columns=OVERRIDE_COLUMNS)
+
+
+def fetch_threshold_overrides() -> pd.DataFrame:
+    """Returns every per-plant threshold stored in the database."""
+    query = "SELECT plant_id, metric, direction, threshold FROM alpha.plant_threshold"
+
+    with pooled_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(query)
+            data = cursor.fetchall()
+
+    return pd.DataFrame(data, columns=OVERRIDE_COLUMNS)
+
+
+def get_thresholds(recordings: pd.DataFrame, metric: str, direction: str,
+                   default: float, overrides: pd.DataFrame) -> pd.Series:
+    """Returns the threshold that applies to each recording for one rule."""
+    if overrides is None or overrides.empty:
+        return pd.Series(default, index=recordings.index)
+
+    rule_overrides = overrides[(overrides["metric"] == metric)
+                               & (overrides["direction"] == direction)]
+    plant_thresholds = rule_overrides.drop_duplicates(
+        "plant_id", keep="last").set_index("plant_id")["threshold"]
+
+    return recordings["plant_id"].map(plant_thresholds).fillna(default).astype(float)
+
+
+def evaluate_thresholds(recordings: pd.DataFrame,
+                        overrides: pd.DataFrame = None) -> pd.DataFrame:
+    """Returns a table of every breached threshold, with one row per plant, metric
+    and direction. Each rule is evaluated as a mask over the whole column."""
+    alerts = []
+
+    for rule in DEFAULT_THRESHOLDS.itertuples(index=False):
+        values = recordings[METRIC_COLUMNS[rule.metric]]
+        thresholds = get_thresholds(recordings, rule.metric, rule.direction,
+                                    rule.threshold, overrides)
+        breached = COMPARISONS[rule.comparison](values, thresholds)
+
+        alerts.append(pd.DataFrame({"plant_id": recordings.loc[breached, "plant_id"],
+                                    "metric": rule.metric,
+                                    "value": values[breached],
+                                    "direction": rule.direction}))
+
+    return pd.concat(alerts, ignore_index=True)[ALERT_COLUMNS]
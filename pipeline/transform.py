@@ -1,54 +1,64 @@
 """This script transforms the data to be loaded into a database"""
 
-from datetime import datetime
-
 import pandas as pd
 
 from extract import extract
-from emailing import send_email
+from emailing import dispatch_alerts
+from metrics import timed_stage
+from thresholds import evaluate_thresholds, load_threshold_overrides
 
 
-def clean(needs_a_clean: pd.DataFrame) -> pd.DataFrame:
-    """This function returns a clean dataframe ready for insertion. """
-    needs_a_clean["recording_taken"] = pd.to_datetime(
-        needs_a_clean["recording_taken"], format="%Y-%m-%d %H:%M:%S", errors='coerce')
+RECORDING_TAKEN_FORMAT = "%Y-%m-%d %H:%M:%S"
+LAST_WATERED_FORMAT = "%a, %d %b %Y %H:%M:%S %Z"
+MONTHS = {"Jan": "01", "Feb": "02", "Mar": "03", "Apr": "04", "May": "05", "Jun": "06",
+          "Jul": "07", "Aug": "08", "Sep": "09", "Oct": "10", "Nov": "11", "Dec": "12"}
 
-    needs_a_clean['last_watered'] = needs_a_clean['last_watered'].apply(
-        lambda row: datetime.strptime(row, "%a, %d %b %Y %H:%M:%S %Z"))
 
-    needs_a_clean['last_watered'] = needs_a_clean['last_watered'].apply(
-        lambda row: row.strftime("%Y-%m-%d %H:%M:%S"))
+def parse_last_watered(last_watered: pd.Series) -> pd.Series:
+    """Returns the last watered strings (e.g. 'Mon, 30 Sep 2024 10:00:00 GMT')
+    as naive UTC datetimes.
+    Parsing day and month names is slow in pandas, so when every value is a fixed-width
+    GMT date the fields are sliced into ISO order and parsed in one call instead."""
+    months = last_watered.str.slice(8, 11).map(MONTHS)
 
-    needs_a_clean['recording_taken'] = needs_a_clean['recording_taken'].apply(
-        lambda row: row.strftime("%Y-%m-%d %H:%M:%S"))
+    if months.isna().any() or not last_watered.str.endswith(" GMT").all():
+        return pd.to_datetime(last_watered, format=LAST_WATERED_FORMAT,
+                              utc=True).dt.tz_localize(None)
+
+    iso_dates = (last_watered.str.slice(12, 16) + "-" + months + "-"
+                 + last_watered.str.slice(5, 7) + " " + last_watered.str.slice(17, 25))
+    return pd.to_datetime(iso_dates, format=RECORDING_TAKEN_FORMAT)
 
-    return needs_a_clean
 
+def clean(needs_a_clean: pd.DataFrame) -> pd.DataFrame:
+    """This function returns a clean dataframe ready for insertion.
+    Both timestamps are parsed with vectorised calls into naive UTC datetime64
+    columns, which are passed straight to load. Raises a ValueError on invalid dates."""
+    needs_a_clean["recording_taken"] = pd.to_datetime(
+        needs_a_clean["recording_taken"], format=RECORDING_TAKEN_FORMAT)
+
+    needs_a_clean["last_watered"] = parse_last_watered(needs_a_clean["last_watered"])
+
+    return needs_a_clean
 
-def check_conditions(clean: pd.DataFrame):
-    for index, row in clean.iterrows():
-        if row['temperature'] > 50:
-            send_email(row['plant_id'], row['temperature'],
-                       'temperature', 'exceeded')
 
-        if row['temperature'] <= 5:
-            send_email(row['plant_id'], row['temperature'],
-                       'temperature', 'not met')
+def check_conditions(clean: pd.DataFrame, overrides: pd.DataFrame = None) -> pd.DataFrame:
+    """Emails the botanists a digest of the recordings outside their acceptable range,
+    and returns the table of alerts."""
+    alerts = evaluate_thresholds(clean, overrides)
 
-        if row['soil_moisture'] >= 90:
-            send_email(row['plant_id'], row['soil_moisture'],
-                       'soil moisture', 'exceeded')
+    if not alerts.empty:
+        with timed_stage("Alerts"):
+            dispatch_alerts(alerts)
 
-        if row['soil_moisture'] < 30:
-            send_email(row['plant_id'], row['soil_moisture'],
-                       'soil moisture', 'not met')
+    return alerts
 
 
 def transform(needs_a_clean: pd.DataFrame) -> pd.DataFrame:
     """This function returns a clean dataframe ready for insertion. """
 
     fresh_and_clean = clean(needs_a_clean)
-    check_conditions(fresh_and_clean)
+    check_conditions(fresh_and_clean, load_threshold_overrides())
 
     return fresh_and_clean
 
@@ -0,0 +1,5 @@
+# Runs benchmark_indexes.sql against the database, saving the plans and timings
+# it prints to benchmark_indexes.txt.
+REPO_ROOT="$(git rev-parse --show-toplevel)"
+source "$REPO_ROOT/pipeline/.env"
+sqlcmd -S $DB_HOST,$DB_PORT -U $DB_USER -P $DB_PASSWORD -d $DB_NAME -i 'benchmark_indexes.sql' -o 'benchmark_indexes.txt' -C
@@ -0,0 +1,184 @@
+-- Compares the original layout of alpha.recording (a clustered IDENTITY key only)
+-- with the layout in schema.sql on a synthetic month of recordings
+-- (50 plants, one reading a minute: 2,160,000 rows).
+-- Each hot query is run once to warm the cache, then again with its plan
+-- (STATISTICS PROFILE), reads (STATISTICS IO) and timings (STATISTICS TIME).
+-- The deletes are rolled back, so both layouts are timed on the same data.
+-- Run with `bash benchmark.sh`. Everything is created in, and then dropped with,
+-- a scratch `benchmark` schema and its own copy of the daily partition scheme.
+SET NOCOUNT ON;
+
+IF SCHEMA_ID('benchmark') IS NULL EXEC('CREATE SCHEMA benchmark');
+
+DROP TABLE IF EXISTS benchmark.recording_original;
+DROP TABLE IF EXISTS benchmark.recording_designed;
+IF EXISTS (SELECT 1 FROM sys.partition_schemes WHERE name = 'ps_benchmark_recording_day')
+    DROP PARTITION SCHEME ps_benchmark_recording_day;
+IF EXISTS (SELECT 1 FROM sys.partition_functions WHERE name = 'pf_benchmark_recording_day')
+    DROP PARTITION FUNCTION pf_benchmark_recording_day;
+
+DECLARE @month_start DATETIME2 = '2024-10-01';
+DECLARE @month_end DATETIME2 = DATEADD(DAY, 30, @month_start);
+-- The daily transfer moves the oldest day.
+DECLARE @cutoff DATETIME2 = DATEADD(DAY, 1, @month_start);
+
+CREATE TABLE benchmark.recording_original (
+    recording_id BIGINT IDENTITY(1,1),
+    plant_id SMALLINT NOT NULL,
+    recording_taken DATETIME2 NOT NULL,
+    last_watered DATETIME2,
+    soil_moisture FLOAT,
+    temperature FLOAT,
+    PRIMARY KEY (recording_id)
+);
+
+-- A copy of ps_recording_day from schema.sql, split into a partition for each day
+-- of the synthetic month as the daily transfer would have. The real function only
+-- has boundaries around today, and splitting it would change alpha.recording.
+CREATE PARTITION FUNCTION pf_benchmark_recording_day (DATETIME2) AS RANGE RIGHT FOR VALUES ();
+CREATE PARTITION SCHEME ps_benchmark_recording_day
+    AS PARTITION pf_benchmark_recording_day ALL TO ([PRIMARY]);
+
+DECLARE @boundary DATETIME2 = @month_start;
+WHILE @boundary <= @month_end
+BEGIN
+    ALTER PARTITION SCHEME ps_benchmark_recording_day NEXT USED [PRIMARY];
+    ALTER PARTITION FUNCTION pf_benchmark_recording_day() SPLIT RANGE (@boundary);
+    SET @boundary = DATEADD(DAY, 1, @boundary);
+END;
+
+-- The same table and indexes as alpha.recording in schema.sql.
+CREATE TABLE benchmark.recording_designed (
+    recording_id BIGINT IDENTITY(1,1),
+    plant_id SMALLINT NOT NULL,
+    recording_taken DATETIME2 NOT NULL,
+    last_watered DATETIME2,
+    soil_moisture FLOAT,
+    temperature FLOAT,
+    PRIMARY KEY NONCLUSTERED (recording_id, recording_taken)
+        ON ps_benchmark_recording_day (recording_taken)
+) ON ps_benchmark_recording_day (recording_taken);
+
+CREATE UNIQUE CLUSTERED INDEX uq_recording_plant_taken
+    ON benchmark.recording_designed (plant_id, recording_taken)
+    ON ps_benchmark_recording_day (recording_taken);
+CREATE INDEX ix_recording_taken ON benchmark.recording_designed (recording_taken)
+    INCLUDE (recording_id, last_watered, soil_moisture, temperature)
+    ON ps_benchmark_recording_day (recording_taken);
+
+-- The readings arrive a minute at a time, all plants together, as the ingest loads them.
+WITH numbers AS (
+    SELECT TOP (43200) ROW_NUMBER() OVER (ORDER BY (SELECT NULL)) - 1 AS n
+    FROM sys.all_objects AS a CROSS JOIN sys.all_objects AS b
+)
+SELECT p.n + 1 AS plant_id,
+       DATEADD(MINUTE, m.n, @month_start) AS recording_taken,
+       DATEADD(HOUR, -(m.n % 24), DATEADD(MINUTE, m.n, @month_start)) AS last_watered,
+       20 + (m.n + p.n) % 60 AS soil_moisture,
+       15 + ((m.n * 7 + p.n) % 150) / 10.0 AS temperature
+INTO #synthetic
+FROM numbers AS m CROSS JOIN (SELECT n FROM numbers WHERE n < 50) AS p;
+
+INSERT INTO benchmark.recording_original (plant_id, recording_taken, last_watered,
+                                          soil_moisture, temperature)
+SELECT plant_id, recording_taken, last_watered, soil_moisture, temperature
+FROM #synthetic ORDER BY recording_taken, plant_id;
+
+INSERT INTO benchmark.recording_designed (plant_id, recording_taken, last_watered,
+                                          soil_moisture, temperature)
+SELECT plant_id, recording_taken, last_watered, soil_moisture, temperature
+FROM #synthetic ORDER BY recording_taken, plant_id;
+
+DROP TABLE #synthetic;
+
+-- The hot queries, with {table} standing for the table being measured.
+-- Results are assigned to variables so the rows aren't printed.
+DECLARE @queries TABLE (position INT, label VARCHAR(100), query NVARCHAR(MAX));
+INSERT INTO @queries VALUES
+(1, 'Dashboard: 5 plants over the last 24 hours, in time order', N'
+    DECLARE @plant SMALLINT, @taken DATETIME2, @temperature FLOAT, @moisture FLOAT;
+    SELECT @plant = plant_id, @taken = recording_taken,
+           @temperature = temperature, @moisture = soil_moisture
+    FROM {table}
+    WHERE plant_id IN (1, 2, 3, 4, 5) AND recording_taken >= DATEADD(DAY, -1, @month_end)
+    ORDER BY recording_taken;'),
+(2, 'Ingest rollups: every plant for the last hour', N'
+    DECLARE @plant SMALLINT, @bucket DATETIME2, @count INT, @average FLOAT;
+    SELECT @plant = plant_id, @bucket = DATEADD(HOUR, DATEDIFF(HOUR, 0, recording_taken), 0),
+           @count = COUNT(*), @average = AVG(temperature)
+    FROM {table}
+    WHERE plant_id BETWEEN 1 AND 50 AND recording_taken >= DATEADD(HOUR, -1, @month_end)
+    GROUP BY plant_id, DATEADD(HOUR, DATEDIFF(HOUR, 0, recording_taken), 0);'),
+(3, 'Transfer checkpoint: recording ids before the cutoff', N'
+    SELECT MIN(recording_id) AS first_recording_id, MAX(recording_id) AS last_recording_id
+    FROM {table}
+    WHERE recording_taken < @cutoff;'),
+(4, 'Transfer extract: the oldest day in archive order', N'
+    DECLARE @id BIGINT, @plant SMALLINT, @taken DATETIME2, @watered DATETIME2,
+            @moisture FLOAT, @temperature FLOAT;
+    SELECT @id = recording_id, @plant = plant_id, @taken = recording_taken,
+           @watered = last_watered, @moisture = soil_moisture, @temperature = temperature
+    FROM {table}
+    WHERE recording_taken < @cutoff
+    ORDER BY CAST(recording_taken AS DATE), plant_id, recording_taken;'),
+(5, 'Retention: one batch of DELETE TOP (5000) by age', N'
+    BEGIN TRANSACTION;
+    DELETE TOP (5000) FROM {table} WHERE recording_taken < @cutoff;
+    ROLLBACK;'),
+(6, 'Transfer delete: one window of 5000 archived recording ids', N'
+    BEGIN TRANSACTION;
+    DELETE FROM {table} WHERE recording_id BETWEEN 1 AND 5000 AND recording_taken < @cutoff;
+    ROLLBACK;');
+
+DECLARE @table SYSNAME, @position INT, @label VARCHAR(100), @query NVARCHAR(MAX);
+DECLARE @started DATETIME2;
+DECLARE @timings TABLE (layout SYSNAME, position INT, label VARCHAR(100), milliseconds INT);
+
+DECLARE runs CURSOR LOCAL FAST_FORWARD FOR
+    SELECT t.name, q.position, q.label, REPLACE(q.query, '{table}', 'benchmark.' + t.name)
+    FROM (VALUES ('recording_original'), ('recording_designed')) AS t (name)
+    CROSS JOIN @queries AS q
+    ORDER BY q.position, t.name DESC;
+
+OPEN runs;
+FETCH NEXT FROM runs INTO @table, @position, @label, @query;
+WHILE @@FETCH_STATUS = 0
+BEGIN
+    PRINT '';
+    PRINT '==== ' + @table + ': ' + @label;
+
+    EXEC sp_executesql @query,
+        N'@month_start DATETIME2, @month_end DATETIME2, @cutoff DATETIME2',
+        @month_start, @month_end, @cutoff;
+
+    SET STATISTICS PROFILE ON;
+    SET STATISTICS IO ON;
+    SET STATISTICS TIME ON;
+    SET @started = SYSDATETIME();
+    EXEC sp_executesql @query,
+        N'@month_start DATETIME2, @month_end DATETIME2, @cutoff DATETIME2',
+        @month_start, @month_end, @cutoff;
+    SET STATISTICS TIME OFF;
+    SET STATISTICS IO OFF;
+    SET STATISTICS PROFILE OFF;
+
+    INSERT INTO @timings VALUES (@table, @position, @label,
+                                 DATEDIFF(MILLISECOND, @started, SYSDATETIME()));
+    FETCH NEXT FROM runs INTO @table, @position, @label, @query;
+END;
+CLOSE runs;
+DEALLOCATE runs;
+
+-- The elapsed time of each query in both layouts, side by side.
+SELECT label,
+       MAX(CASE WHEN layout = 'recording_original' THEN milliseconds END) AS original_ms,
+       MAX(CASE WHEN layout = 'recording_designed' THEN milliseconds END) AS designed_ms
+FROM @timings
+GROUP BY position, label
+ORDER BY position;
+
+DROP TABLE benchmark.recording_original;
+DROP TABLE benchmark.recording_designed;
+DROP PARTITION SCHEME ps_benchmark_recording_day;
+DROP PARTITION FUNCTION pf_benchmark_recording_day;
+EXEC('DROP SCHEMA benchmark');
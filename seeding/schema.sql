@@ -1,5 +1,15 @@
+DROP TABLE IF EXISTS alpha.transfer_checkpoint;
+DROP TABLE IF EXISTS alpha.alert_log;
+DROP TABLE IF EXISTS alpha.plant_threshold;
+DROP TABLE IF EXISTS alpha.plant_histogram;
+DROP TABLE IF EXISTS alpha.recording_hour;
+DROP TABLE IF EXISTS alpha.recording_minute;
 DROP TABLE IF EXISTS alpha.plant_average ; 
 DROP TABLE IF EXISTS alpha.recording;
+IF EXISTS (SELECT 1 FROM sys.partition_schemes WHERE name = 'ps_recording_day')
+    DROP PARTITION SCHEME ps_recording_day;
+IF EXISTS (SELECT 1 FROM sys.partition_functions WHERE name = 'pf_recording_day')
+    DROP PARTITION FUNCTION pf_recording_day;
 DROP TABLE IF EXISTS alpha.plant;
 DROP TABLE IF EXISTS alpha.botanist;
 DROP TABLE IF EXISTS alpha.location;
@@ -33,6 +43,13 @@ CREATE TABLE alpha.plant (
     FOREIGN KEY (location_id) REFERENCES alpha.location(location_id)
 );
 
+-- The recordings are partitioned by day, so the daily transfer can empty a whole
+-- archived day at once. The daily transfer adds the partitions for the coming days.
+CREATE PARTITION FUNCTION pf_recording_day (DATETIME2) AS RANGE RIGHT FOR VALUES ();
+CREATE PARTITION SCHEME ps_recording_day AS PARTITION pf_recording_day ALL TO ([PRIMARY]);
+
+-- Every index is partitioned the same way, which emptying a partition requires,
+-- so each unique index includes recording_taken.
 CREATE TABLE alpha.recording (
     recording_id BIGINT IDENTITY(1,1),
     plant_id SMALLINT NOT NULL,
@@ -40,7 +57,53 @@ CREATE TABLE alpha.recording (
     last_watered DATETIME2,
     soil_moisture FLOAT,
     temperature FLOAT,
-    PRIMARY KEY (recording_id),
+    PRIMARY KEY NONCLUSTERED (recording_id, recording_taken) ON ps_recording_day (recording_taken),
+    FOREIGN KEY (plant_id) REFERENCES alpha.plant(plant_id)
+) ON ps_recording_day (recording_taken);
+
+-- A plant only takes one reading at a time, so repeated loads can't duplicate it.
+-- The table is stored in this order, so each plant's readings over a time range
+-- (the dashboard, the rollups and the load's duplicate check) are one range seek.
+CREATE UNIQUE CLUSTERED INDEX uq_recording_plant_taken ON alpha.recording (plant_id, recording_taken)
+    ON ps_recording_day (recording_taken);
+
+-- The daily transfer finds, extracts and deletes old recordings by age.
+-- It covers the extract, so the old recordings are read without touching the table.
+CREATE INDEX ix_recording_taken ON alpha.recording (recording_taken)
+    INCLUDE (recording_id, last_watered, soil_moisture, temperature)
+    ON ps_recording_day (recording_taken);
+
+-- Each plant's readings summarised per minute and per hour as they are loaded,
+-- so the dashboard can chart them without reading the recordings.
+CREATE TABLE alpha.recording_minute (
+    plant_id SMALLINT NOT NULL,
+    bucket_start DATETIME2 NOT NULL,
+    recording_count INT NOT NULL,
+    temperature_count INT NOT NULL,
+    average_temperature FLOAT,
+    min_temperature FLOAT,
+    max_temperature FLOAT,
+    soil_moisture_count INT NOT NULL,
+    average_soil_moisture FLOAT,
+    min_soil_moisture FLOAT,
+    max_soil_moisture FLOAT,
+    PRIMARY KEY (plant_id, bucket_start),
+    FOREIGN KEY (plant_id) REFERENCES alpha.plant(plant_id)
+);
+
+CREATE TABLE alpha.recording_hour (
+    plant_id SMALLINT NOT NULL,
+    bucket_start DATETIME2 NOT NULL,
+    recording_count INT NOT NULL,
+    temperature_count INT NOT NULL,
+    average_temperature FLOAT,
+    min_temperature FLOAT,
+    max_temperature FLOAT,
+    soil_moisture_count INT NOT NULL,
+    average_soil_moisture FLOAT,
+    min_soil_moisture FLOAT,
+    max_soil_moisture FLOAT,
+    PRIMARY KEY (plant_id, bucket_start),
     FOREIGN KEY (plant_id) REFERENCES alpha.plant(plant_id)
 );
 
@@ -49,10 +112,67 @@ CREATE TABLE alpha.plant_average (
     average_temperature FLOAT NOT NULL DEFAULT 0.00,
     average_soil_moisture FLOAT NOT NULL DEFAULT 0.00,
     recording_count INT NOT NULL DEFAULT 0,
+    -- The readings of each metric, leaving out missing ones, which the averages are over.
+    temperature_count INT NOT NULL DEFAULT 0,
+    soil_moisture_count INT NOT NULL DEFAULT 0,
+    -- Sums of squared deviations from the average, so variance = m2 / <metric>_count.
+    temperature_m2 FLOAT NOT NULL DEFAULT 0.00,
+    soil_moisture_m2 FLOAT NOT NULL DEFAULT 0.00,
+    min_temperature FLOAT,
+    max_temperature FLOAT,
+    min_soil_moisture FLOAT,
+    max_soil_moisture FLOAT,
     PRIMARY KEY (plant_id),
     FOREIGN KEY (plant_id) REFERENCES alpha.plant(plant_id)
 );
 
+-- Counts of readings in fixed width bins, from which percentiles are estimated.
+CREATE TABLE alpha.plant_histogram (
+    plant_id SMALLINT NOT NULL,
+    metric VARCHAR(20) NOT NULL,
+    bin SMALLINT NOT NULL,
+    bin_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (plant_id, metric, bin),
+    FOREIGN KEY (plant_id) REFERENCES alpha.plant(plant_id),
+    CHECK (metric IN ('temperature', 'soil_moisture'))
+);
+
+CREATE TABLE alpha.plant_threshold (
+    plant_id SMALLINT NOT NULL,
+    metric VARCHAR(20) NOT NULL,
+    direction VARCHAR(10) NOT NULL,
+    threshold FLOAT NOT NULL,
+    PRIMARY KEY (plant_id, metric, direction),
+    FOREIGN KEY (plant_id) REFERENCES alpha.plant(plant_id),
+    CHECK (metric IN ('temperature', 'soil moisture')),
+    CHECK (direction IN ('exceeded', 'not met'))
+);
+
+-- When each alert was last emailed, so the cooldown holds across every ingest invocation.
+CREATE TABLE alpha.alert_log (
+    plant_id SMALLINT NOT NULL,
+    metric VARCHAR(20) NOT NULL,
+    direction VARCHAR(10) NOT NULL,
+    last_alerted DATETIME2 NOT NULL,
+    PRIMARY KEY (plant_id, metric, direction),
+    FOREIGN KEY (plant_id) REFERENCES alpha.plant(plant_id),
+    CHECK (metric IN ('temperature', 'soil moisture')),
+    CHECK (direction IN ('exceeded', 'not met'))
+);
+
+-- Each daily transfer run pins its cutoff and recording ids, and records the last stage it finished.
+CREATE TABLE alpha.transfer_checkpoint (
+    run_id VARCHAR(40) NOT NULL,
+    cutoff_time DATETIME2 NOT NULL,
+    first_recording_id BIGINT NOT NULL,
+    last_recording_id BIGINT NOT NULL,
+    stage VARCHAR(10) NOT NULL DEFAULT 'started',
+    started_at DATETIME2 NOT NULL DEFAULT SYSDATETIME(),
+    updated_at DATETIME2 NOT NULL DEFAULT SYSDATETIME(),
+    PRIMARY KEY (run_id),
+    CHECK (stage IN ('started', 'archived', 'averaged', 'deleted'))
+);
+
 INSERT INTO alpha.location (location_id, latitude, longitude, city_name, country_code) VALUES
 (1, -19.32556, -41.25528, 'Resplendor', 'BR'),
 (2, 33.95015, -118.03917, 'South Whittier', 'US'),
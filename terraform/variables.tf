@@ -58,4 +58,6 @@ variable "FROM_EMAIL" {
 
 variable "TO_EMAIL" {
   type = string
+  # Only needed while SES is in the sandbox; otherwise alerts go to each botanist.
+  default = ""
 }
\ No newline at end of file
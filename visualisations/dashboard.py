@@ -1,6 +1,12 @@
 """Streamlit dashboard."""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from math import ceil
 from os import environ as ENV
+from queue import LifoQueue, Empty, Full
+from time import monotonic
 
+import numpy as np
 import pymssql
 import pandas as pd
 import altair as alt
@@ -8,6 +14,26 @@ import streamlit as st
 from dotenv import load_dotenv
 
 
+# The plant, botanist and location details rarely change, so are cached for an hour.
+METADATA_TTL = 3600
+# Recordings arrive every minute, so the recent recordings are re-queried at most once a minute.
+RECORDING_TTL = 60
+# The most idle connections kept open for reuse across reruns and sessions.
+POOL_SIZE = 4
+# Idle connections older than this many seconds are checked before they are lent out,
+# as the database may have dropped them while the dashboard sat unused.
+POOL_HEALTHCHECK_SECONDS = 30
+# The charts cover the last 24 hours in at most this many points per plant,
+# however often the sensors report.
+CHART_HOURS = 24
+CHART_POINTS = 288
+# The histogram bins of each metric in alpha.plant_histogram, as (lowest edge, highest edge,
+# width), matching the data transfer pipeline. The typical range of a plant's readings
+# is drawn between these percentiles of its histogram.
+HISTOGRAM_BINS = {"temperature": (-20.0, 60.0, 1.0), "soil_moisture": (0.0, 100.0, 1.0)}
+TYPICAL_RANGE = (0.1, 0.9)
+
+
 def create_connection():
     """Returns a connection to connect to the database. """
     load_dotenv()
@@ -21,39 +47,166 @@ def create_connection():
     return conn
 
 
-def fetch_plant_data(plant_ids):
-    """Fetches plant recording data for selected plant IDs."""
-    conn = create_connection()
-    with conn.cursor() as cursor:
+def is_connection_healthy(conn) -> bool:
+    """Returns True if the connection can still run a query."""
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1 AS healthy")
+            cursor.fetchone()
+        return True
+    except (pymssql.Error, OSError):
+        return False
+
+
+def close_quietly(conn) -> None:
+    """Closes a connection that may already be broken."""
+    try:
+        conn.close()
+    except (pymssql.Error, OSError):
+        pass
+
+
+@st.cache_resource
+def get_connection_pool() -> LifoQueue:
+    """Returns the pool of idle connections shared by every session of the dashboard,
+    each kept with the time it was returned."""
+    return LifoQueue(maxsize=POOL_SIZE)
+
+
+def get_pooled_connection(pool: LifoQueue):
+    """Returns an idle connection from the pool, or a new one if there are none.
+    Connections idle for longer than POOL_HEALTHCHECK_SECONDS are checked first
+    and replaced if they have gone stale."""
+    while True:
+        try:
+            conn, released_at = pool.get_nowait()
+        except Empty:
+            return create_connection()
+
+        if monotonic() - released_at < POOL_HEALTHCHECK_SECONDS or is_connection_healthy(conn):
+            return conn
+        close_quietly(conn)
+
+
+@contextmanager
+def pooled_connection():
+    """
+    Lends a connection from the pool, opening a new one if none are idle, and returns
+    it to the pool afterwards. A connection that raised an error is closed instead,
+    as are any beyond the size of the pool.
+    """
+    pool = get_connection_pool()
+    conn = get_pooled_connection(pool)
+
+    try:
+        yield conn
+    except Exception:
+        close_quietly(conn)
+        raise
+
+    try:
+        pool.put_nowait((conn, monotonic()))
+    except Full:
+        conn.close()
+
+
+@st.cache_data(ttl=METADATA_TTL)
+def fetch_plant_metadata() -> pd.DataFrame:
+    """Fetches the details of every plant, its botanist and its origin in one query."""
+    with pooled_connection() as conn, conn.cursor() as cursor:
         cursor.execute("""
-            SELECT 
-                p.plant_id, 
-                p.plant_name, 
-                r.recording_taken, 
-                r.temperature, 
-                r.soil_moisture 
-            FROM 
-                alpha.plant p 
-            JOIN 
-                alpha.recording r ON p.plant_id = r.plant_id 
-            WHERE 
-                p.plant_id IN %s 
-            ORDER BY 
-                r.recording_taken ASC
-        """, (tuple(plant_ids),))
+            SELECT
+                p.plant_id,
+                p.plant_name,
+                p.scientific_name,
+                p.image_url,
+                l.city_name,
+                l.country_code,
+                l.latitude,
+                l.longitude,
+                b.botanist_name,
+                b.botanist_email,
+                b.botanist_phone_no
+            FROM
+                alpha.plant p
+            JOIN
+                alpha.location l ON p.location_id = l.location_id
+            JOIN
+                alpha.botanist b ON p.botanist_id = b.botanist_id
+        """)
+        metadata = cursor.fetchall()
+    return pd.DataFrame(metadata)
+
+
+def chart_bucket_minutes(hours: int = CHART_HOURS, points: int = CHART_POINTS) -> int:
+    """Returns the width in minutes of the time buckets that fit the hours into the points."""
+    return max(1, ceil(hours * 60 / points))
+
+
+def rollup_table(bucket_minutes: int) -> str:
+    """Returns the coarsest rollup table whose buckets fit evenly into the chart's buckets."""
+    return "alpha.recording_hour" if bucket_minutes % 60 == 0 else "alpha.recording_minute"
+
+
+@st.cache_data(ttl=RECORDING_TTL)
+def fetch_plant_data(plant_ids: tuple[int], bucket_minutes: int = None):
+    """
+    Fetches the readings from the last 24 hours for the selected plant IDs, as the mean,
+    min and max of each plant for every bucket_minutes (by default sized to CHART_POINTS),
+    so the charts stay the same size however many recordings there are.
+    They are combined in the database from the per minute or per hour rollups kept by the
+    ingest pipeline, so the recordings themselves are never read. Buckets line up on whole
+    multiples of the width, so they don't shift between refreshes.
+    Cached for a minute for each selection of plants.
+    """
+    bucket_minutes = bucket_minutes or chart_bucket_minutes()
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT
+                p.plant_id,
+                p.plant_name,
+                b.bucket AS recording_taken,
+                SUM(u.average_temperature * u.temperature_count)
+                    / NULLIF(SUM(u.temperature_count), 0) AS temperature,
+                MIN(u.min_temperature) AS min_temperature,
+                MAX(u.max_temperature) AS max_temperature,
+                SUM(u.average_soil_moisture * u.soil_moisture_count)
+                    / NULLIF(SUM(u.soil_moisture_count), 0) AS soil_moisture,
+                MIN(u.min_soil_moisture) AS min_soil_moisture,
+                MAX(u.max_soil_moisture) AS max_soil_moisture
+            FROM
+                alpha.plant p
+            JOIN
+                {rollup_table(bucket_minutes)} u ON p.plant_id = u.plant_id
+            CROSS APPLY
+                (SELECT DATEADD(MINUTE, DATEDIFF(MINUTE, 0, u.bucket_start) / %s * %s, 0)
+                 AS bucket) b
+            WHERE
+                p.plant_id IN %s
+                AND u.bucket_start >= %s
+            GROUP BY
+                p.plant_id, p.plant_name, b.bucket
+            ORDER BY
+                recording_taken ASC
+        """, (bucket_minutes, bucket_minutes, tuple(plant_ids),
+              datetime.now() - timedelta(hours=CHART_HOURS)))
         data = cursor.fetchall()
     return pd.DataFrame(data)
 
 
-def fetch_plant_averages(plant_ids):
-    """Fetches average temperature and soil moisture for selected plant IDs."""
-    conn = create_connection()
-    with conn.cursor() as cursor:
+@st.cache_data(ttl=METADATA_TTL)
+def fetch_plant_averages(plant_ids: tuple[int]):
+    """Fetches average temperature and soil moisture for selected plant IDs.
+    The averages only change once a day, so are cached for an hour for each selection."""
+    with pooled_connection() as conn, conn.cursor() as cursor:
         cursor.execute("""
             SELECT 
                 plant_id, 
                 average_temperature, 
-                average_soil_moisture 
+                average_soil_moisture,
+                SQRT(temperature_m2 / NULLIF(temperature_count, 0)) AS temperature_deviation,
+                SQRT(soil_moisture_m2 / NULLIF(soil_moisture_count, 0))
+                    AS soil_moisture_deviation
             FROM 
                 alpha.plant_average 
             WHERE 
@@ -63,6 +216,53 @@ def fetch_plant_averages(plant_ids):
     return pd.DataFrame(averages)
 
 
+def histogram_quantiles(histograms: pd.DataFrame, quantiles: list[float]) -> pd.DataFrame:
+    """
+    Returns an estimate of each quantile of each plant and metric from their histograms,
+    interpolating within the bin the quantile falls in. The estimate is accurate
+    to the bin width.
+    """
+    estimates = []
+    for (plant_id, metric), histogram in histograms.groupby(["plant_id", "metric"]):
+        lowest, _, width = HISTOGRAM_BINS[metric]
+        histogram = histogram.sort_values("bin")
+        cumulative = histogram["bin_count"].cumsum().to_numpy()
+        total = cumulative[-1]
+
+        for quantile in quantiles:
+            position = np.searchsorted(cumulative, quantile * total)
+            position = min(position, len(cumulative) - 1)
+            before = cumulative[position - 1] if position else 0
+            fraction = (quantile * total - before) / (cumulative[position] - before)
+            estimates.append({"plant_id": plant_id, "metric": metric, "quantile": quantile,
+                              "value": lowest + (histogram["bin"].iloc[position] + fraction)
+                              * width})
+
+    return pd.DataFrame(estimates, columns=["plant_id", "metric", "quantile", "value"])
+
+
+@st.cache_data(ttl=METADATA_TTL)
+def fetch_plant_percentiles(plant_ids: tuple[int]) -> pd.DataFrame:
+    """Fetches the histograms of the selected plant IDs and returns the TYPICAL_RANGE
+    percentiles of each metric. Like the averages, they only change once a day."""
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT
+                plant_id,
+                metric,
+                bin,
+                bin_count
+            FROM
+                alpha.plant_histogram
+            WHERE
+                plant_id IN %s
+        """, (tuple(plant_ids),))
+        histograms = cursor.fetchall()
+    return histogram_quantiles(
+        pd.DataFrame(histograms, columns=["plant_id", "metric", "bin", "bin_count"]),
+        list(TYPICAL_RANGE))
+
+
 def create_temp_chart(plant_data: pd.DataFrame) -> alt.Chart:
     """Returns a chart of temperature over time."""
     return alt.Chart(plant_data).mark_line().encode(
@@ -85,6 +285,37 @@ def create_temp_avg_chart(plant_data: pd.DataFrame, row: pd.Series) -> alt.Chart
     )
 
 
+def create_deviation_band(plant_data: pd.DataFrame, average: float,
+                          deviation: float) -> alt.Chart:
+    """Returns a shaded band one standard deviation either side of the all time average."""
+    return alt.Chart(pd.DataFrame({
+        'lower': [average - deviation],
+        'upper': [average + deviation],
+        'recording_taken': [plant_data['recording_taken'].min()]
+    })).mark_rect(color='red', opacity=0.1).encode(
+        y='lower:Q',
+        y2='upper:Q'
+    )
+
+
+def create_typical_range_rules(percentiles: pd.DataFrame, metric: str) -> alt.Chart:
+    """Returns dotted lines at the percentiles of the metric's all time readings."""
+    return alt.Chart(percentiles[percentiles['metric'] == metric]).mark_rule(
+        color='grey', strokeDash=[2, 4]).encode(
+        y='value:Q'
+    )
+
+
+def create_range_band(plant_data: pd.DataFrame, metric: str) -> alt.Chart:
+    """Returns a shaded band from the lowest to the highest reading in each time bucket."""
+    return alt.Chart(plant_data).mark_area(opacity=0.2).encode(
+        x='recording_taken:T',
+        y=f'min_{metric}:Q',
+        y2=f'max_{metric}:Q',
+        color='plant_name:N'
+    )
+
+
 def create_soil_moisture_chart(plant_data: pd.DataFrame) -> alt.Chart:
     """Returns a chart of soil moisture over time."""
     return alt.Chart(plant_data).mark_line().encode(
@@ -112,14 +343,10 @@ def display_dashboard():
     """Displays the dashboard."""
     st.title("Plant Recordings Dashboard")
 
-    conn = create_connection()
-    plant_query = "SELECT plant_id, plant_name FROM alpha.plant"
-    with conn.cursor() as cursor:
-        cursor.execute(plant_query)
-        res = cursor.fetchall()
+    if st.sidebar.button("Refresh plant details"):
+        fetch_plant_metadata.clear()
 
-    plant_df = pd.DataFrame(res)
-    conn.close()
+    plant_df = fetch_plant_metadata()
 
     selected_plants = st.multiselect(
         "Select Plants (Max 5)",
@@ -128,22 +355,34 @@ def display_dashboard():
         max_selections=5
     )
 
-    selected_plant_ids = plant_df[plant_df['plant_name'].isin(
-        selected_plants)]['plant_id'].tolist()
+    # Sorted so the same plants share a cache entry whatever order they were picked in.
+    selected_plant_ids = tuple(sorted(plant_df[plant_df['plant_name'].isin(
+        selected_plants)]['plant_id'].tolist()))
 
     if selected_plant_ids:
         plant_data = fetch_plant_data(selected_plant_ids)
         average_data = fetch_plant_averages(selected_plant_ids)
         row = average_data.iloc[0] if not average_data.empty else None
+        percentiles = (fetch_plant_percentiles(selected_plant_ids)
+                       if len(selected_plant_ids) == 1 else None)
 
-        temp_chart = create_temp_chart(plant_data)
+        temp_chart = create_range_band(plant_data, 'temperature') + create_temp_chart(plant_data)
         if len(selected_plant_ids) == 1 and row is not None:
-            temp_chart += create_temp_avg_chart(plant_data, row)
+            temp_chart = (create_deviation_band(plant_data, row['average_temperature'],
+                                                row['temperature_deviation'])
+                          + temp_chart + create_temp_avg_chart(plant_data, row))
+        if percentiles is not None and not percentiles.empty:
+            temp_chart += create_typical_range_rules(percentiles, 'temperature')
 
-        moisture_chart = create_soil_moisture_chart(plant_data)
+        moisture_chart = (create_range_band(plant_data, 'soil_moisture')
+                          + create_soil_moisture_chart(plant_data))
 
         if len(selected_plant_ids) == 1 and row is not None:
-            moisture_chart += create_soil_moisture_avg_chart(plant_data, row)
+            moisture_chart = (create_deviation_band(plant_data, row['average_soil_moisture'],
+                                                    row['soil_moisture_deviation'])
+                              + moisture_chart + create_soil_moisture_avg_chart(plant_data, row))
+        if percentiles is not None and not percentiles.empty:
+            moisture_chart += create_typical_range_rules(percentiles, 'soil_moisture')
 
         st.altair_chart(temp_chart, use_container_width=True)
         st.altair_chart(moisture_chart, use_container_width=True)
@@ -152,42 +391,13 @@ def display_dashboard():
             "Select a Plant for More Info", options=plant_df['plant_name'].tolist())
 
         if selected_plant_info:
-            plant_info = plant_df[plant_df['plant_name']
-                                  == selected_plant_info].iloc[0]
-            plant_id = int(plant_info['plant_id'])
-
-            location_query = """
-                SELECT 
-                    l.city_name, 
-                    l.country_code,
-                    l.latitude,
-                    l.longitude, 
-                    b.botanist_name, 
-                    b.botanist_email,
-                    b.botanist_phone_no,
-                    p.scientific_name,
-                    p.image_url
-                FROM 
-                    alpha.plant p 
-                JOIN 
-                    alpha.location l ON p.location_id = l.location_id 
-                JOIN 
-                    alpha.botanist b ON p.botanist_id = b.botanist_id 
-                WHERE 
-                    p.plant_id = %s
-            """
-            conn = create_connection()
-            try:
-                with conn.cursor() as cursor:
-                    cursor.execute(location_query, (plant_id,))
-                    info = cursor.fetchone()
-            finally:
-                conn.close()
-
-            if info:
+            matches = plant_df[plant_df['plant_name'] == selected_plant_info]
+            info = matches.iloc[0] if not matches.empty else None
+
+            if info is not None:
                 col1, col2 = st.columns([1, 3])
 
-                if info['image_url']:
+                if pd.notna(info['image_url']) and info['image_url']:
                     with col1:
                         st.image(info['image_url'],
                                  caption="Scientific Image", use_column_width=True)
@@ -2,16 +2,113 @@
 
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
+import numpy as np
 import pandas as pd
+import pymssql
 import altair as alt
-from dashboard import (fetch_plant_data, fetch_plant_averages, create_temp_chart,
+from dashboard import (get_connection_pool, pooled_connection, fetch_plant_metadata,
+                       fetch_plant_data, fetch_plant_averages, chart_bucket_minutes,
+                       create_temp_chart, create_range_band,
                        create_temp_avg_chart, create_soil_moisture_chart,
-                       create_soil_moisture_avg_chart, display_dashboard)
+                       create_soil_moisture_avg_chart, create_deviation_band,
+                       histogram_quantiles, fetch_plant_percentiles,
+                       create_typical_range_rules, display_dashboard,
+                       POOL_HEALTHCHECK_SECONDS)
+
+
+class TestPooledConnection(TestCase):
+    """Tests for the pooled connection context manager."""
+
+    def setUp(self):
+        get_connection_pool.clear()
+
+    @patch("dashboard.create_connection")
+    def test_pooled_connection_reused(self, fake_create_connection):
+        """Test that a returned connection is lent out again rather than reopened."""
+        with pooled_connection() as first:
+            pass
+        with pooled_connection() as second:
+            pass
+
+        fake_create_connection.assert_called_once()
+        self.assertIs(first, second)
+        first.close.assert_not_called()
+
+    @patch("dashboard.create_connection")
+    def test_pooled_connection_closed_on_error(self, fake_create_connection):
+        """Test that a connection which raised an error is closed, not returned to the pool."""
+        with self.assertRaises(ValueError):
+            with pooled_connection():
+                raise ValueError("Connection lost")
+
+        fake_create_connection.return_value.close.assert_called_once()
+        self.assertTrue(get_connection_pool().empty())
+
+    @patch("dashboard.monotonic")
+    @patch("dashboard.create_connection")
+    def test_stale_connection_replaced(self, fake_create_connection, fake_monotonic):
+        """Test that a connection idle for too long is checked, and replaced if it is dead."""
+        stale_conn, fresh_conn = MagicMock(), MagicMock()
+        stale_conn.cursor.return_value.__enter__.return_value.execute.side_effect = \
+            pymssql.OperationalError("Connection reset")
+        fake_create_connection.side_effect = [stale_conn, fresh_conn]
+
+        fake_monotonic.return_value = 0
+        with pooled_connection():
+            pass
+        fake_monotonic.return_value = POOL_HEALTHCHECK_SECONDS + 1
+        with pooled_connection() as conn:
+            self.assertIs(conn, fresh_conn)
+
+        stale_conn.close.assert_called_once()
+
+    @patch("dashboard.monotonic")
+    @patch("dashboard.create_connection")
+    def test_recent_connection_not_checked(self, fake_create_connection, fake_monotonic):
+        """Test that a connection returned recently is lent out without a health check."""
+        fake_monotonic.return_value = 0
+        with pooled_connection():
+            pass
+        fake_monotonic.return_value = POOL_HEALTHCHECK_SECONDS - 1
+        with pooled_connection():
+            pass
+
+        fake_create_connection.return_value.cursor.assert_not_called()
+
+
+class TestFetchPlantMetadata(TestCase):
+    """Tests for the fetch plant metadata function."""
+
+    def setUp(self):
+        get_connection_pool.clear()
+        fetch_plant_metadata.clear()
+
+    @patch("dashboard.create_connection")
+    def test_fetch_plant_metadata_cached(self, fake_create_connection):
+        """Test that the plant details are fetched once and then served from the cache."""
+        fake_conn = MagicMock()
+        fake_cursor = MagicMock()
+        fake_conn.cursor.return_value.__enter__.return_value = fake_cursor
+        fake_create_connection.return_value = fake_conn
+
+        fake_cursor.fetchall.return_value = [{"plant_id": 1, "plant_name": "Rose",
+                                              "botanist_name": "Dr. Green"}]
+
+        fetch_plant_metadata()
+        result_df = fetch_plant_metadata()
+
+        fake_cursor.execute.assert_called_once()
+        fake_conn.close.assert_not_called()
+        self.assertEqual(result_df.iloc[0]["botanist_name"], "Dr. Green")
 
 
 class TestFetchPlantData(TestCase):
     """Tests for the fetch plant data function."""
 
+    def setUp(self):
+        get_connection_pool.clear()
+        fetch_plant_data.clear()
+
     @patch("dashboard.create_connection")
     def test_fetch_plant_data(self, fake_create_connection):
         """Test fetching plant data from the database."""
@@ -25,17 +122,66 @@ class TestFetchPlantData(TestCase):
                                               "recording_taken": "2023-01-01 12:00:00",
                                               "temperature": 20, "soil_moisture": 50}]
 
-        plant_ids = [1, 2]
+        plant_ids = (1, 2)
         result_df = fetch_plant_data(plant_ids)
 
         fake_cursor.execute.assert_called_once()
         self.assertIsInstance(result_df, pd.DataFrame)
         self.assertEqual(result_df.iloc[0]["plant_name"], "Rose")
 
+    @patch("dashboard.create_connection")
+    def test_fetch_plant_data_downsampled(self, fake_create_connection):
+        """Test the recordings are grouped into time buckets of the given width."""
+        fake_cursor = MagicMock()
+        fake_create_connection.return_value.cursor.return_value.__enter__.return_value = \
+            fake_cursor
+        fake_cursor.fetchall.return_value = []
+
+        fetch_plant_data((1,), bucket_minutes=10)
+
+        query, params = fake_cursor.execute.call_args.args
+        self.assertIn("GROUP BY", query)
+        self.assertIn("JOIN\n                alpha.recording_minute u", query)
+        self.assertIn("MAX(u.max_temperature) AS max_temperature", query)
+        self.assertNotIn("alpha.recording r", query)
+        self.assertEqual(params[:3], (10, 10, (1,)))
+
+    @patch("dashboard.create_connection")
+    def test_fetch_plant_data_hourly_rollups(self, fake_create_connection):
+        """Test that buckets of whole hours are combined from the hourly rollups."""
+        fake_cursor = MagicMock()
+        fake_create_connection.return_value.cursor.return_value.__enter__.return_value = \
+            fake_cursor
+        fake_cursor.fetchall.return_value = []
+
+        fetch_plant_data((1,), bucket_minutes=120)
+
+        self.assertIn("alpha.recording_hour u", fake_cursor.execute.call_args.args[0])
+
+    @patch("dashboard.create_connection")
+    def test_fetch_plant_data_cached_per_selection(self, fake_create_connection):
+        """Test that each selection of plants is queried once, over one shared connection."""
+        fake_cursor = MagicMock()
+        fake_create_connection.return_value.cursor.return_value.__enter__.return_value = \
+            fake_cursor
+        fake_cursor.fetchall.return_value = [{"plant_id": 1, "temperature": 20}]
+
+        fetch_plant_data((1, 2))
+        fetch_plant_data((1, 2))
+        fetch_plant_data((3,))
+
+        self.assertEqual([call.args[1][2] for call in fake_cursor.execute.call_args_list],
+                         [(1, 2), (3,)])
+        fake_create_connection.assert_called_once()
+
 
 class TestFetchPlantAverages(TestCase):
     """Tests for the fetch plant averages function."""
 
+    def setUp(self):
+        get_connection_pool.clear()
+        fetch_plant_averages.clear()
+
     @patch("dashboard.create_connection")
     def test_fetch_plant_averages(self, fake_create_connection):
         """Test fetching plant averages from the database."""
@@ -48,7 +194,7 @@ class TestFetchPlantAverages(TestCase):
                                               "average_temperature": 20.5,
                                               "average_soil_moisture": 55}]
 
-        plant_ids = [1]
+        plant_ids = (1,)
         result_df = fetch_plant_averages(plant_ids)
 
         fake_cursor.execute.assert_called_once()
@@ -56,6 +202,87 @@ class TestFetchPlantAverages(TestCase):
         self.assertEqual(result_df.iloc[0]["average_temperature"], 20.5)
 
 
+class TestHistogramQuantiles(TestCase):
+    """Tests for the histogram quantiles function."""
+
+    def test_histogram_quantiles(self):
+        """Test the estimates are within a bin width of the exact quantiles."""
+        rng = np.random.default_rng(7)
+        readings = {"temperature": rng.normal(20, 5, 50_000),
+                    "soil_moisture": rng.uniform(0, 100, 50_000)}
+        histograms = pd.concat([
+            pd.DataFrame({"plant_id": 1, "metric": metric,
+                          "bin": np.floor(values.clip(lowest, highest - 0.5) - lowest)
+                          .astype(int)}).groupby(["plant_id", "metric", "bin"])
+            .size().rename("bin_count").reset_index()
+            for (metric, values), (lowest, highest) in zip(
+                readings.items(), [(-20.0, 60.0), (0.0, 100.0)])])
+
+        estimates = histogram_quantiles(histograms, [0.05, 0.5, 0.95])
+
+        self.assertEqual(len(estimates), 6)
+        for row in estimates.itertuples():
+            exact = np.quantile(readings[row.metric], row.quantile)
+            self.assertLess(abs(row.value - exact), 0.5)
+
+    def test_histogram_quantiles_no_histograms(self):
+        """Test a plant without a histogram has no estimates."""
+        histograms = pd.DataFrame(columns=["plant_id", "metric", "bin", "bin_count"])
+
+        self.assertTrue(histogram_quantiles(histograms, [0.1, 0.9]).empty)
+
+
+class TestFetchPlantPercentiles(TestCase):
+    """Tests for the fetch plant percentiles function."""
+
+    def setUp(self):
+        get_connection_pool.clear()
+        fetch_plant_percentiles.clear()
+
+    @patch("dashboard.create_connection")
+    def test_fetch_plant_percentiles(self, fake_create_connection):
+        """Test the typical range is estimated from the plant's histogram."""
+        fake_conn = MagicMock()
+        fake_cursor = MagicMock()
+        fake_conn.cursor.return_value.__enter__.return_value = fake_cursor
+        fake_create_connection.return_value = fake_conn
+
+        fake_cursor.fetchall.return_value = [
+            {"plant_id": 1, "metric": "temperature", "bin": 40, "bin_count": 5},
+            {"plant_id": 1, "metric": "temperature", "bin": 41, "bin_count": 5}]
+
+        result_df = fetch_plant_percentiles((1,))
+
+        fake_cursor.execute.assert_called_once()
+        self.assertIn("alpha.plant_histogram", fake_cursor.execute.call_args[0][0])
+        self.assertEqual(result_df["quantile"].tolist(), [0.1, 0.9])
+        self.assertEqual([round(value, 1) for value in result_df["value"]], [20.2, 21.8])
+
+
+class TestChartBucketMinutes(TestCase):
+    """Tests for the chart bucket minutes function."""
+
+    def test_chart_bucket_minutes(self):
+        """Test the bucket width keeps the points per plant within the limit."""
+        self.assertEqual(chart_bucket_minutes(24, 288), 5)
+        self.assertEqual(chart_bucket_minutes(24, 500), 3)
+        self.assertEqual(chart_bucket_minutes(1, 500), 1)
+
+
+class TestCreateRangeBand(TestCase):
+    """Tests for the create range band function."""
+
+    def test_create_range_band(self):
+        """Test the band spans the lowest to highest reading of each bucket."""
+        plant_data = pd.DataFrame({"plant_name": ["Rose"],
+                                   "recording_taken": ["2023-01-01 12:00:00"],
+                                   "min_temperature": [19], "max_temperature": [22]})
+
+        chart = create_range_band(plant_data, "temperature")
+        self.assertIsInstance(chart, alt.Chart)
+        self.assertEqual(chart.encoding.y2.shorthand, "max_temperature:Q")
+
+
 class TestCreateTempChart(TestCase):
     """Tests for the create temp chart function."""
 
@@ -82,6 +309,35 @@ class TestCreateTempAvgChart(TestCase):
         self.assertIsInstance(chart, alt.Chart)
 
 
+class TestCreateDeviationBand(TestCase):
+    """Tests for the create deviation band function."""
+
+    def test_create_deviation_band(self):
+        """Test the band spans one deviation either side of the average."""
+        plant_data = pd.DataFrame({"recording_taken": ["2023-01-01 12:00:00"],
+                                   "temperature": [20]})
+
+        chart = create_deviation_band(plant_data, 21, 2)
+        self.assertIsInstance(chart, alt.Chart)
+        self.assertEqual(chart.data[["lower", "upper"]].iloc[0].tolist(), [19, 23])
+
+
+class TestCreateTypicalRangeRules(TestCase):
+    """Tests for the create typical range rules function."""
+
+    def test_create_typical_range_rules(self):
+        """Test only the percentiles of the chart's metric are drawn."""
+        percentiles = pd.DataFrame({"plant_id": [1, 1, 1, 1],
+                                    "metric": ["temperature", "temperature",
+                                               "soil_moisture", "soil_moisture"],
+                                    "quantile": [0.1, 0.9, 0.1, 0.9],
+                                    "value": [18.0, 24.0, 40.0, 70.0]})
+
+        chart = create_typical_range_rules(percentiles, 'soil_moisture')
+        self.assertIsInstance(chart, alt.Chart)
+        self.assertEqual(chart.data["value"].tolist(), [40.0, 70.0])
+
+
 class TestCreateSoilMoistureChart(TestCase):
     """Tests for the create soil moisture chart function."""
 
@@ -113,31 +369,41 @@ class TestDisplayDashboard(TestCase):
 
     @patch("dashboard.st")
     @patch("dashboard.fetch_plant_data")
+    @patch("dashboard.fetch_plant_percentiles")
     @patch("dashboard.fetch_plant_averages")
-    @patch("dashboard.create_connection")
-    def test_display_dashboard(self, fake_create_connection, fake_fetch_plant_data,
-                               fake_fetch_plant_averages, fake_st):
+    @patch("dashboard.fetch_plant_metadata")
+    def test_display_dashboard(self, fake_fetch_plant_metadata, fake_fetch_plant_averages,
+                               fake_fetch_plant_percentiles, fake_fetch_plant_data, fake_st):
         """Test display dashboard logic."""
-        fake_conn = MagicMock()
-        fake_create_connection.return_value = fake_conn
-
-        plant_data_mock = [{"plant_id": 1, "plant_name": "Rose"}]
-
-        fake_conn.cursor.return_value.__enter__.return_value.fetchall.return_value = plant_data_mock
+        fake_fetch_plant_metadata.return_value = pd.DataFrame({
+            "plant_id": [1], "plant_name": ["Rose"], "scientific_name": ["Rosa"],
+            "image_url": [None], "city_name": ["Split"], "country_code": ["HR"],
+            "latitude": [43.5], "longitude": [16.4], "botanist_name": ["Dr. Green"],
+            "botanist_email": ["green@example.com"], "botanist_phone_no": ["123"]})
 
         fake_fetch_plant_data.return_value = pd.DataFrame({"plant_id": [1],
                                                            "plant_name": ["Rose"],
                                                            "recording_taken": ["2023-01-01 12:00:00"],
                                                            "temperature": [20],
+                                                           "min_temperature": [19],
+                                                           "max_temperature": [21],
                                                            "soil_moisture": [50],
+                                                           "min_soil_moisture": [49],
+                                                           "max_soil_moisture": [51],
                                                            "average_temperature": [18],
                                                            "average_soil_moisture": [55]})
 
         fake_fetch_plant_averages.return_value = pd.DataFrame({"plant_id": [1],
                                                                "average_temperature": [21],
                                                                "average_soil_moisture": [55],
+                                                               "temperature_deviation": [2],
+                                                               "soil_moisture_deviation": [5],
                                                                "recording_taken": ["2023-01-01 12:00:00"]})
 
+        fake_fetch_plant_percentiles.return_value = pd.DataFrame({
+            "plant_id": [1, 1], "metric": ["temperature", "temperature"],
+            "quantile": [0.1, 0.9], "value": [18.0, 24.0]})
+
         fake_st.multiselect.return_value = ["Rose"]
         fake_st.selectbox.return_value = "Rose"
         fake_st.columns.return_value = MagicMock(), MagicMock()
@@ -150,3 +416,7 @@ class TestDisplayDashboard(TestCase):
                                                     options=["Rose"],
                                                     default=["Venus Flytrap"],
                                                     max_selections=5)
+        fake_fetch_plant_metadata.assert_called_once()
+        fake_fetch_plant_data.assert_called_once_with((1,))
+        fake_fetch_plant_percentiles.assert_called_once_with((1,))
+        fake_st.write.assert_any_call("**Botanist:** Dr. Green")